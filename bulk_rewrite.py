@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Bulk rewrite of exported posts through LLMService.
+
+Input JSONL:  {"id": "...", "text": "...", "entities": [...]}   (id defaults to line number)
+Output JSONL: {"id": "...", "text": "...", "entities": [...]}  or  {"id": "...", "error": "..."}
+
+Results are appended as soon as they are ready. On start, ids already present
+in the output without an error are skipped, so an interrupted run resumes
+without paying again for finished posts. Failed posts are retried on the next run.
+
+Usage:
+    python bulk_rewrite.py export.jsonl rewritten.jsonl --concurrency 4 --rpm 60
+    python bulk_rewrite.py export.jsonl rewritten.jsonl --backend batch --gcs-prefix gs://bucket/bulk
+    python bulk_rewrite.py export.jsonl rewritten.jsonl --stub          # offline stand-in, no Vertex calls
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from itertools import islice
+
+from google.genai import types
+
+from config import load_config
+from services.llm import LLMService, REWRITE_INSTRUCTION, current_profile
+from services.stub import StubClient
+from utils.ratelimit import RateLimiter
+from utils.text import final_fix_entities
+from utils import trace
+
+_log = logging.getLogger("bulk")
+
+BATCH_DONE_STATES = {
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+}
+
+
+# --- INPUT / OUTPUT ---
+
+def load_done(output_path: str) -> set[str]:
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line of an interrupted run
+            if "error" not in record:
+                done.add(str(record["id"]))
+    return done
+
+
+def load_submitted(state_path: str) -> set[str]:
+    """Ids of the checkpointed batch job: its results come from the job, not a new submission."""
+    if not os.path.exists(state_path):
+        return set()
+    with open(state_path, encoding="utf-8") as f:
+        return {str(item["id"]) for item in json.load(f)["items"].values()}
+
+
+def iter_posts(input_path: str, done: set[str]):
+    """Stream (id, text, entities) from the export, skipping finished ids."""
+    with open(input_path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            post_id = str(record.get("id", line_no))
+            if post_id in done or not record.get("text"):
+                continue
+            yield post_id, record["text"], record.get("entities") or []
+
+
+class OutputWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf-8")
+        self.ok = 0
+        self.failed = 0
+
+    def write(self, post_id: str, text: str | None = None, entities: list | None = None, error: str | None = None):
+        record = {"id": post_id, "error": error} if error else {"id": post_id, "text": text, "entities": entities}
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()  # every finished post is durable, this is the checkpoint
+        if error:
+            self.failed += 1
+        else:
+            self.ok += 1
+
+    def close(self):
+        self.file.close()
+
+
+# --- ONLINE BACKEND ---
+
+async def run_online(llm: LLMService, posts, writer: OutputWriter, concurrency: int, rpm: float,
+                     profile: str | None = None):
+    limiter = RateLimiter(rpm, burst=concurrency)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def rewrite_one(post_id: str, text: str, entities: list):
+        try:
+            await limiter.acquire()
+            with trace.start_trace(f"bulk:{post_id}"):
+                result = await llm.rewrite(text, entities=entities, purpose="bulk", profile=profile)
+            writer.write(post_id, *final_fix_entities(result.text, result.entities))
+        except Exception as e:
+            _log.error(f"[BULK] {post_id} failed: {e}")
+            writer.write(post_id, error=str(e))
+        finally:
+            slots.release()
+
+    tasks = set()
+    for post_id, text, entities in posts:
+        # Backpressure: never read further ahead than `concurrency` posts
+        await slots.acquire()
+        task = asyncio.create_task(rewrite_one(post_id, text, entities))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+# --- BATCH BACKENDS ---
+
+class VertexBatchBackend:
+    """Vertex AI batch prediction: requests file on GCS -> predictions on GCS."""
+
+    def __init__(self, llm: LLMService, gcs_prefix: str, poll_interval: float = 30.0):
+        from google.cloud import storage  # only needed for this backend
+        self.llm = llm
+        self.gcs_prefix = gcs_prefix.rstrip("/")
+        self.poll_interval = poll_interval
+        self.storage = storage.Client()
+
+    def _upload(self, uri: str, lines: list[str]):
+        bucket, _, path = uri.removeprefix("gs://").partition("/")
+        self.storage.bucket(bucket).blob(path).upload_from_string("\n".join(lines), content_type="application/jsonl")
+
+    def _download(self, prefix_uri: str) -> list[dict]:
+        bucket, _, prefix = prefix_uri.removeprefix("gs://").partition("/")
+        rows = []
+        for blob in self.storage.list_blobs(bucket, prefix=prefix):
+            if blob.name.endswith(".jsonl"):
+                rows.extend(json.loads(line) for line in blob.download_as_text().splitlines() if line.strip())
+        return rows
+
+    async def submit(self, requests: list[dict], name: str) -> str:
+        src = f"{self.gcs_prefix}/{name}/requests.jsonl"
+        await asyncio.to_thread(self._upload, src, [json.dumps(r, ensure_ascii=False) for r in requests])
+        job = await self.llm.client.aio.batches.create(
+            model=self.llm.model_name,
+            src=src,
+            config=types.CreateBatchJobConfig(display_name=name, dest=f"{self.gcs_prefix}/{name}/out"),
+        )
+        return job.name
+
+    async def results(self, job_name: str) -> list[dict]:
+        while True:
+            job = await self.llm.client.aio.batches.get(name=job_name)
+            if job.state in BATCH_DONE_STATES:
+                break
+            _log.info(f"[BULK] Batch {job_name}: {job.state}")
+            await asyncio.sleep(self.poll_interval)
+        if job.state not in (types.JobState.JOB_STATE_SUCCEEDED, types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED):
+            raise RuntimeError(f"Batch job {job_name} ended with {job.state}: {job.error}")
+        return await asyncio.to_thread(self._download, job.dest.gcs_uri)
+
+
+class LocalBatchBackend:
+    """Stand-in for VertexBatchBackend: runs the same request lines through
+    llm.client locally and returns rows in the batch prediction format."""
+
+    def __init__(self, llm: LLMService, workdir: str, concurrency: int = 8):
+        self.llm = llm
+        self.workdir = workdir
+        self.concurrency = concurrency
+
+    async def submit(self, requests: list[dict], name: str) -> str:
+        # The "job" is the requests file itself, so it survives a restart like a real one
+        path = os.path.join(self.workdir, f"{name}.requests.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in requests)
+        return path
+
+    async def results(self, job_name: str) -> list[dict]:
+        with open(job_name, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def predict(row: dict) -> dict:
+            request = row["request"]
+            async with slots:
+                response = await self.llm.client.aio.models.generate_content(
+                    model=self.llm.model_name,
+                    contents=request["contents"][0]["parts"][0]["text"],
+                    config=types.GenerateContentConfig.model_validate(request.get("generationConfig", {})),
+                )
+            return {"request": request, "response": response.model_dump(mode="json", by_alias=True, exclude_none=True)}
+
+        predictions = await asyncio.gather(*(predict(row) for row in rows))
+        os.remove(job_name)
+        return predictions
+
+
+def _prediction_text(row: dict) -> str:
+    candidates = (row.get("response") or {}).get("candidates") or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(p.get("text", "") for p in parts if not p.get("thought")).strip()
+
+
+async def run_batch(llm: LLMService, backend, posts, writer: OutputWriter, state_path: str, batch_size: int,
+                    profile: str | None = None):
+    """Submit posts in batches; the submitted job is checkpointed in state_path
+    so a restart waits for it instead of submitting (and paying) again
+    (`posts` must skip its ids, see load_submitted)."""
+    # Same thinking budget, temperature and output cap as an online bulk rewrite
+    current_profile.set(llm.profile("bulk", profile))
+    while True:
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            _log.info(f"[BULK] Resuming batch job {state['job']} ({len(state['items'])} posts)")
+        else:
+            chunk = list(islice(posts, batch_size))
+            if not chunk:
+                return
+            items, requests = {}, []
+            for i, (post_id, text, entities) in enumerate(chunk):
+                key = f"k{i}"
+                text_safe, links = llm._extract_all_links(text, entities)
+                items[key] = {"id": post_id, "links": links}
+                generation_config = llm._request_config(llm.model_name, llm._output_budget(text_safe))
+                requests.append({
+                    "request": {
+                        "contents": [{"role": "user", "parts": [{"text": llm._build_prompt(REWRITE_INSTRUCTION, text_safe)}]}],
+                        "generationConfig": generation_config.model_dump(mode="json", by_alias=True, exclude_none=True),
+                        "labels": {"bulk_key": key},
+                    }
+                })
+            job = await backend.submit(requests, f"bulk-{time.time_ns()}")
+            state = {"job": job, "items": items}
+            with open(state_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            _log.info(f"[BULK] Submitted batch job {job} ({len(items)} posts)")
+
+        items = state["items"]
+        for row in await backend.results(state["job"]):
+            key = row.get("request", {}).get("labels", {}).get("bulk_key")
+            item = items.pop(key, None)
+            if item is None:
+                continue
+            usage = (row.get("response") or {}).get("usageMetadata")
+            if usage:
+                llm.usage.record(
+                    llm.model_name, types.GenerateContentResponseUsageMetadata.model_validate(usage), purpose="bulk"
+                )
+            raw = _prediction_text(row)
+            if not raw:
+                writer.write(item["id"], error=row.get("status") or "empty prediction")
+                continue
+            text, entities = llm._finalize(raw, item["links"])
+            writer.write(item["id"], *final_fix_entities(text, entities))
+        for item in items.values():
+            writer.write(item["id"], error="missing in batch output")
+        os.remove(state_path)
+
+
+# --- CLI ---
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk rewrite of exported posts")
+    parser.add_argument("input", help="JSONL export: id, text, entities")
+    parser.add_argument("output", help="JSONL results (appended, doubles as checkpoint)")
+    parser.add_argument("--backend", choices=("online", "batch"), default="online")
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel LLM calls (online)")
+    parser.add_argument("--rpm", type=float, default=60, help="requests per minute, 0 = unlimited (online)")
+    parser.add_argument("--gcs-prefix", help="gs://bucket/path for batch input/output")
+    parser.add_argument("--batch-size", type=int, default=1000, help="posts per batch job")
+    parser.add_argument("--profile", help="latency profile (default: LLM_PROFILE_BULK)")
+    parser.add_argument("--stub", action="store_true", help="offline stand-in client instead of Vertex AI")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stdout)
+    _log.setLevel(logging.INFO)
+
+    if args.stub:
+        os.environ.setdefault("VERTEX_PROJECT_ID", "offline")
+        os.environ.setdefault("VERTEX_LOCATION", "offline")
+    config = load_config(for_bot=False)
+    if args.profile and args.profile not in config.llm_profiles:
+        parser.error(f"unknown profile {args.profile}, known: {', '.join(config.llm_profiles)}")
+    llm = LLMService(config, client=StubClient() if args.stub else None)
+    llm.usage.start()
+    # Everything here is background work; --concurrency is the only limit that matters
+    llm.scheduler.concurrency = max(1, args.concurrency)
+
+    state_path = f"{args.output}.batch.json"
+    done = load_done(args.output)
+    _log.info(f"[BULK] {len(done)} post(s) already done, skipping")
+    if args.backend == "batch":
+        # Posts of an unfinished batch job are written when it is resumed, not submitted again
+        done |= load_submitted(state_path)
+    posts = iter_posts(args.input, done)
+    writer = OutputWriter(args.output)
+    started = time.monotonic()
+    try:
+        if args.backend == "online":
+            await run_online(llm, posts, writer, args.concurrency, args.rpm, args.profile)
+        else:
+            if args.stub:
+                backend = LocalBatchBackend(llm, os.path.dirname(os.path.abspath(args.output)), args.concurrency)
+            elif args.gcs_prefix:
+                backend = VertexBatchBackend(llm, args.gcs_prefix)
+            else:
+                parser.error("--backend batch needs --gcs-prefix (or --stub)")
+            await run_batch(llm, backend, posts, writer, state_path, args.batch_size, args.profile)
+    finally:
+        writer.close()
+        await llm.close()
+    _log.info(f"[BULK] Done in {time.monotonic() - started:.1f}s: ok={writer.ok}, failed={writer.failed}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -12,15 +12,93 @@ _log = logging.getLogger(__name__)
 class Channel:
     name: str
     channel_id: str
+    profiles: dict[str, str] = field(default_factory=dict)  # Action -> latency profile for posts to this channel
+
+@dataclass
+class LatencyProfile:
+    name: str
+    thinking_budget: int | None  # Hidden thinking tokens per call; None = model decides, 0 = off where allowed
+    max_output_tokens: int  # Cap on the computed output budget
+    temperature: float
+
+# Built-in profiles; LLM_PROFILES can change them or add new ones. "quality" is the old fixed setup
+DEFAULT_PROFILES = {
+    "fast": LatencyProfile("fast", thinking_budget=0, max_output_tokens=2048, temperature=0.6),
+    "balanced": LatencyProfile("balanced", thinking_budget=1024, max_output_tokens=4096, temperature=0.7),
+    "quality": LatencyProfile("quality", thinking_budget=None, max_output_tokens=8192, temperature=0.7),
+}
+# Actions a profile is chosen for
+PROFILE_ACTIONS = ("draft", "regenerate", "bulk")
+
+@dataclass
+class Editor:
+    user_id: int
+    name: str
+    channels: list[Channel]  # Channels this editor may publish to
+    llm_concurrency: int = 2  # LLM calls in flight for this editor at once (0 = no own limit)
+    daily_token_budget: int = 0  # 0 = unlimited
 
 @dataclass
 class Config:
     bot_token: str
-    admin_id: int
+    admin_id: int  # Owner: /trace and /validation, always an editor
     channels: list[Channel]
     vertex_project_id: str
     vertex_location: str
     vertex_model: str = "gemini-2.5-pro"  # Default model
+    vertex_fast_model: str = "gemini-2.5-flash"  # First tier for short posts ("" disables)
+    route_fast_max_chars: int = 1500  # Posts up to this length try the fast model first
+    route_fast_max_links: int = 3  # ...and with at most this many links
+    llm_min_paragraphs: int = 1
+    llm_max_paragraphs: int = 6
+    llm_retry_budget: int = 2  # Corrective retries when an answer breaks hard rules
+    llm_retry_deadline: float = 90.0  # No new retry after this many seconds
+    llm_retry_temperature_step: float = 0.25  # Temperature drop per retry
+    long_post_threshold: int = 2500  # Longer posts are rewritten in parallel chunks
+    long_post_chunk_chars: int = 1200  # Target chunk size (split at paragraphs)
+    llm_concurrency: int = 4  # LLM calls in flight at once, queued by priority beyond that
+    llm_scheduler_aging: float = 10.0  # Seconds of waiting worth one background request of priority
+    llm_max_preemptions: int = 0  # Times a running background call may be cancelled for an interactive one (0: never)
+    llm_request_timeout: float = 120.0  # Seconds per generate call; a timeout counts as a backend failure
+    llm_breaker_threshold: int = 3  # Consecutive backend failures that open the circuit
+    llm_breaker_reset: float = 30.0  # Seconds before the first probe, doubled per failed probe
+    llm_breaker_max_reset: float = 300.0
+    llm_keepalive_interval: float = 240.0  # Seconds between warm-up pings
+    llm_output_ratio: float = 1.5  # max_output_tokens per input token
+    llm_output_reserve: int = 3072  # Extra output tokens for hidden thinking
+    llm_output_floor: int = 1024
+    llm_output_ceiling: int = 8192
+    variant_history_limit: int = 5  # Rewrite variants kept per draft for ◀/▶ navigation
+    dedup_path: str = "data/dedup.json"  # SimHash index of forwarded/published posts
+    dedup_capacity: int = 3000
+    dedup_max_distance: int = 12  # Max differing bits (of 64) for a near-duplicate
+    shutdown_deadline: float = 20.0  # Seconds to drain in-flight work on stop
+    checkpoint_path: str = "data/pending.json"  # Unfinished jobs for the next start
+    archive_path: str = "data/archive.db"  # SQLite archive of published posts (full-text search)
+    usage_path: str = "data/usage.db"  # Token usage per day/model/purpose
+    usage_flush_interval: float = 60.0
+    llm_daily_token_budget: int = 0  # 0 = unlimited
+    llm_monthly_token_budget: int = 0
+    llm_budget_economy_ratio: float = 0.8  # Share of a budget after which the fast model replaces the heavy one
+    llm_budget_pause_ratio: float = 0.95  # ...and after which regenerations are refused
+    trace_capacity: int = 5000  # Debug events kept in memory for /trace and error dumps
+    llm_profiles: dict[str, LatencyProfile] = field(default_factory=lambda: dict(DEFAULT_PROFILES))
+    llm_profile_draft: str = "quality"  # Profile per action unless the channel sets its own
+    llm_profile_regenerate: str = "quality"
+    llm_profile_bulk: str = "quality"
+    probe_results_path: str = "data/probe.json"  # list_models.py output: default model/region
+    editors: list[Editor] = field(default_factory=list)  # Who may forward posts to the bot
+
+    def editor(self, user_id: int) -> Editor | None:
+        return next((e for e in self.editors if e.user_id == user_id), None)
+
+    def profile_for(self, action: str, channel: Channel | None = None) -> str:
+        """Latency profile name for an action; the channel's own choice wins."""
+        if channel and action in channel.profiles:
+            return channel.profiles[action]
+        defaults = {"draft": self.llm_profile_draft, "regenerate": self.llm_profile_regenerate,
+                    "bulk": self.llm_profile_bulk}
+        return defaults.get(action, self.llm_profile_draft)
 
     @property
     def channel_id(self) -> str:
@@ -31,14 +109,37 @@ def _parse_channels() -> list[Channel]:
     """
     Parse channels from CHANNELS env var (JSON) or fallback to CHANNEL_ID.
     Format: [{"name": "Main", "id": "-100123"}, {"name": "News", "id": "-100456"}]
+    Optional "profile": a latency profile name for every action, or {"draft": "fast", "regenerate": "quality"}.
+    CHANNELS that isn't JSON falls back to CHANNEL_ID; a malformed channel entry is a config error.
     """
     channels_json = os.getenv('CHANNELS')
+    parsed = None
     if channels_json:
         try:
             parsed = json.loads(channels_json)
-            return [Channel(name=ch["name"], channel_id=ch["id"]) for ch in parsed]
-        except (json.JSONDecodeError, KeyError):
+        except json.JSONDecodeError:
             pass
+    if parsed is not None:
+        if not isinstance(parsed, list):
+            raise ValueError('CHANNELS is not valid: expected a list of channels')
+        channels = []
+        for i, ch in enumerate(parsed):
+            label = f"#{i + 1}" + (f" ({ch['name']!r})" if isinstance(ch, dict) and "name" in ch else "")
+            try:
+                profile = ch.get("profile") or {}
+                if isinstance(profile, str):
+                    profiles = dict.fromkeys(PROFILE_ACTIONS, profile)
+                elif isinstance(profile, dict) and all(isinstance(name, str) for name in profile.values()):
+                    profiles = dict(profile)
+                else:
+                    raise TypeError(f'"profile" must be a profile name or {{action: name}}, got {profile!r}')
+                channels.append(Channel(name=ch["name"], channel_id=ch["id"], profiles=profiles))
+            except KeyError as e:
+                raise ValueError(f'CHANNELS is not valid: channel {label} has no {e}')
+            except (AttributeError, TypeError) as e:
+                # Not an object, or a profile that isn't a name: fail here, not deep in load_config
+                raise ValueError(f'CHANNELS is not valid: channel {label}: {e}')
+        return channels
 
     channel_id = os.getenv('CHANNEL_ID')
     if channel_id:
@@ -46,38 +147,234 @@ def _parse_channels() -> list[Channel]:
 
     return []
 
-def load_config() -> Config:
-    bot_token = os.getenv('BOT_TOKEN')
-    if not bot_token:
+def _parse_profiles() -> dict[str, LatencyProfile]:
+    """
+    Built-in latency profiles, changed or extended by LLM_PROFILES (JSON).
+    Format: {"fast": {"thinking_budget": 128}, "draft-long": {"thinking_budget": 2048, "max_output_tokens": 6144}}
+    Missing keys keep the built-in value (or the "quality" one for a new profile).
+    """
+    profiles = dict(DEFAULT_PROFILES)
+    profiles_json = os.getenv('LLM_PROFILES')
+    if profiles_json:
+        try:
+            for name, settings in json.loads(profiles_json).items():
+                base = profiles.get(name, DEFAULT_PROFILES["quality"])
+                profiles[name] = LatencyProfile(
+                    name=name,
+                    thinking_budget=settings.get("thinking_budget", base.thinking_budget),
+                    max_output_tokens=int(settings.get("max_output_tokens", base.max_output_tokens)),
+                    temperature=float(settings.get("temperature", base.temperature)),
+                )
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f'LLM_PROFILES is not valid: {e}')
+    return profiles
+
+def _parse_editors(admin_id: int, channels: list[Channel], concurrency: int, daily_budget: int) -> list[Editor]:
+    """
+    Parse editors from EDITORS env var (JSON); the admin is always one of them.
+    Format: [{"id": 123, "name": "Аня", "channels": ["-100123"], "concurrency": 2, "daily_tokens": 300000}]
+    "channels" lists ids from CHANNELS (all channels if omitted); other keys fall back to
+    EDITOR_CONCURRENCY / EDITOR_DAILY_TOKEN_BUDGET.
+    """
+    editors = []
+    editors_json = os.getenv('EDITORS')
+    if editors_json:
+        try:
+            parsed = json.loads(editors_json)
+            by_id = {ch.channel_id: ch for ch in channels}
+            for item in parsed:
+                allowed = item.get("channels")
+                editor_channels = channels if allowed is None else [by_id[str(ch)] for ch in allowed if str(ch) in by_id]
+                editors.append(Editor(
+                    user_id=int(item["id"]),
+                    name=item.get("name") or str(item["id"]),
+                    channels=editor_channels,
+                    llm_concurrency=int(item.get("concurrency", concurrency)),
+                    daily_token_budget=int(item.get("daily_tokens", daily_budget)),
+                ))
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError, AttributeError) as e:
+            # Unlike CHANNELS that isn't JSON, a silently dropped list would lock editors out
+            raise ValueError(f'EDITORS is not valid: {e}')
+
+    if admin_id and not any(e.user_id == admin_id for e in editors):
+        editors.insert(0, Editor(user_id=admin_id, name="admin", channels=channels,
+                                 llm_concurrency=concurrency, daily_token_budget=daily_budget))
+    return editors
+
+def _probe_recommendation(path: str) -> dict:
+    """{"region", ...} picked by the last list_models.py run ({} if there is none)."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    # An offline (--stub) run measures nothing real
+    if not isinstance(report, dict) or report.get("stub"):
+        return {}
+    return report.get("recommended") or {}
+
+def load_config(for_bot: bool = True) -> Config:
+    """for_bot=False: CLI tools that only need the LLM part (no token, admin or channels)."""
+    bot_token = os.getenv('BOT_TOKEN') or ''
+    if not bot_token and for_bot:
         raise ValueError('BOT_TOKEN is not set in environment variables')
 
     admin_id = os.getenv('ADMIN_ID')
-    if not admin_id:
+    if not admin_id and not os.getenv('EDITORS') and for_bot:
         raise ValueError('ADMIN_ID is not set in environment variables')
 
     vertex_project_id = os.getenv('VERTEX_PROJECT_ID')
     if not vertex_project_id:
         raise ValueError('VERTEX_PROJECT_ID is not set in environment variables')
 
-    vertex_location = os.getenv('VERTEX_LOCATION')
+    # Default region measured by `python list_models.py` (VERTEX_LOCATION wins)
+    probe_results_path = os.getenv('PROBE_RESULTS_PATH', 'data/probe.json')
+    probed = _probe_recommendation(probe_results_path)
+
+    vertex_location = os.getenv('VERTEX_LOCATION') or probed.get('region')
     if not vertex_location:
         raise ValueError('VERTEX_LOCATION is not set in environment variables')
 
     # Model name (with default fallback)
     vertex_model = os.getenv('VERTEX_MODEL', 'gemini-2.5-pro')
 
+    # Model cascade: short/simple posts go to the fast model, escalate on failed checks
+    vertex_fast_model = os.getenv('VERTEX_FAST_MODEL', 'gemini-2.5-flash')
+    route_fast_max_chars = int(os.getenv('ROUTE_FAST_MAX_CHARS', '1500'))
+    route_fast_max_links = int(os.getenv('ROUTE_FAST_MAX_LINKS', '3'))
+    llm_min_paragraphs = int(os.getenv('LLM_MIN_PARAGRAPHS', '1'))
+    llm_max_paragraphs = int(os.getenv('LLM_MAX_PARAGRAPHS', '6'))
+
+    # Validation retries with lower temperature and a corrective note
+    llm_retry_budget = int(os.getenv('LLM_RETRY_BUDGET', '2'))
+    llm_retry_deadline = float(os.getenv('LLM_RETRY_DEADLINE', '90'))
+    llm_retry_temperature_step = float(os.getenv('LLM_RETRY_TEMPERATURE_STEP', '0.25'))
+
+    # Long-post mode: parallel chunked rewrite above the threshold
+    long_post_threshold = int(os.getenv('LONG_POST_THRESHOLD', '2500'))
+    long_post_chunk_chars = int(os.getenv('LONG_POST_CHUNK_CHARS', '1200'))
+
+    # Priority scheduler: interactive > normal > background, weighted fair with aging
+    llm_concurrency = int(os.getenv('LLM_CONCURRENCY', '4'))
+    llm_scheduler_aging = float(os.getenv('LLM_SCHEDULER_AGING', '10'))
+    # A cancelled call is still billed and its retry pays again: off unless set
+    llm_max_preemptions = int(os.getenv('LLM_MAX_PREEMPTIONS', '0'))
+
+    # Circuit breaker: fail fast while Vertex AI is down (billing off, outage, quota)
+    llm_request_timeout = float(os.getenv('LLM_REQUEST_TIMEOUT', '120'))
+    llm_breaker_threshold = int(os.getenv('LLM_BREAKER_THRESHOLD', '3'))
+    llm_breaker_reset = float(os.getenv('LLM_BREAKER_RESET', '30'))
+    llm_breaker_max_reset = float(os.getenv('LLM_BREAKER_MAX_RESET', '300'))
+
+    # Keep Vertex connections and credentials warm (0 disables keepalive)
+    llm_keepalive_interval = float(os.getenv('LLM_KEEPALIVE_INTERVAL', '240'))
+
+    # Output budget: reserve + ratio * input tokens, clamped to [floor, ceiling]
+    llm_output_ratio = float(os.getenv('LLM_OUTPUT_RATIO', '1.5'))
+    llm_output_reserve = int(os.getenv('LLM_OUTPUT_RESERVE', '3072'))
+    llm_output_floor = int(os.getenv('LLM_OUTPUT_FLOOR', '1024'))
+    llm_output_ceiling = int(os.getenv('LLM_OUTPUT_CEILING', '8192'))
+
+    # Variants kept per draft (older ones are evicted)
+    variant_history_limit = int(os.getenv('VARIANT_HISTORY_LIMIT', '5'))
+
+    # Near-duplicate index
+    dedup_path = os.getenv('DEDUP_PATH', 'data/dedup.json')
+    dedup_capacity = int(os.getenv('DEDUP_CAPACITY', '3000'))
+    dedup_max_distance = int(os.getenv('DEDUP_MAX_DISTANCE', '12'))
+
+    # Graceful shutdown
+    shutdown_deadline = float(os.getenv('SHUTDOWN_DEADLINE', '20'))
+    checkpoint_path = os.getenv('CHECKPOINT_PATH', 'data/pending.json')
+
+    # Published posts archive
+    archive_path = os.getenv('ARCHIVE_PATH', 'data/archive.db')
+
+    # Token accounting and budgets (tokens = input + output + thinking)
+    usage_path = os.getenv('USAGE_PATH', 'data/usage.db')
+    usage_flush_interval = float(os.getenv('USAGE_FLUSH_INTERVAL', '60'))
+    llm_daily_token_budget = int(os.getenv('LLM_DAILY_TOKEN_BUDGET', '0'))
+    llm_monthly_token_budget = int(os.getenv('LLM_MONTHLY_TOKEN_BUDGET', '0'))
+    llm_budget_economy_ratio = float(os.getenv('LLM_BUDGET_ECONOMY_RATIO', '0.8'))
+    llm_budget_pause_ratio = float(os.getenv('LLM_BUDGET_PAUSE_RATIO', '0.95'))
+
+    # Debug trace ring buffer (events, not requests; oldest are dropped)
+    trace_capacity = int(os.getenv('TRACE_CAPACITY', '5000'))
+
     channels = _parse_channels()
-    if not channels:
+    if not channels and for_bot:
         raise ValueError('No channels configured. Set CHANNELS or CHANNEL_ID.')
 
-    _log.debug(f"[CONFIG] Loaded {len(channels)} channel(s)")
+    # Latency profiles: thinking budget, output cap and temperature, per action and per channel
+    llm_profiles = _parse_profiles()
+    llm_profile_draft = os.getenv('LLM_PROFILE_DRAFT', 'quality')
+    llm_profile_regenerate = os.getenv('LLM_PROFILE_REGENERATE', 'quality')
+    llm_profile_bulk = os.getenv('LLM_PROFILE_BULK', 'quality')
+    chosen = {llm_profile_draft, llm_profile_regenerate, llm_profile_bulk}
+    chosen.update(name for ch in channels for name in ch.profiles.values())
+    unknown = chosen - llm_profiles.keys()
+    if unknown:
+        raise ValueError(f'Unknown latency profile(s): {", ".join(sorted(unknown))}')
+
+    # Editors: own channel list, share of LLM concurrency and daily token quota each
+    editor_concurrency = int(os.getenv('EDITOR_CONCURRENCY', '2'))
+    editor_daily_token_budget = int(os.getenv('EDITOR_DAILY_TOKEN_BUDGET', '0'))
+    editors = _parse_editors(int(admin_id or 0), channels, editor_concurrency, editor_daily_token_budget)
+    if not admin_id and editors:
+        admin_id = editors[0].user_id
+
+    _log.debug(f"[CONFIG] Loaded {len(channels)} channel(s), {len(editors)} editor(s)")
     _log.info(f"[CONFIG] Vertex AI configured: project={vertex_project_id}, location={vertex_location}, model={vertex_model}")
+    if probed.get('region') and not os.getenv('VERTEX_LOCATION'):
+        _log.info(f"[CONFIG] Region from probe results {probe_results_path}: {probed['region']}")
 
     return Config(
         bot_token=bot_token,
-        admin_id=int(admin_id),
+        admin_id=int(admin_id or 0),
         channels=channels,
         vertex_project_id=vertex_project_id,
         vertex_location=vertex_location,
-        vertex_model=vertex_model
+        vertex_model=vertex_model,
+        vertex_fast_model=vertex_fast_model,
+        route_fast_max_chars=route_fast_max_chars,
+        route_fast_max_links=route_fast_max_links,
+        llm_min_paragraphs=llm_min_paragraphs,
+        llm_max_paragraphs=llm_max_paragraphs,
+        llm_retry_budget=llm_retry_budget,
+        llm_retry_deadline=llm_retry_deadline,
+        llm_retry_temperature_step=llm_retry_temperature_step,
+        long_post_threshold=long_post_threshold,
+        long_post_chunk_chars=long_post_chunk_chars,
+        llm_concurrency=llm_concurrency,
+        llm_scheduler_aging=llm_scheduler_aging,
+        llm_max_preemptions=llm_max_preemptions,
+        llm_request_timeout=llm_request_timeout,
+        llm_breaker_threshold=llm_breaker_threshold,
+        llm_breaker_reset=llm_breaker_reset,
+        llm_breaker_max_reset=llm_breaker_max_reset,
+        llm_keepalive_interval=llm_keepalive_interval,
+        llm_output_ratio=llm_output_ratio,
+        llm_output_reserve=llm_output_reserve,
+        llm_output_floor=llm_output_floor,
+        llm_output_ceiling=llm_output_ceiling,
+        variant_history_limit=variant_history_limit,
+        dedup_path=dedup_path,
+        dedup_capacity=dedup_capacity,
+        dedup_max_distance=dedup_max_distance,
+        shutdown_deadline=shutdown_deadline,
+        checkpoint_path=checkpoint_path,
+        archive_path=archive_path,
+        usage_path=usage_path,
+        usage_flush_interval=usage_flush_interval,
+        llm_daily_token_budget=llm_daily_token_budget,
+        llm_monthly_token_budget=llm_monthly_token_budget,
+        llm_budget_economy_ratio=llm_budget_economy_ratio,
+        llm_budget_pause_ratio=llm_budget_pause_ratio,
+        trace_capacity=trace_capacity,
+        probe_results_path=probe_results_path,
+        llm_profiles=llm_profiles,
+        llm_profile_draft=llm_profile_draft,
+        llm_profile_regenerate=llm_profile_regenerate,
+        llm_profile_bulk=llm_profile_bulk,
+        editors=editors
     )
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""Shared setup for the offline test scripts (run with pytest, or each script directly)."""
+import os
+import asyncio
+
+import pytest
+
+# Offline: the stub client needs no Vertex credentials
+os.environ.setdefault("VERTEX_PROJECT_ID", "test")
+os.environ.setdefault("VERTEX_LOCATION", "us-central1")
+
+# Live checks against Vertex AI, run by hand with real credentials
+collect_ignore = ["test_vertex_ai.py", "test_llm_tokens.py"]
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """for_bot=False config with every data file under tmp_path."""
+    from config import load_config
+
+    monkeypatch.setenv("USAGE_PATH", str(tmp_path / "usage.db"))
+    monkeypatch.setenv("ARCHIVE_PATH", str(tmp_path / "archive.db"))
+    monkeypatch.setenv("DEDUP_PATH", str(tmp_path / "dedup.json"))
+    monkeypatch.setenv("CHECKPOINT_PATH", str(tmp_path / "pending.json"))
+    monkeypatch.setenv("PROBE_RESULTS_PATH", str(tmp_path / "probe.json"))
+    return load_config(for_bot=False)
+
+
+@pytest.fixture
+def llm(config):
+    """LLMService on an instant StubClient (echoes the post back)."""
+    from services.llm import LLMService
+    from services.stub import StubClient
+
+    service = LLMService(config, client=StubClient(latency=0, jitter=0))
+    yield service
+    asyncio.run(service.close())
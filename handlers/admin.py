@@ -1,13 +1,27 @@
 import re
+import asyncio
 import logging
-from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputMediaVideo, LinkPreviewOptions, MessageEntity
+from functools import lru_cache
+from typing import Awaitable, Callable
+from datetime import datetime, timedelta
+from aiogram import Router, F, Bot, Dispatcher
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputMediaVideo, LinkPreviewOptions, MessageEntity, BufferedInputFile
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import StateFilter
-
-from config import Config
-from services.llm import LLMService
+from aiogram.filters import StateFilter, Command
+from aiogram.exceptions import TelegramBadRequest
+
+from config import Config, Channel
+from services.llm import LLMService, RewriteResult
+from services.chunking import paragraph_spans
+from services.dedup import DedupIndex, simhash
+from services.archive import PostArchive
+from services.breaker import CircuitOpen, is_backend_failure
 from utils.states import PostState
+from utils.inflight import InflightRegistry, ShuttingDown
+from utils.utf16 import utf16_len
+from utils.text import final_fix_entities
+from utils.variants import push_variant, select_variant
+from utils import trace
 
 _log = logging.getLogger(__name__)
 
@@ -16,28 +30,73 @@ admin_router = Router()
 # In-memory storage for last used channel per user
 _user_last_channel: dict[int, int] = {}
 
-def final_fix(text):
-    # Убираем все звездочки, если они вдруг пролезли
-    text = text.replace("*", "")
-    # Длинные тире (em-dash) → обычное тире
-    text = text.replace("—", "-")
-    text = text.replace("–", "-")
-    # Убираем точки в конце строк/абзацев
-    text = re.sub(r'\.(?=\s*(\n|$))', '', text)
-    return text.strip()
+# Как часто отложенный пост проверяет, освободился ли админ от текущего черновика
+PARKED_POLL_INTERVAL = 5.0
+
+# Длиннее этого /trace присылает файлом, а не сообщением
+TRACE_MESSAGE_LIMIT = 4000
+
+PARAGRAPH_BUTTONS_PER_ROW = 5
+
+def to_tg_entities(text: str, entities: list[dict], shift: int = 0) -> list[MessageEntity] | None:
+    """Entity dicts (UTF-16 offsets) -> MessageEntity, shifted by a prefix of `shift` UTF-16 units.
+
+    Entities that don't fit the text are dropped: Telegram rejects the whole message for them.
+    """
+    if not entities:
+        return None
+    text_len = utf16_len(text)
+    tg_entities = []
+    for e in entities:
+        if e["offset"] < 0 or e["length"] <= 0 or e["offset"] + e["length"] > text_len:
+            _log.warning(f"[ADMIN] Entity out of text bounds dropped: {e}")
+            continue
+        tg_entities.append(MessageEntity(type=e["type"], offset=e["offset"] + shift, length=e["length"], url=e.get("url")))
+    return tg_entities or None
 
 # --- КЛАВИАТУРЫ ---
-def get_action_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
+def get_action_keyboard(variant_idx: int = 0, variant_count: int = 0, paragraph_count: int = 0):
+    rows = [
         [InlineKeyboardButton(text="🚀 Publish", callback_data="publish"),
          InlineKeyboardButton(text="✏️ Edit", callback_data="edit_manual")],
         [InlineKeyboardButton(text="🔄 Regenerate", callback_data="regen"),
          InlineKeyboardButton(text="🗑 Delete", callback_data="delete")]
+    ]
+    # Регенерация одного абзаца: 🔄¶N, по PARAGRAPH_BUTTONS_PER_ROW в ряд
+    if paragraph_count > 1:
+        buttons = [InlineKeyboardButton(text=f"🔄¶{i + 1}", callback_data=f"para:{i}") for i in range(paragraph_count)]
+        for i in range(0, len(buttons), PARAGRAPH_BUTTONS_PER_ROW):
+            rows.append(buttons[i:i + PARAGRAPH_BUTTONS_PER_ROW])
+    # Навигация по вариантам, если их больше одного
+    if variant_count > 1:
+        rows.insert(0, [
+            InlineKeyboardButton(text="◀", callback_data="variant:prev"),
+            InlineKeyboardButton(text=f"{variant_idx + 1}/{variant_count}", callback_data="variant:noop"),
+            InlineKeyboardButton(text="▶", callback_data="variant:next"),
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+# Клавиатура превью зависит только от трёх чисел — собираем каждую один раз
+_cached_action_keyboard = lru_cache(maxsize=128)(get_action_keyboard)
+
+@lru_cache(maxsize=256)
+def _paragraph_count(text: str) -> int:
+    return len(paragraph_spans(text))
+
+def preview_keyboard(data: dict) -> InlineKeyboardMarkup:
+    return _cached_action_keyboard(data.get("variant_idx", 0), len(data.get("variants", [])),
+                                   _paragraph_count(data.get("generated_text", "")))
+
+def get_duplicate_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="♻️ Взять опубликованный", callback_data="dup_reuse")],
+        [InlineKeyboardButton(text="🔄 Переписать всё равно", callback_data="dup_rewrite"),
+         InlineKeyboardButton(text="⏭ Пропустить", callback_data="dup_skip")]
     ])
 
-def get_channel_keyboard(config: Config, last_idx: int | None = None) -> InlineKeyboardMarkup:
+def get_channel_keyboard(channels: list[Channel], last_idx: int | None = None) -> InlineKeyboardMarkup:
     buttons = []
-    for i, ch in enumerate(config.channels):
+    for i, ch in enumerate(channels):
         if i == last_idx:
             label = f"✓ {ch.name} (последний)"
             buttons.insert(0, [InlineKeyboardButton(text=label, callback_data=f"channel:{i}")])
@@ -50,11 +109,17 @@ def get_channel_keyboard(config: Config, last_idx: int | None = None) -> InlineK
 
 # Используем config из dependency injection вместо load_config() в фильтре
 @admin_router.message(F.forward_origin)
-async def handle_forward(message: Message, state: FSMContext, bot: Bot, config: Config, llm: LLMService, album: list[Message] = None):
-    """Принимаем форвард (одиночный или альбом)"""
+@trace.traced("forward")
+async def handle_forward(message: Message, state: FSMContext, bot: Bot, config: Config, llm: LLMService,
+                         inflight: InflightRegistry, dedup: DedupIndex, album: list[Message] = None,
+                         album_rewrite: tuple[str, asyncio.Task] | None = None):
+    """Принимаем форвард (одиночный или альбом)
 
-    # Проверка прав доступа
-    if message.from_user.id != config.admin_id:
+    album_rewrite — переписывание подписи, запущенное AlbumMiddleware, пока собирался альбом.
+    """
+
+    # Проверка прав доступа: форварды принимаем только от редакторов
+    if config.editor(message.from_user.id) is None:
         return
 
     # 1. Достаем текст, медиа и entities
@@ -62,8 +127,7 @@ async def handle_forward(message: Message, state: FSMContext, bot: Bot, config:
     if album:
         original_text = album[0].caption or ""
         entities = album[0].caption_entities or []
-        _log.info(f"[ADMIN] Album forward: text_len={len(original_text)}, entities={len(entities)}")
-        _log.info(f"[ADMIN] Album received: text_len={len(original_text)}, entities_count={len(entities)}")
+        trace.event("forward.album", parts=len(album), chars=len(original_text), entities=len(entities))
 
         media_group = []
         for msg in album:
@@ -77,9 +141,7 @@ async def handle_forward(message: Message, state: FSMContext, bot: Bot, config:
         # Get text and entities (works for both text and caption)
         original_text = message.caption or message.text or ""
         entities = message.caption_entities or message.entities or []
-        _log.info(f"[ADMIN] Message received: text_len={len(original_text)}, entities_count={len(entities)}")
-        for e in (entities or []):
-            _log.info(f"[ADMIN]   Entity: type={e.type}, offset={e.offset}, length={e.length}, url={getattr(e, 'url', None)}")
+        trace.event("forward.message", chars=len(original_text), entities=len(entities))
 
         # Вот этот блок ниже должен стоять ровно под original_text
         if message.photo:
@@ -89,275 +151,521 @@ async def handle_forward(message: Message, state: FSMContext, bot: Bot, config:
         else:
             await state.update_data(media_type="text", is_album=False)
 
+    # Convert Telegram MessageEntity objects to dicts for FSM serialization
+    original_entities_dicts = _entity_dicts(entities)
+
+    fingerprint = simhash(original_text)
+    await state.update_data(original_text=original_text, original_entities=original_entities_dicts,
+                            fingerprint=fingerprint)
+
+    # Почти дубль уже опубликованного поста — спрашиваем до оплаты LLM
+    match = dedup.find(fingerprint)
+    if match:
+        entry, distance = match
+        _log.info(f"[ADMIN] Near-duplicate of published post (distance={distance})")
+        await state.update_data(dup_text=entry.text, dup_entities=entry.entities)
+        await state.set_state(PostState.confirming_duplicate)
+        similarity = round(100 * (1 - distance / 64))
+        published_at = datetime.fromtimestamp(entry.created_at).strftime("%d.%m %H:%M")
+        await message.answer(
+            f"♻️ Похоже на пост, опубликованный {published_at} (сходство {similarity}%):\n\n{entry.text[:500]}",
+            reply_markup=get_duplicate_keyboard(),
+            parse_mode=None
+        )
+        return
+    if dedup.find(fingerprint, kind="recent"):
+        _log.info("[ADMIN] Near-duplicate of a recent forward")
+    dedup.add_recent(fingerprint)
+
     # 2. Информируем админа (Индикатор работы)
     processing_msg = await message.answer("⏳ Processing...")
 
+    # 3-5. Генерируем и показываем превью; подпись альбома уже может переписываться
+    pending = None
+    if album_rewrite and album_rewrite[0] == original_text:
+        pending = album_rewrite[1]
+        trace.event("album.join", done=pending.done())
+    elif album_rewrite:
+        # Подпись пришла с более поздней частью: чужой результат не нужен, не платим за него дальше
+        album_rewrite[1].cancel()
+        trace.event("album.discard")
+    await _generate_preview(processing_msg, state, llm, inflight, message.from_user.id, pending=pending,
+                            profile=_profile_for(config, message.from_user.id, "draft"))
+
+def _entity_dicts(entities: list[MessageEntity]) -> list[dict]:
+    dicts = []
+    for e in entities:
+        d = {"type": e.type, "offset": e.offset, "length": e.length}
+        if e.url:
+            d["url"] = e.url
+        dicts.append(d)
+    return dicts
+
+def speculate_album_rewrite(event: Message, data: dict) -> tuple[str, asyncio.Task] | None:
+    """Начинает переписывать подпись альбома, пока AlbumMiddleware ждёт остальные части.
+
+    Те же проверки, что в handle_forward до вызова LLM: редактор, квота, почти дубль
+    (его сначала показываем редактору, платить за LLM рано).
+    """
+    config, llm, dedup = data["config"], data["llm"], data["dedup"]
+    user_id = event.from_user.id
+    if not event.forward_origin or config.editor(user_id) is None or llm.usage.editor_exhausted(user_id):
+        return None
+    if dedup.find(simhash(event.caption)):
+        return None
+    trace.event("album.speculate", chars=len(event.caption))
+    task = asyncio.create_task(llm.rewrite(event.caption, entities=_entity_dicts(event.caption_entities or []),
+                                           editor=user_id, profile=_profile_for(config, user_id, "draft")))
+    return event.caption, task
+
+async def _generate_preview(processing_msg: Message, state: FSMContext, llm: LLMService,
+                            inflight: InflightRegistry, user_id: int, front: bool = False,
+                            priority: str = "interactive", pending: asyncio.Task | None = None,
+                            profile: str | None = None):
+    """Переписывает original_text из FSM и заменяет processing_msg превью.
+
+    Если LLM недоступен (цепь разомкнута), пост откладывается в очередь;
+    front=True сохраняет его место в очереди при повторном откладывании.
+    priority — класс в планировщике LLM: админ ждёт ответа (interactive)
+    или пост досылается сам (normal). pending — уже запущенное переписывание
+    того же текста, его результат ждём вместо нового вызова. profile — профиль
+    задержки LLM (см. _profile_for).
+    """
+    data = await state.get_data()
+
+    if pending is None and llm.usage.editor_exhausted(user_id):
+        await processing_msg.edit_text("⛔ Твоя дневная квота токенов исчерпана, пост не переписан. Попробуй завтра")
+        return
+
     # 3. Генерируем (передаем entities для сохранения text_link)
     try:
-        generated_text, generated_entities = await llm.rewrite_text(original_text, entities=entities)
-        # Очистка (Post-processing)
-        generated_text = final_fix(generated_text)
+        async with inflight.track("rewrite", processing_msg.chat.id, user_id, {"data": data}):
+            if pending is not None:
+                result = await pending
+            else:
+                result = await llm.rewrite(data["original_text"], entities=data.get("original_entities", []),
+                                           priority=priority, editor=user_id, profile=profile)
+            # Очистка (Post-processing), ссылки сдвигаются вместе с текстом
+            generated_text, generated_entities = final_fix_entities(result.text, result.entities)
+
+            # 4. Сохраняем в FSM (включая entities для regenerate и публикации, модель и время для архива)
+            # Новый черновик начинает историю вариантов заново
+            await state.update_data(push_variant(data, generated_text, generated_entities,
+                                                 result.model, result.elapsed, reset=True))
+    except ShuttingDown:
+        await processing_msg.edit_text("⏸ Бот перезапускается, пришли пост ещё раз через минуту")
+        return
     except Exception as e:
+        # Сбой, который разомкнул цепь, тоже откладываем, а не теряем
+        if isinstance(e, CircuitOpen) or (is_backend_failure(e) and llm.breaker.state == "open"):
+            _log.warning(f"[ADMIN] LLM unavailable, parking rewrite: {e}")
+            inflight.park("rewrite", processing_msg.chat.id, user_id,
+                          {"data": data, "message_id": processing_msg.message_id}, front=front)
+            await processing_msg.edit_text(
+                f"⏸ LLM сейчас недоступен, пост в очереди ({len(inflight.parked)}). "
+                "Обработаю автоматически, как только сервис восстановится"
+            )
+            return
         _log.error(f"[ADMIN] GPT rewrite error: {e}", exc_info=True)
+        trace.dump("rewrite error")
         await processing_msg.edit_text(f"❌ Ошибка генерации текста: {e}")
         return
 
-    # 4. Сохраняем в FSM (включая entities для regenerate и публикации)
-    # Convert Telegram MessageEntity objects to dicts for FSM serialization
-    original_entities_dicts = []
-    for e in entities:
-        d = {"type": e.type, "offset": e.offset, "length": e.length}
-        if e.url:
-            d["url"] = e.url
-        original_entities_dicts.append(d)
+    # 5. Показываем превью на месте "⏳ Processing..."
+    await replace_preview(processing_msg, state, generated_text)
+
+CAPTION_LIMIT = 1024  # UTF-16 units, like entity offsets
+ALBUM_PREFIX = "[ALBUM] "
+
+def _preview_body(data: dict, text: str) -> tuple[str, list[MessageEntity] | None, bool]:
+    """Текст превью, его entities и влезает ли он в подпись к медиа: (body, entities, as_caption)"""
+    entities = tuple((e["type"], e["offset"], e["length"], e.get("url")) for e in data.get("generated_entities", []))
+    has_media = bool(data.get("is_album") or data.get("media_type") in ("photo", "video"))
+    return _build_preview_body(text, entities, bool(data.get("is_album")), has_media)
+
+@lru_cache(maxsize=256)
+def _build_preview_body(text: str, entities: tuple, is_album: bool,
+                        has_media: bool) -> tuple[str, list[MessageEntity] | None, bool]:
+    # Кэш по содержимому: ◀/▶ и повторные показы варианта не пересобирают entities
+    entities = [{"type": t, "offset": offset, "length": length, "url": url} for t, offset, length, url in entities]
+    # Альбомный префикс тоже входит в подпись
+    prefix_len = utf16_len(ALBUM_PREFIX) if is_album else 0
+    as_caption = has_media and prefix_len + utf16_len(text) <= CAPTION_LIMIT
+    if is_album:
+        return f"{ALBUM_PREFIX}{text}", to_tg_entities(text, entities, shift=utf16_len(ALBUM_PREFIX)), as_caption
+    if not has_media and not text:
+        return "⚠️ (Нет текста)", None, False
+    return text, to_tg_entities(text, entities), as_caption
+
+def _preview_media(data: dict) -> tuple[str | None, str | None]:
+    """Медиа превью (type, file_id); для альбома — первое медиа"""
+    if data.get("is_album") and data.get("media_group"):
+        return data["media_group"][0]["type"], data["media_group"][0]["media"]
+    return data.get("media_type"), data.get("file_id")
+
+def _preview_message_ids(data: dict, message: Message) -> list[int]:
+    """Все сообщения превью: при длинном тексте перед сообщением с кнопками идёт медиа без подписи"""
+    split = data.get("preview_split")  # [media_message_id, text_message_id]
+    if split and split[1] == message.message_id:
+        return split
+    return [message.message_id]
+
+async def _delete_quietly(bot: Bot, chat_id: int, message_ids: list[int]):
+    try:
+        await bot.delete_messages(chat_id, message_ids)
+    except TelegramBadRequest as e:
+        _log.warning(f"[ADMIN] Could not delete {message_ids}: {e}")
 
-    await state.update_data(
-        generated_text=generated_text,
-        generated_entities=generated_entities,
-        original_text=original_text,
-        original_entities=original_entities_dicts
-    )
-    
-    # 5. Показываем превью
-    await processing_msg.delete()
-    await send_preview(message, state, generated_text, is_new=True)
+async def _hide_keyboard(message: Message):
+    try:
+        await message.edit_reply_markup(reply_markup=None)
+    except TelegramBadRequest as e:
+        _log.warning(f"[ADMIN] Could not hide keyboard: {e}")
+
+async def replace_preview(message: Message, state: FSMContext, text: str):
+    """Показывает превью вместо message: "⏳ Processing...", вопроса о дубле или старого превью.
+
+    Правим на месте, где Bot API это позволяет (текст → текст, подпись → подпись);
+    иначе новое сообщение уходит одновременно с удалением старого. Так на каждую
+    регенерацию приходится один видимый запрос к Telegram.
+    """
+    data = await state.get_data()
+    body, tg_entities, as_caption = _preview_body(data, text)
+    keyboard = preview_keyboard(data)
+    media_type, _ = _preview_media(data)
+    has_media = media_type in ("photo", "video")
+    is_text = message.text is not None
+    message_ids = _preview_message_ids(data, message)
+    split = message_ids if len(message_ids) == 2 else None
+
+    resend = False
+    try:
+        if is_text and (not has_media or (split and not as_caption)):
+            # Текстовый пост или длинный текст под медиа: текст остаётся текстом
+            await message.edit_text(body, entities=tg_entities, reply_markup=keyboard,
+                                    link_preview_options=LinkPreviewOptions(is_disabled=True))
+        elif not is_text and as_caption:
+            await message.edit_caption(caption=body, caption_entities=tg_entities, reply_markup=keyboard)
+        elif split and as_caption:
+            # Текст снова влез в подпись: он переезжает в подпись медиа, отдельное сообщение убираем
+            await asyncio.gather(
+                message.bot.edit_message_caption(chat_id=message.chat.id, message_id=split[0], caption=body,
+                                                 caption_entities=tg_entities, reply_markup=keyboard),
+                _delete_quietly(message.bot, message.chat.id, [message.message_id]),
+            )
+            await state.update_data(preview_split=None)
+        elif not is_text:
+            # Текст перестал влезать в подпись: подпись снимаем, текст уходит отдельным сообщением ниже
+            _, sent = await asyncio.gather(
+                message.bot.edit_message_caption(chat_id=message.chat.id, message_id=message.message_id),
+                message.bot.send_message(message.chat.id, body, entities=tg_entities, reply_markup=keyboard,
+                                         link_preview_options=LinkPreviewOptions(is_disabled=True)),
+            )
+            await state.update_data(preview_split=[message.message_id, sent.message_id])
+        else:
+            # Текстовое сообщение в медиа не превратить (edit_message_media правит только медиа)
+            resend = True
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            # Сообщение удалили или его уже нельзя править: превью присылаем заново
+            _log.warning(f"[ADMIN] Could not edit preview, sending a new one: {e}")
+            resend = True
+    if resend:
+        await asyncio.gather(
+            _delete_quietly(message.bot, message.chat.id, message_ids),
+            send_preview(message, state, text, is_new=True),
+        )
+        return
+    await state.set_state(PostState.viewing_preview)
 
 async def send_preview(message: Message, state: FSMContext, text: str, is_new: bool = False):
     """Отправляет превью поста админу"""
     data = await state.get_data()
 
-    # Get entities for preview (so admin sees clickable links)
-    entities = data.get("generated_entities", [])
-    tg_entities = [
-        MessageEntity(
-            type=e["type"],
-            offset=e["offset"],
-            length=e["length"],
-            url=e.get("url")
-        ) for e in entities
-    ] if entities else None
-
-    CAPTION_LIMIT = 1024
+    # Entities for preview (so admin sees clickable links), shifted by the album prefix
+    body, tg_entities, as_caption = _preview_body(data, text)
+    keyboard = preview_keyboard(data)
 
     if is_new:
-        has_media = data.get("is_album") or data.get("media_type") in ("photo", "video")
+        media_type, media = _preview_media(data)
 
-        if has_media and len(text) > CAPTION_LIMIT:
+        if not as_caption and media_type in ("photo", "video"):
             # Текст слишком длинный для caption — шлём медиа без подписи + текст отдельно
-            if data.get("is_album") and data.get("media_group"):
-                first_media = data["media_group"][0]
-                album_prefix = "[ALBUM] "
-                if first_media["type"] == "photo":
-                    await message.answer_photo(first_media["media"])
-                elif first_media["type"] == "video":
-                    await message.answer_video(first_media["media"])
-            elif data.get("media_type") == "photo":
-                await message.answer_photo(photo=data["file_id"])
-            elif data.get("media_type") == "video":
-                await message.answer_video(video=data["file_id"])
-
-            prefix = "[ALBUM] " if data.get("is_album") else ""
-            msg_text = f"{prefix}{text}" if prefix else text
-            # Shift entities for prefix if needed
-            if prefix and tg_entities:
-                tg_entities = [
-                    MessageEntity(type=e.type, offset=e.offset + len(prefix), length=e.length, url=e.url)
-                    for e in tg_entities
-                ]
-            await message.answer(msg_text, entities=tg_entities, reply_markup=get_action_keyboard())
-
-        elif data.get("is_album") and data.get("media_group"):
+            if media_type == "photo":
+                media_msg = await message.answer_photo(media)
+            else:
+                media_msg = await message.answer_video(media)
+            text_msg = await message.answer(body, entities=tg_entities, reply_markup=keyboard)
+            await state.update_data(preview_split=[media_msg.message_id, text_msg.message_id])
+        elif media_type == "photo":
             # Для альбома показываем первое медиа как превью
-            first_media = data["media_group"][0]
-            album_prefix = "[ALBUM] "
-            # Shift entity offsets to account for prefix
-            shifted_entities = [
-                MessageEntity(
-                    type=e["type"],
-                    offset=e["offset"] + len(album_prefix),
-                    length=e["length"],
-                    url=e.get("url")
-                ) for e in entities
-            ] if entities else None
-
-            caption_text = f"{album_prefix}{text}"
-            if first_media["type"] == "photo":
-                await message.answer_photo(
-                    first_media["media"],
-                    caption=caption_text,
-                    caption_entities=shifted_entities,
-                    reply_markup=get_action_keyboard()
-                )
-            elif first_media["type"] == "video":
-                await message.answer_video(
-                    first_media["media"],
-                    caption=caption_text,
-                    caption_entities=shifted_entities,
-                    reply_markup=get_action_keyboard()
-                )
-        elif data.get("media_type") == "photo":
-            await message.answer_photo(
-                photo=data["file_id"],
-                caption=text,
-                caption_entities=tg_entities,
-                reply_markup=get_action_keyboard()
-            )
-        elif data.get("media_type") == "video":
-            await message.answer_video(
-                video=data["file_id"],
-                caption=text,
-                caption_entities=tg_entities,
-                reply_markup=get_action_keyboard()
-            )
+            await message.answer_photo(media, caption=body, caption_entities=tg_entities, reply_markup=keyboard)
+        elif media_type == "video":
+            await message.answer_video(media, caption=body, caption_entities=tg_entities, reply_markup=keyboard)
         else:
-            msg_text = text if text else "⚠️ (Нет текста)"
-            await message.answer(msg_text, entities=tg_entities, reply_markup=get_action_keyboard())
+            await message.answer(body, entities=tg_entities, reply_markup=keyboard)
 
     await state.set_state(PostState.viewing_preview)
 
 # --- КНОПКИ ---
 
+@admin_router.callback_query(F.data == "dup_reuse", StateFilter(PostState.confirming_duplicate))
+async def on_dup_reuse(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await state.update_data(push_variant(data, data["dup_text"], data["dup_entities"], reset=True))
+    await asyncio.gather(replace_preview(callback.message, state, data["dup_text"]),
+                         callback.bot.answer_callback_query(callback.id))
+
+@admin_router.callback_query(F.data == "dup_rewrite", StateFilter(PostState.confirming_duplicate))
+async def on_dup_rewrite(callback: CallbackQuery, state: FSMContext, config: Config, llm: LLMService,
+                         inflight: InflightRegistry):
+    await callback.message.edit_text("⏳ Processing...")
+    await callback.answer()
+    await _generate_preview(callback.message, state, llm, inflight, callback.from_user.id,
+                            profile=_profile_for(config, callback.from_user.id, "draft"))
+
+@admin_router.callback_query(F.data == "dup_skip", StateFilter(PostState.confirming_duplicate))
+async def on_dup_skip(callback: CallbackQuery, state: FSMContext):
+    await callback.message.delete()
+    await state.clear()
+    await callback.answer("Пропущено")
+
 @admin_router.callback_query(F.data == "regen", StateFilter(PostState.viewing_preview))
-async def on_regen(callback: CallbackQuery, state: FSMContext, llm: LLMService):
-    # Убираем кнопки, чтобы показать процесс
-    await callback.message.edit_reply_markup(reply_markup=None)
+@trace.traced("regen")
+async def on_regen(callback: CallbackQuery, state: FSMContext, config: Config, llm: LLMService,
+                   inflight: InflightRegistry):
+    await _regenerate(callback, state, config, llm, inflight, lambda data: llm.rewrite(
+        data["original_text"], entities=data.get("original_entities", []), purpose="regenerate",
+        editor=callback.from_user.id, profile=_profile_for(config, callback.from_user.id, "regenerate"),
+    ))
+
+@admin_router.callback_query(F.data.startswith("para:"), StateFilter(PostState.viewing_preview))
+@trace.traced("paragraph")
+async def on_paragraph_regen(callback: CallbackQuery, state: FSMContext, config: Config, llm: LLMService,
+                             inflight: InflightRegistry):
+    """🔄¶N: переписывает только N-й абзац текущего варианта, остальные остаются как были"""
+    index = int(callback.data.split(":")[1])
+    await _regenerate(callback, state, config, llm, inflight, lambda data: llm.rewrite_paragraph(
+        data["generated_text"], data.get("generated_entities", []), index, editor=callback.from_user.id,
+        profile=_profile_for(config, callback.from_user.id, "regenerate"),
+    ))
+
+async def _regenerate(callback: CallbackQuery, state: FSMContext, config: Config, llm: LLMService,
+                      inflight: InflightRegistry, rewrite: Callable[[dict], Awaitable[RewriteResult]]):
+    """Общая часть регенерации: проверка бюджета, вызов rewrite(data), новый вариант в истории"""
+    if llm.usage.regenerations_paused:
+        await callback.answer("⛔ Бюджет токенов почти исчерпан, регенерация на паузе. Отредактируй вручную", show_alert=True)
+        return
+    if llm.usage.editor_exhausted(callback.from_user.id):
+        await callback.answer("⛔ Твоя дневная квота токенов исчерпана. Отредактируй вручную", show_alert=True)
+        return
+
+    # Убираем кнопки, чтобы показать процесс; LLM этого не ждёт
+    hiding = asyncio.create_task(_hide_keyboard(callback.message))
 
     data = await state.get_data()
-    entities = data.get("original_entities", [])
 
     try:
-        new_text, new_entities = await llm.rewrite_text(data["original_text"], entities=entities)
-        # Очистка (Post-processing)
-        new_text = final_fix(new_text)
+        try:
+            async with inflight.track("rewrite", callback.message.chat.id, callback.from_user.id, {"data": data}):
+                result = await rewrite(data)
+                # Очистка (Post-processing), ссылки сдвигаются вместе с текстом
+                new_text, new_entities = final_fix_entities(result.text, result.entities)
+        finally:
+            # Правки сообщения ниже не должны обогнать снятие кнопок
+            await hiding
+    except ShuttingDown:
+        await callback.message.edit_reply_markup(reply_markup=preview_keyboard(data))
+        await callback.answer("⏸ Бот перезапускается, попробуй через минуту", show_alert=True)
+        return
+    except CircuitOpen as e:
+        await callback.message.edit_reply_markup(reply_markup=preview_keyboard(data))
+        await callback.answer(f"⏸ LLM сейчас недоступен, попробуй через {e.retry_after:.0f} с", show_alert=True)
+        return
     except Exception as e:
         _log.error(f"[ADMIN] GPT regenerate error: {e}", exc_info=True)
+        trace.dump("regenerate error")
         await callback.message.edit_text(f"❌ Ошибка регенерации: {e}")
         await callback.answer()
         return
 
-    await state.update_data(generated_text=new_text, generated_entities=new_entities)
+    # Прошлые варианты остаются в истории, к ним можно вернуться кнопками ◀/▶
+    await state.update_data(push_variant(await state.get_data(), new_text, new_entities, result.model,
+                                         result.elapsed, limit=config.variant_history_limit))
 
-    await callback.message.delete()
-    await send_preview(callback.message, state, new_text, is_new=True)
+    # Форматирование внутри переписанного абзаца перенести некуда — говорим об этом
+    notice = "ℹ️ Форматирование внутри абзаца сброшено" if result.formatting_reset else None
+    await asyncio.gather(replace_preview(callback.message, state, new_text),
+                         callback.bot.answer_callback_query(callback.id, notice))
+
+@admin_router.callback_query(F.data.startswith("variant:"), StateFilter(PostState.viewing_preview))
+async def on_variant(callback: CallbackQuery, state: FSMContext):
+    """◀/▶: переключает превью между сохранёнными вариантами без запроса к LLM"""
+    data = await state.get_data()
+    count = len(data.get("variants", []))
+    step = {"variant:prev": -1, "variant:next": 1}.get(callback.data)
+    if not step or count < 2:
+        await callback.answer()
+        return
+
+    update = select_variant(data, (data.get("variant_idx", 0) + step) % count)
+    await state.update_data(update)
+    await asyncio.gather(replace_preview(callback.message, state, update["generated_text"]),
+                         callback.bot.answer_callback_query(callback.id))
 
 @admin_router.callback_query(F.data == "edit_manual", StateFilter(PostState.viewing_preview))
 async def on_edit_start(callback: CallbackQuery, state: FSMContext):
-    await callback.message.answer("✍️ Пришли мне новый текст поста:")
+    data = await state.get_data()
     await state.update_data(preview_message_id=callback.message.message_id,
                             preview_chat_id=callback.message.chat.id)
-    # Удаляем старое превью чтобы не было дублей
-    try:
-        await callback.message.delete()
-    except Exception:
-        pass
     await state.set_state(PostState.waiting_for_correction)
-    await callback.answer()
+    # Удаляем старое превью (вместе с медиа над длинным текстом), чтобы не было дублей
+    await asyncio.gather(
+        callback.bot.send_message(callback.message.chat.id, "✍️ Пришли мне новый текст поста:"),
+        _delete_quietly(callback.bot, callback.message.chat.id, _preview_message_ids(data, callback.message)),
+        callback.bot.answer_callback_query(callback.id),
+    )
 
 @admin_router.callback_query(F.data == "delete", StateFilter(PostState.viewing_preview))
 async def on_delete(callback: CallbackQuery, state: FSMContext):
-    await callback.message.delete()
+    data = await state.get_data()
     await state.clear()
-    await callback.answer("Отменено")
+    await asyncio.gather(
+        _delete_quietly(callback.bot, callback.message.chat.id, _preview_message_ids(data, callback.message)),
+        callback.bot.answer_callback_query(callback.id, "Отменено"),
+    )
+
+def _editor_channels(config: Config, user_id: int) -> list[Channel]:
+    """Каналы редактора; индексы в callback_data "channel:N" — по этому списку"""
+    editor = config.editor(user_id)
+    return editor.channels if editor else []
+
+def _profile_for(config: Config, user_id: int, action: str) -> str:
+    """Профиль задержки LLM для действия редактора.
+
+    Канал черновика выбирается только при публикации, поэтому берём канал,
+    в который редактор публиковал последним, а без него — его первый канал.
+    """
+    channels = _editor_channels(config, user_id)
+    last_idx = _user_last_channel.get(user_id, 0)
+    channel = channels[last_idx] if 0 <= last_idx < len(channels) else None
+    return config.profile_for(action, channel)
 
 @admin_router.callback_query(F.data == "publish", StateFilter(PostState.viewing_preview))
-async def on_publish(callback: CallbackQuery, state: FSMContext, bot: Bot, config: Config):
+@trace.traced("publish")
+async def on_publish(callback: CallbackQuery, state: FSMContext, bot: Bot, config: Config, inflight: InflightRegistry,
+                     dedup: DedupIndex, archive: PostArchive):
     user_id = callback.from_user.id
+    channels = _editor_channels(config, user_id)
 
-    if len(config.channels) > 1:
+    if not channels:
+        await callback.answer("❌ Тебе не назначено ни одного канала", show_alert=True)
+        return
+    if len(channels) > 1:
         last_idx = _user_last_channel.get(user_id)
-        await callback.message.edit_reply_markup(reply_markup=get_channel_keyboard(config, last_idx))
+        await callback.message.edit_reply_markup(reply_markup=get_channel_keyboard(channels, last_idx))
         await state.set_state(PostState.selecting_channel)
         await callback.answer("Выберите канал для публикации")
         return
-    await _do_publish(callback, state, bot, config.channels[0].channel_id, channel_idx=0)
+    await _do_publish(callback, state, bot, inflight, dedup, archive, channels[0].channel_id, channel_idx=0)
 
 @admin_router.callback_query(F.data.startswith("channel:"), StateFilter(PostState.selecting_channel))
-async def on_channel_selected(callback: CallbackQuery, state: FSMContext, bot: Bot, config: Config):
+@trace.traced("publish")
+async def on_channel_selected(callback: CallbackQuery, state: FSMContext, bot: Bot, config: Config,
+                              inflight: InflightRegistry, dedup: DedupIndex, archive: PostArchive):
     idx = int(callback.data.split(":")[1])
-    if idx < 0 or idx >= len(config.channels):
+    channels = _editor_channels(config, callback.from_user.id)
+    if idx < 0 or idx >= len(channels):
         await callback.answer("❌ Неверный канал", show_alert=True)
         return
 
-    channel = config.channels[idx]
-    await _do_publish(callback, state, bot, channel.channel_id, channel_idx=idx)
+    channel = channels[idx]
+    await _do_publish(callback, state, bot, inflight, dedup, archive, channel.channel_id, channel_idx=idx)
 
 @admin_router.callback_query(F.data == "cancel_publish", StateFilter(PostState.selecting_channel))
 async def on_cancel_publish(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_reply_markup(reply_markup=get_action_keyboard())
+    await callback.message.edit_reply_markup(reply_markup=preview_keyboard(await state.get_data()))
     await state.set_state(PostState.viewing_preview)
     await callback.answer("Отменено")
 
-async def _do_publish(callback: CallbackQuery, state: FSMContext, bot: Bot, chat_id: str, channel_idx: int = 0):
-    _log.info(f"[ADMIN] _do_publish called: chat_id={chat_id}, channel_idx={channel_idx}")
+async def _do_publish(callback: CallbackQuery, state: FSMContext, bot: Bot, inflight: InflightRegistry,
+                      dedup: DedupIndex, archive: PostArchive, chat_id: str, channel_idx: int = 0):
     data = await state.get_data()
     text = data["generated_text"]
     entities = data.get("generated_entities", [])
-
-    _log.info(f"[ADMIN] Publishing: text_len={len(text)}, entities_count={len(entities)}")
-    _log.info(f"[ADMIN] Media type: is_album={data.get('is_album')}, media_type={data.get('media_type')}")
+    trace.event("publish", chat_id=chat_id, chars=len(text), entities=entities,
+                is_album=data.get("is_album"), media_type=data.get("media_type"))
 
     # Convert entity dicts to MessageEntity objects for Telegram API
-    tg_entities = [
-        MessageEntity(
-            type=e["type"],
-            offset=e["offset"],
-            length=e["length"],
-            url=e.get("url")
-        ) for e in entities
-    ] if entities else None
+    tg_entities = to_tg_entities(text, entities)
 
     try:
-        if data.get("is_album") and data.get("media_group"):
-            media = []
-            for i, item in enumerate(data["media_group"]):
-                if i == 0:
-                    # First item gets caption + entities
-                    if item["type"] == "photo":
-                        media.append(InputMediaPhoto(
-                            media=item["media"],
-                            caption=text,
-                            caption_entities=tg_entities
-                        ))
-                    elif item["type"] == "video":
-                        media.append(InputMediaVideo(
-                            media=item["media"],
-                            caption=text,
-                            caption_entities=tg_entities
-                        ))
-                else:
-                    if item["type"] == "photo":
-                        media.append(InputMediaPhoto(media=item["media"]))
-                    elif item["type"] == "video":
-                        media.append(InputMediaVideo(media=item["media"]))
-            await bot.send_media_group(chat_id=chat_id, media=media)
-
-        elif data.get("media_type") == "photo":
-            await bot.send_photo(chat_id=chat_id, photo=data["file_id"], caption=text, caption_entities=tg_entities)
-
-        elif data.get("media_type") == "video":
-            await bot.send_video(chat_id=chat_id, video=data["file_id"], caption=text, caption_entities=tg_entities)
+        async with inflight.track("publish", callback.message.chat.id, callback.from_user.id,
+                                  {"data": data, "target": chat_id, "channel_idx": channel_idx}):
+            if data.get("is_album") and data.get("media_group"):
+                media = []
+                for i, item in enumerate(data["media_group"]):
+                    if i == 0:
+                        # First item gets caption + entities
+                        if item["type"] == "photo":
+                            media.append(InputMediaPhoto(
+                                media=item["media"],
+                                caption=text,
+                                caption_entities=tg_entities
+                            ))
+                        elif item["type"] == "video":
+                            media.append(InputMediaVideo(
+                                media=item["media"],
+                                caption=text,
+                                caption_entities=tg_entities
+                            ))
+                    else:
+                        if item["type"] == "photo":
+                            media.append(InputMediaPhoto(media=item["media"]))
+                        elif item["type"] == "video":
+                            media.append(InputMediaVideo(media=item["media"]))
+                sent = (await bot.send_media_group(chat_id=chat_id, media=media))[0]
 
-        else:
-            if not text:
-                await callback.answer("❌ Ошибка: текст пустой, нечего публиковать!", show_alert=True)
-                return
-            await bot.send_message(chat_id=chat_id, text=text, entities=tg_entities, link_preview_options=LinkPreviewOptions(is_disabled=True))
+            elif data.get("media_type") == "photo":
+                sent = await bot.send_photo(chat_id=chat_id, photo=data["file_id"], caption=text, caption_entities=tg_entities)
+
+            elif data.get("media_type") == "video":
+                sent = await bot.send_video(chat_id=chat_id, video=data["file_id"], caption=text, caption_entities=tg_entities)
+
+            else:
+                if not text:
+                    await callback.answer("❌ Ошибка: текст пустой, нечего публиковать!", show_alert=True)
+                    return
+                sent = await bot.send_message(chat_id=chat_id, text=text, entities=tg_entities, link_preview_options=LinkPreviewOptions(is_disabled=True))
 
         _user_last_channel[callback.from_user.id] = channel_idx
 
+        fingerprint = data.get("fingerprint") or simhash(data.get("original_text", ""))
+        dedup.add_published(fingerprint, text, entities, chat_id)
+        # Запись в архив уходит в фоновую очередь, публикацию не задерживает
+        archive.record(
+            channel=chat_id, message_id=sent.message_id, model=data.get("model"),
+            rewrite_seconds=data.get("rewrite_seconds"), original_text=data.get("original_text", ""),
+            text=text, entities=entities,
+        )
+
         _log.info(f"[ADMIN] Successfully published to channel {chat_id}")
         await callback.message.edit_reply_markup(reply_markup=None)
         await callback.message.answer("✅ Опубликовано!")
         await state.clear()
+        await dedup.save_async()
 
+    except ShuttingDown:
+        await callback.answer("⏸ Бот перезапускается, опубликуй через минуту", show_alert=True)
     except Exception as e:
         _log.error(f"[ADMIN] Publish error: {e}", exc_info=True)
+        trace.dump("publish error")
         await callback.message.answer(f"Ошибка публикации: {e}")
 
 # --- РУЧНОЕ РЕДАКТИРОВАНИЕ ---
 
 @admin_router.message(StateFilter(PostState.waiting_for_correction))
-async def on_manual_text(message: Message, state: FSMContext, bot: Bot):
+async def on_manual_text(message: Message, state: FSMContext, bot: Bot, config: Config):
     new_text = message.text or ""
 
     # Preserve ALL entities from user's message (not just text_link)
@@ -373,13 +681,155 @@ async def on_manual_text(message: Message, state: FSMContext, bot: Bot):
                 entity_dict["url"] = entity.url
             new_entities.append(entity_dict)
 
-    await state.update_data(generated_text=new_text, generated_entities=new_entities)
+    # Ручная правка — тоже вариант: к сгенерированным можно вернуться
+    data = await state.get_data()
+    await state.update_data(push_variant(data, new_text, new_entities, data.get("model"), data.get("rewrite_seconds"),
+                                         limit=config.variant_history_limit))
+
+    # Удаляем сообщение пользователя с правкой (для чистоты) одновременно с отправкой нового превью
+    await asyncio.gather(
+        _delete_quietly(bot, message.chat.id, [message.message_id]),
+        send_preview(message, state, new_text, is_new=True),
+    )
+
+# --- КОМАНДЫ ---
+
+@admin_router.message(Command("validation"))
+async def cmd_validation(message: Message, config: Config, llm: LLMService):
+    """Доля ответов модели, нарушивших каждое жёсткое правило промпта"""
+    if message.from_user.id != config.admin_id:
+        return
+    await message.answer(f"📏 Проверка ответов LLM\n\n{llm.validation_stats.summary()}", parse_mode=None)
 
-    # Пытаемся удалить сообщение пользователя с правкой (для чистоты)
+SEARCH_DATE = re.compile(r'\b(from|to):(\d{4}-\d{2}-\d{2})\b')
+
+@admin_router.message(Command("search"))
+async def cmd_search(message: Message, config: Config, archive: PostArchive):
+    """Поиск по архиву опубликованного: /search слова from:2024-01-01 to:2024-01-31"""
+    if config.editor(message.from_user.id) is None:
+        return
+    query = message.text.partition(" ")[2]
+    bounds = {}
     try:
-        await message.delete()
-    except Exception:
-        pass
+        for key, value in SEARCH_DATE.findall(query):
+            bounds[key] = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        await message.answer("❌ Дата должна быть в формате ГГГГ-ММ-ДД")
+        return
+    keywords = SEARCH_DATE.sub(" ", query).strip()
+    if not keywords and not bounds:
+        await message.answer("🔎 /search слова [from:ГГГГ-ММ-ДД] [to:ГГГГ-ММ-ДД]")
+        return
+
+    date_from = bounds["from"].timestamp() if "from" in bounds else None
+    # to: включительно, до конца дня
+    date_to = (bounds["to"] + timedelta(days=1)).timestamp() if "to" in bounds else None
+    posts = await archive.search(keywords, date_from, date_to)
+    if not posts:
+        await message.answer("🔎 Ничего не найдено")
+        return
+
+    lines = []
+    for post in posts:
+        published = datetime.fromtimestamp(post.published_at).strftime("%Y-%m-%d %H:%M")
+        lines.append(f"{published} · {post.channel} #{post.message_id}\n{post.snippet}")
+    await message.answer(f"🔎 Найдено: {len(posts)}\n\n" + "\n\n".join(lines), parse_mode=None)
 
-    # Возвращаем новое превью
-    await send_preview(message, state, new_text, is_new=True)
\ No newline at end of file
+@admin_router.message(Command("stats"))
+async def cmd_stats(message: Message, config: Config, llm: LLMService):
+    """Расход токенов по моделям, назначению и редакторам, бюджет, ожидание в очереди LLM"""
+    if config.editor(message.from_user.id) is None:
+        return
+    names = {e.user_id: e.name for e in config.editors}
+    lines = []
+    for owner, (calls, average_wait) in sorted(llm.scheduler.wait_stats().items(), key=lambda item: -item[1][0]):
+        lines.append(f"  {names.get(owner, owner) if owner is not None else 'bulk'}: "
+                     f"{calls} вызовов, ожидание в среднем {average_wait:.1f} с")
+    queue = "\n\nОчередь LLM с запуска:\n" + "\n".join(lines) if lines else ""
+    await message.answer(f"📊 Токены\n\n{llm.usage.summary(names)}{queue}", parse_mode=None)
+
+@admin_router.message(Command("trace"))
+async def cmd_trace(message: Message, config: Config):
+    """Отладочная трасса последних N запросов: /trace [N]"""
+    if message.from_user.id != config.admin_id:
+        return
+    args = (message.text or "").split()
+    count = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1
+    trace_ids = trace.recorder.trace_ids()[-max(1, count):]
+    if not trace_ids:
+        await message.answer("🧵 Трасса пуста")
+        return
+    dump = "\n\n".join("\n".join(trace.recorder.format(trace_id)) for trace_id in trace_ids)
+    if len(dump) <= TRACE_MESSAGE_LIMIT:
+        await message.answer(dump, parse_mode=None)
+    else:
+        await message.answer_document(BufferedInputFile(dump.encode(), filename="trace.txt"),
+                                      caption=f"🧵 Трасс: {len(trace_ids)}")
+
+# --- ВОССТАНОВЛЕНИЕ ПОСЛЕ ПЕРЕЗАПУСКА ---
+
+async def resume_pending(bot: Bot, dispatcher: Dispatcher, llm: LLMService, inflight: InflightRegistry):
+    """Поднимает черновики, которые не успели обработаться до остановки бота."""
+    count = inflight.load_checkpoint()
+    if not count:
+        return
+    _log.info(f"[ADMIN] Resuming {count} job(s) from checkpoint")
+
+    while job := inflight.next_pending():
+        state = dispatcher.fsm.get_context(bot=bot, chat_id=job.chat_id, user_id=job.user_id)
+        await state.set_data(job.payload["data"])
+        try:
+            if job.kind == "rewrite":
+                processing_msg = await bot.send_message(job.chat_id, "♻️ Восстанавливаю черновик после перезапуска...")
+                with trace.start_trace("resume"):
+                    await _generate_preview(processing_msg, state, llm, inflight, job.user_id, priority="normal",
+                                            profile=_profile_for(dispatcher["config"], job.user_id, "draft"))
+            elif job.kind == "publish":
+                # Публикацию не повторяем автоматически: часть альбома могла уже уйти в канал
+                notice = await bot.send_message(
+                    job.chat_id,
+                    "⚠️ Публикация была прервана перезапуском. Проверь канал перед повторной публикацией."
+                )
+                await send_preview(notice, state, job.payload["data"]["generated_text"], is_new=True)
+        except Exception as e:
+            _log.error(f"[ADMIN] Resume of {job.describe()} failed: {e}", exc_info=True)
+
+async def _next_parked(bot: Bot, dispatcher: Dispatcher, inflight: InflightRegistry):
+    """Первый отложенный пост редактора, у которого нет открытого черновика: (job, state)"""
+    while inflight.parked:
+        for job in list(inflight.parked):
+            state = dispatcher.fsm.get_context(bot=bot, chat_id=job.chat_id, user_id=job.user_id)
+            # Не затираем черновик, который редактор смотрит или который сейчас генерируется
+            if await state.get_state() is None and not any(j.user_id == job.user_id for j in inflight.jobs):
+                return job, state
+        await asyncio.sleep(PARKED_POLL_INTERVAL)
+    return None
+
+async def process_parked(bot: Bot, dispatcher: Dispatcher, llm: LLMService, inflight: InflightRegistry):
+    """Переписывает отложенные форварды, как только LLM снова доступен.
+
+    Первый отложенный пост сам служит пробным запросом (half-open).
+    Пост редактора берётся, только когда он закончил с текущим черновиком;
+    занятый редактор не задерживает отложенные посты остальных.
+    """
+    while True:
+        await inflight.wait_parked()
+        await llm.breaker.wait_ready()
+        picked = await _next_parked(bot, dispatcher, inflight)
+        if picked is None:
+            continue
+        job, state = picked
+
+        text = "⏳ Сервис снова доступен, обрабатываю отложенный пост..."
+        try:
+            processing_msg = await bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.payload["message_id"])
+        except TelegramBadRequest:
+            processing_msg = await bot.send_message(job.chat_id, text)
+        inflight.parked.remove(job)
+        await state.set_data(job.payload["data"])
+        try:
+            with trace.start_trace("parked"):
+                await _generate_preview(processing_msg, state, llm, inflight, job.user_id, front=True, priority="normal",
+                                        profile=_profile_for(dispatcher["config"], job.user_id, "draft"))
+        except Exception as e:
+            _log.error(f"[ADMIN] Parked {job.describe()} failed: {e}", exc_info=True)
@@ -1,53 +1,316 @@
 #!/usr/bin/env python3
 """
-Script to list available models in Vertex AI
+Latency and quality probe of candidate models × Vertex AI regions.
+
+Sends a fixed corpus of representative posts (with link tokens, exactly as
+LLMService prepares them) to every model in every region, concurrently, and
+measures per combination:
+  - time to first token (streaming) and total latency, p50/p95
+  - output tokens per second after the first token
+  - token preservation: share of ⟦LINK:n⟧ tokens returned exactly once
+  - average cost per post
+
+Results go to PROBE_RESULTS_PATH (data/probe.json). Its "recommended"
+region is the one where every probed model passes and the heavy model
+(the first of --models) is fastest; it becomes the default of load_config()
+when VERTEX_LOCATION is not set. Models are never picked on latency: the
+heavy/fast pair stays what VERTEX_MODEL / VERTEX_FAST_MODEL say.
+
+Usage:
+    python list_models.py --models gemini-2.5-pro,gemini-2.5-flash --regions us-central1,europe-west4
+    python list_models.py --repeat 3 --concurrency 8 --output data/probe.json
+    python list_models.py --stub                      # offline stand-in, no Vertex calls
+
+VERTEX_LOCATION may stay unset when --regions is given; leave it unset in
+.env for the probed region to take effect.
+    python list_models.py --list --regions us-central1  # just list available models
 """
+import os
+import re
+import sys
+import json
+import time
 import asyncio
+import logging
+import argparse
+from collections import Counter
+from datetime import datetime
+from statistics import median
+
 from google import genai
+from google.genai import types
+
+from config import Config, LatencyProfile, load_config
+from services.llm import LLMService, REWRITE_INSTRUCTION, output_budget, thinking_config
+from services.pricing import estimate_cost
+from services.stub import StubClient
+from services.validation import ANY_LINK_TOKEN
+from utils.utf16 import Utf16Index
+
+_log = logging.getLogger("probe")
+
+# Representative posts; [anchor](url) becomes a text_link entity, bare URLs stay raw links
+CORPUS = [
+    "Наткнулся на [разбор](https://example.com/agents?utm_source=tg) того, как агенты ломаются на длинных задачах. "
+    "Главное - не модель, а то, как устроена память между шагами",
+    "Три наблюдения после месяца с LLM в проде.\n\n"
+    "Первое: промпт живёт дольше, чем кажется, и его надо версионировать как код. "
+    "Второе: [evals](https://example.com/evals) важнее любой интуиции.\n\n"
+    "Третье: латентность 🐢 решает больше, чем качество на бенчмарках. Подробнее тут https://example.com/latency",
+    "Интересный кейс 🚀 [Команда](https://example.com/team) перевела поиск на эмбеддинги и потеряла половину "
+    "точных совпадений. Вернули BM25 рядом с векторами, и всё встало на место.\n\n"
+    "Гибридный поиск до сих пор недооценён. Особенно когда в запросах артикулы, фамилии и версии, "
+    "а не \"смысл\". Сравнение подходов: https://example.com/hybrid и [вторая часть](https://example.com/hybrid-2)",
+    "Короткая мысль: если агенту нужно больше пяти инструментов, скорее всего, ему нужен не агент, а workflow",
+    "Перечитал старые заметки про RAG 📚 и понял, что половина проблем была не в retrieval, "
+    "а в том, как мы резали документы. Чанки по 512 токенов без учёта структуры - это лотерея.\n\n"
+    "Сейчас режем по заголовкам и абзацам, храним путь раздела рядом с текстом. "
+    "[Пример пайплайна](https://example.com/pipeline) и [код](https://example.com/code).\n\n"
+    "Отдельно помогло переписывать вопрос пользователя перед поиском. Дёшево и заметно",
+]
+MARKDOWN_LINK = re.compile(r'\[([^\]]+)\]\(([^)]+)\)')
+
+
+def _corpus_post(source: str) -> tuple[str, list[dict]]:
+    """[anchor](url) markup -> (text, Telegram text_link entities in UTF-16 units)."""
+    text, spans, last = "", [], 0
+    for match in MARKDOWN_LINK.finditer(source):
+        text += source[last:match.start()]
+        spans.append((len(text), len(text) + len(match.group(1)), match.group(2)))
+        text += match.group(1)
+        last = match.end()
+    text += source[last:]
+    index = Utf16Index(text)
+    entities = []
+    for start, end, url in spans:
+        offset, length = index.to_entity_span(start, end)
+        entities.append({"type": "text_link", "offset": offset, "length": length, "url": url})
+    return text, entities
 
-async def list_models():
-    client = genai.Client(
-        vertexai=True,
-        project="gen-lang-client-0116875412",
-        location="us-central1"
+
+def _percentile(values: list[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def prepare_corpus(config: Config) -> list[tuple[str, list[str], int]]:
+    """(prompt, link tokens, output budget) per post, built as the bot builds a draft's."""
+    profile = config.llm_profiles[config.llm_profile_draft]
+    prepared = []
+    for source in CORPUS:
+        text, entities = _corpus_post(source)
+        text_safe, links = LLMService._extract_all_links(text, entities)
+        budget = output_budget(text_safe, config.llm_output_reserve, config.llm_output_ratio,
+                               config.llm_output_floor, config.llm_output_ceiling, profile)
+        prepared.append((LLMService._build_prompt(REWRITE_INSTRUCTION, text_safe), list(links), budget))
+    return prepared
+
+
+async def probe_one(client, model: str, prompt: str, tokens: list[str], profile: LatencyProfile,
+                    budget: int) -> dict:
+    """One streamed call: timings, usage and how many link tokens came back exactly once."""
+    config = types.GenerateContentConfig(
+        temperature=profile.temperature,
+        max_output_tokens=budget,
+        thinking_config=thinking_config(model, profile.thinking_budget),
     )
+    started = time.monotonic()
+    first_token = None
+    parts, usage = [], None
+    stream = await client.aio.models.generate_content_stream(model=model, contents=prompt, config=config)
+    async for chunk in stream:
+        if chunk.text:
+            if first_token is None:
+                first_token = time.monotonic() - started
+            parts.append(chunk.text)
+        if chunk.usage_metadata:
+            usage = chunk.usage_metadata
+    latency = time.monotonic() - started
+    answer = "".join(parts)
+
+    found = Counter(ANY_LINK_TOKEN.findall(answer))
+    prompt_tokens = (usage.prompt_token_count or 0) if usage else 0
+    output_tokens = (usage.candidates_token_count or 0) if usage else 0
+    thinking_tokens = (usage.thoughts_token_count or 0) if usage else 0
+    first_token = first_token if first_token is not None else latency
+    generation = latency - first_token
+    return {
+        "ttft": first_token,
+        "latency": latency,
+        # Single-chunk answers have no measurable generation phase: fall back to the whole call
+        "tokens_per_second": output_tokens / (generation if generation > 0.05 else latency) if latency else 0.0,
+        "preserved": sum(1 for token in tokens if found[token] == 1),
+        "tokens": len(tokens),
+        "cost": estimate_cost(model, prompt_tokens, output_tokens + thinking_tokens),
+    }
+
+
+def summarize_samples(model: str, region: str, samples: list[dict], errors: list[str]) -> dict:
+    result = {"model": model, "region": region, "samples": len(samples), "errors": len(errors)}
+    if errors:
+        result["last_error"] = errors[-1][:200]
+    if not samples:
+        return result
+    ttft = [s["ttft"] for s in samples]
+    latency = [s["latency"] for s in samples]
+    costs = [s["cost"] for s in samples if s["cost"] is not None]
+    tokens = sum(s["tokens"] for s in samples)
+    result.update({
+        "ttft_p50": round(median(ttft), 3),
+        "ttft_p95": round(_percentile(ttft, 0.95), 3),
+        "latency_p50": round(median(latency), 3),
+        "latency_p95": round(_percentile(latency, 0.95), 3),
+        "tokens_per_second": round(median(s["tokens_per_second"] for s in samples), 1),
+        "preservation": round(sum(s["preserved"] for s in samples) / tokens, 4) if tokens else 1.0,
+        "cost_per_post": round(sum(costs) / len(costs), 6) if costs else None,
+    })
+    return result
+
+
+def recommend(results: list[dict], min_preservation: float, models: list[str]) -> dict | None:
+    """Region where every model passes (no errors, enough link tokens kept), by p50 latency.
 
-    print("Listing available models...")
-    try:
-        models = await client.aio.models.list()
-        print("\nAvailable models:")
-        async for model in models:
-            print(f"  - {model.name}")
-            if hasattr(model, 'display_name'):
-                print(f"    Display: {model.display_name}")
-    except Exception as e:
-        print(f"Error listing models: {e}")
-        print("\nTrying to list Claude models specifically...")
-
-        # Try specific Claude model names
-        claude_models = [
-            "claude-3-5-sonnet@20240620",
-            "claude-3-5-sonnet-v2@20241022",
-            "claude-3-opus@20240229",
-            "claude-3-sonnet@20240229",
-            "claude-3-haiku@20240307",
-        ]
-
-        for model_name in claude_models:
+    The bot's cascade uses all models through one regional client, so the
+    region must serve each of them; the heavy model (models[0]) serving most
+    drafts decides, the others break ties. No model is ever recommended.
+    """
+    by_region: dict[str, dict[str, dict]] = {}
+    for r in results:
+        by_region.setdefault(r["region"], {})[r["model"]] = r
+
+    def passes(r: dict | None) -> bool:
+        return bool(r and r["samples"] and not r["errors"] and r.get("preservation", 0) >= min_preservation)
+
+    eligible = {region: rows for region, rows in by_region.items() if all(passes(rows.get(m)) for m in models)}
+    if not eligible:
+        return None
+    region = min(eligible, key=lambda region: [eligible[region][m]["latency_p50"] for m in models])
+    return {"region": region, "latency_p50": {m: eligible[region][m]["latency_p50"] for m in models}}
+
+
+async def run_probe(args, config) -> dict:
+    prepared = prepare_corpus(config)
+    profile = config.llm_profiles[config.llm_profile_draft]
+
+    if args.stub:
+        clients = {region: StubClient(latency=args.stub_latency) for region in args.regions}
+    else:
+        clients = {
+            region: genai.Client(vertexai=True, project=config.vertex_project_id, location=region)
+            for region in args.regions
+        }
+        # Open connections and fetch credentials before anything is timed
+        await asyncio.gather(*(
+            client.aio.models.count_tokens(model=args.models[0], contents="ping") for client in clients.values()
+        ), return_exceptions=True)
+
+    slots = asyncio.Semaphore(args.concurrency)
+    samples: dict[tuple[str, str], list[dict]] = {(m, r): [] for m in args.models for r in args.regions}
+    errors: dict[tuple[str, str], list[str]] = {key: [] for key in samples}
+
+    async def sample(model: str, region: str, prompt: str, tokens: list[str], budget: int):
+        async with slots:
             try:
-                response = await client.aio.models.generate_content(
-                    model=model_name,
-                    contents="test"
+                samples[(model, region)].append(
+                    await asyncio.wait_for(probe_one(clients[region], model, prompt, tokens, profile, budget), args.timeout)
                 )
-                print(f"✅ {model_name} - WORKS")
             except Exception as e:
-                error_msg = str(e)
-                if "404" in error_msg:
-                    print(f"❌ {model_name} - NOT FOUND")
-                elif "403" in error_msg:
-                    print(f"⚠️  {model_name} - NO ACCESS (billing?)")
-                else:
-                    print(f"❌ {model_name} - ERROR: {error_msg[:100]}")
+                errors[(model, region)].append(f"{type(e).__name__}: {e}")
+
+    started = time.monotonic()
+    await asyncio.gather(*(
+        sample(model, region, prompt, tokens, budget)
+        for _ in range(args.repeat)
+        for model in args.models
+        for region in args.regions
+        for prompt, tokens, budget in prepared
+    ))
+
+    results = [summarize_samples(model, region, samples[(model, region)], errors[(model, region)])
+               for model, region in samples]
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "stub": args.stub,
+        "corpus": len(CORPUS),
+        "repeat": args.repeat,
+        "seconds": round(time.monotonic() - started, 1),
+        "min_preservation": args.min_preservation,
+        "results": results,
+        "recommended": recommend(results, args.min_preservation, args.models),
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{'model':<28} {'region':<16} {'ttft p50':>8} {'lat p50':>8} {'lat p95':>8} "
+          f"{'tok/s':>7} {'links':>7} {'$/post':>9} {'err':>4}")
+    for r in sorted(report["results"], key=lambda r: r.get("latency_p50", float("inf"))):
+        if not r["samples"]:
+            print(f"{r['model']:<28} {r['region']:<16} {'-':>8} {'-':>8} {'-':>8} {'-':>7} {'-':>7} {'-':>9} "
+                  f"{r['errors']:>4}  {r.get('last_error', '')}")
+            continue
+        cost = f"{r['cost_per_post']:.5f}" if r["cost_per_post"] is not None else "?"
+        print(f"{r['model']:<28} {r['region']:<16} {r['ttft_p50']:>8.2f} {r['latency_p50']:>8.2f} "
+              f"{r['latency_p95']:>8.2f} {r['tokens_per_second']:>7.1f} {r['preservation']:>7.1%} "
+              f"{cost:>9} {r['errors']:>4}")
+    recommended = report["recommended"]
+    print(f"\nRecommended region: {recommended['region'] if recommended else 'none (no region passes for every model)'}")
+
+
+async def list_models(config, regions: list[str]):
+    for region in regions:
+        client = genai.Client(vertexai=True, project=config.vertex_project_id, location=region)
+        print(f"Models in {region}:")
+        try:
+            async for model in await client.aio.models.list():
+                print(f"  - {model.name}" + (f" ({model.display_name})" if model.display_name else ""))
+        except Exception as e:
+            print(f"  Error listing models: {e}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Probe latency and link-token preservation of models × regions")
+    parser.add_argument("--models", help="comma-separated, heavy model first; default: VERTEX_MODEL and VERTEX_FAST_MODEL")
+    parser.add_argument("--regions", help="comma-separated; default: VERTEX_LOCATION")
+    parser.add_argument("--repeat", type=int, default=2, help="passes over the corpus per combination")
+    parser.add_argument("--concurrency", type=int, default=8, help="calls in flight across all combinations")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds per call")
+    parser.add_argument("--min-preservation", type=float, default=0.98,
+                        help="least share of link tokens kept for a combination to be recommended")
+    parser.add_argument("--output", help="results JSON; default: PROBE_RESULTS_PATH")
+    parser.add_argument("--stub", action="store_true", help="offline stand-in client instead of Vertex AI")
+    parser.add_argument("--stub-latency", type=float, default=0.3, help="simulated seconds to first token (--stub)")
+    parser.add_argument("--list", action="store_true", help="only list the models available in --regions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stdout)
+    if args.stub:
+        os.environ.setdefault("VERTEX_PROJECT_ID", "offline")
+        os.environ.setdefault("VERTEX_LOCATION", "offline")
+    if args.regions:
+        # Probing is how a region gets chosen, so it can't require one up front
+        os.environ.setdefault("VERTEX_LOCATION", args.regions.split(",")[0])
+    config = load_config(for_bot=False)
+    args.models = [m for m in (args.models or "").split(",") if m] or \
+        list(dict.fromkeys(m for m in (config.vertex_model, config.vertex_fast_model) if m))
+    args.regions = [r for r in (args.regions or "").split(",") if r] or [config.vertex_location]
+
+    if args.list:
+        await list_models(config, args.regions)
+        return
+
+    print(f"Probing {len(args.models)} model(s) × {len(args.regions)} region(s), "
+          f"{len(CORPUS)} posts × {args.repeat}...")
+    report = await run_probe(args, config)
+    print_report(report)
+
+    output = args.output or config.probe_results_path
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}")
+
 
 if __name__ == '__main__':
-    asyncio.run(list_models())
+    asyncio.run(main())
@@ -9,9 +9,13 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import load_config
-from handlers.admin import admin_router
+from handlers.admin import admin_router, resume_pending, process_parked, speculate_album_rewrite
 from middlewares.album import AlbumMiddleware
 from services.llm import LLMService
+from services.dedup import DedupIndex
+from services.archive import PostArchive
+from utils.inflight import InflightRegistry
+from utils import trace
 
 async def main():
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
@@ -23,22 +27,49 @@ async def main():
     dp = Dispatcher(storage=MemoryStorage())
     
     # Сервисы
+    trace.recorder.configure(config.trace_capacity)
     llm_service = LLMService(config)
+    # Прогреваем соединения и токен до первого форварда
+    await llm_service.warm_up()
+    llm_service.start_keepalive()
+    llm_service.usage.start()
+    inflight = InflightRegistry(config.checkpoint_path)
+    dedup = DedupIndex(config.dedup_path, config.dedup_capacity, config.dedup_max_distance)
+    dedup.load()
+    archive = PostArchive(config.archive_path)
+    archive.start()
 
     # Прокидываем объекты внутрь хендлеров
     dp['config'] = config
     dp['llm'] = llm_service
+    dp['inflight'] = inflight
+    dp['dedup'] = dedup
+    dp['archive'] = archive
     
     # Подключаем Middleware и Роутеры
-    dp.message.middleware(AlbumMiddleware())
+    dp.message.middleware(AlbumMiddleware(speculate=speculate_album_rewrite))
     dp.include_router(admin_router)
     
     logging.info('🚀 Attention Log Bot started!')
     
+    # Досылаем то, что не успели до прошлой остановки
+    resume_task = asyncio.create_task(resume_pending(bot, dp, llm_service, inflight))
+    # Форварды, отложенные пока Vertex AI недоступен
+    parked_task = asyncio.create_task(process_parked(bot, dp, llm_service, inflight))
+
     try:
         await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        # SIGTERM/SIGINT останавливает polling; сессию закрываем сами после drain
+        await dp.start_polling(bot, close_bot_session=False)
     finally:
+        # Drain: новые апдейты уже не принимаются, ждём текущие rewrite/publish
+        drained, abandoned = await inflight.drain(config.shutdown_deadline)
+        logging.info(f'🛑 Shutdown: drained={len(drained)}, abandoned={len(abandoned)}')
+        resume_task.cancel()
+        parked_task.cancel()
+        dedup.save()
+        await archive.close()
+        await llm_service.close()
         await bot.session.close()
 
 if __name__ == '__main__':
@@ -1,14 +1,34 @@
 import asyncio
 import time
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 
+from utils import trace
+
 class AlbumMiddleware(BaseMiddleware):
-    def __init__(self, latency: float = 0.5, cleanup_timeout: float = 60.0):
+    """Collects media group parts for `latency` seconds and calls the handler once with data["album"].
+
+    speculate(event, data) may start work on the caption while the parts are
+    still arriving; it returns (caption, task) or None. The pair is passed to
+    the handler as data["album_rewrite"], and the task is cancelled if the
+    handler didn't await it.
+    """
+
+    def __init__(self, latency: float = 0.5, cleanup_timeout: float = 60.0,
+                 speculate: Callable[[Message, Dict[str, Any]], tuple[str, asyncio.Task] | None] | None = None):
         self.latency = latency
         self.cleanup_timeout = cleanup_timeout
+        self.speculate = speculate
         self.album_data: Dict[str, tuple[List[Message], float]] = {}
+        self.speculative: Dict[str, tuple[str, asyncio.Task]] = {}
+
+    def _speculate(self, media_group_id: str, event: Message, data: Dict[str, Any]) -> None:
+        # The caption is usually on the first part, but may come with any of them
+        if self.speculate and event.caption and media_group_id not in self.speculative:
+            started = self.speculate(event, data)
+            if started:
+                self.speculative[media_group_id] = started
 
     async def __call__(self, handler, event: Message, data: Dict[str, Any]) -> Any:
         if not event.media_group_id:
@@ -27,14 +47,29 @@ class AlbumMiddleware(BaseMiddleware):
 
         if media_group_id in self.album_data:
             self.album_data[media_group_id][0].append(event)
+            self._speculate(media_group_id, event, data)
             return
 
-        self.album_data[media_group_id] = ([event], current_time)
-        await asyncio.sleep(self.latency)
+        # One trace for the speculative rewrite and the handler that joins it
+        with trace.start_trace("forward"):
+            self.album_data[media_group_id] = ([event], current_time)
+            self._speculate(media_group_id, event, data)
+            await asyncio.sleep(self.latency)
 
-        album_messages, _ = self.album_data.pop(media_group_id, ([], 0))
-        if album_messages:
-            album_messages.sort(key=lambda x: x.message_id)
-            data["album"] = album_messages
+            album_messages, _ = self.album_data.pop(media_group_id, ([], 0))
+            speculative = self.speculative.pop(media_group_id, None)
+            if album_messages:
+                album_messages.sort(key=lambda x: x.message_id)
+                data["album"] = album_messages
+            if speculative:
+                data["album_rewrite"] = speculative
 
-        return await handler(event, data)
\ No newline at end of file
+            try:
+                return await handler(event, data)
+            finally:
+                if speculative:
+                    task = speculative[1]
+                    if not task.done():
+                        task.cancel()
+                    elif not task.cancelled():
+                        task.exception()  # the handler didn't use it: don't log "never retrieved"
@@ -0,0 +1,180 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+_log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    published_at REAL NOT NULL,
+    channel TEXT NOT NULL,
+    message_id INTEGER,
+    model TEXT,
+    rewrite_seconds REAL,
+    original_text TEXT NOT NULL,
+    text TEXT NOT NULL,
+    entities TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_published_at ON posts (published_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+    original_text, text, content='posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS posts_ai AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_fts (rowid, original_text, text) VALUES (
+        new.id,
+        replace(replace(new.original_text, 'ё', 'е'), 'Ё', 'Е'),
+        replace(replace(new.text, 'ё', 'е'), 'Ё', 'Е')
+    );
+END;
+"""
+
+INSERT = """
+INSERT INTO posts (published_at, channel, message_id, model, rewrite_seconds, original_text, text, entities)
+VALUES (:published_at, :channel, :message_id, :model, :rewrite_seconds, :original_text, :text, :entities)
+"""
+
+QUERY_WORD = re.compile(r'\w+')
+
+
+@dataclass
+class ArchivedPost:
+    published_at: float
+    channel: str
+    message_id: int | None
+    model: str | None
+    snippet: str
+
+
+def _fts_query(keywords: str) -> str:
+    """User keywords -> FTS5 query: every word must match, as a prefix.
+
+    unicode61 does not fold ё into е, so both the index and the query do it.
+    """
+    words = QUERY_WORD.findall(keywords.lower().replace("ё", "е"))
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class PostArchive:
+    """SQLite + FTS5 archive of published posts.
+
+    `record()` only enqueues, a background writer inserts in batches from a
+    worker thread, so publishing never waits on disk. `close()` lets the
+    writer finish what it has taken and everything queued before closing.
+    """
+
+    def __init__(self, path: str, batch_size: int = 50, flush_interval: float = 2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[dict | None] = asyncio.Queue()  # None stops the writer
+        self._lock = threading.Lock()
+        self._writer: asyncio.Task | None = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def start(self) -> None:
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+
+    def record(self, *, channel: str, message_id: int | None, model: str | None, rewrite_seconds: float | None,
+               original_text: str, text: str, entities: list[dict]) -> None:
+        self._queue.put_nowait({
+            "published_at": time.time(),
+            "channel": channel,
+            "message_id": message_id,
+            "model": model,
+            "rewrite_seconds": rewrite_seconds,
+            "original_text": original_text,
+            "text": text,
+            "entities": json.dumps(entities, ensure_ascii=False),
+        })
+
+    def _insert(self, rows: list[dict]) -> None:
+        with self._lock, self._db:
+            self._db.executemany(INSERT, rows)
+
+    async def _write_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is None:
+                return
+            rows = [row]
+            # Collect a batch for up to flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    # Closing: write this batch now, then stop
+                    stopping = True
+                    break
+                rows.append(row)
+            try:
+                await asyncio.to_thread(self._insert, rows)
+            except sqlite3.Error as e:
+                _log.error(f"[ARCHIVE] Failed to write {len(rows)} post(s): {e}")
+
+    async def close(self) -> None:
+        if self._writer:
+            # Not cancelled: rows it already took would be lost, and its insert could race db.close()
+            self._queue.put_nowait(None)
+            await self._writer
+            self._writer = None
+        rows = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not None:
+                rows.append(row)
+        if rows:
+            self._insert(rows)
+        self._db.close()
+
+    def _search(self, keywords: str, date_from: float | None, date_to: float | None, limit: int) -> list[ArchivedPost]:
+        where, params = [], {"limit": limit}
+        if date_from is not None:
+            where.append("p.published_at >= :date_from")
+            params["date_from"] = date_from
+        if date_to is not None:
+            where.append("p.published_at < :date_to")
+            params["date_to"] = date_to
+
+        query = _fts_query(keywords)
+        if query:
+            sql = ("SELECT p.published_at, p.channel, p.message_id, p.model, "
+                   "snippet(posts_fts, 1, '«', '»', '…', 12) "
+                   "FROM posts_fts JOIN posts p ON p.id = posts_fts.rowid "
+                   "WHERE posts_fts MATCH :query")
+            params["query"] = query
+            if where:
+                sql += " AND " + " AND ".join(where)
+            sql += " ORDER BY rank LIMIT :limit"
+        else:
+            sql = "SELECT published_at, channel, message_id, model, substr(text, 1, 120) FROM posts p"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            sql += " ORDER BY published_at DESC LIMIT :limit"
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [ArchivedPost(*row) for row in rows]
+
+    async def search(self, keywords: str, date_from: float | None = None, date_to: float | None = None,
+                     limit: int = 10) -> list[ArchivedPost]:
+        return await asyncio.to_thread(self._search, keywords, date_from, date_to, limit)
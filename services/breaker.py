@@ -0,0 +1,125 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import httpx
+from google.genai import errors
+
+_log = logging.getLogger(__name__)
+
+# Client errors that mean "the backend is unusable right now", not "bad request":
+# auth, billing disabled (403 PERMISSION_DENIED), quota exhausted
+BACKEND_CLIENT_CODES = {401, 403, 429}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling the backend while the circuit is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM backend unavailable, next probe in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    if isinstance(error, errors.ServerError):
+        return True
+    if isinstance(error, errors.ClientError):
+        return error.code in BACKEND_CLIENT_CODES
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive backend failures.
+
+    While open every call fails immediately with CircuitOpen. After
+    `reset_timeout` one call is let through as a probe (half-open): success
+    closes the circuit, failure reopens it and doubles the timeout up to
+    `max_reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0, max_reset_timeout: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = "closed"  # "closed" | "open" | "half_open"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._closed = asyncio.Event()
+        self._closed.set()
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until a probe is allowed (0 when calls go through)."""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def _open(self) -> None:
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self._closed.clear()
+        _log.error(f"[BREAKER] Open after {self.failures} failure(s), probing in {self.reset_timeout:.0f}s")
+
+    def _close(self) -> None:
+        if self.state != "closed":
+            _log.info("[BREAKER] Closed, backend recovered")
+        self.state = "closed"
+        self.failures = 0
+        self.reset_timeout = self.base_reset_timeout
+        self._closed.set()
+
+    def _before_call(self) -> None:
+        if self.state == "closed":
+            return
+        if self.state == "open" and not self.retry_after:
+            self.state = "half_open"
+            _log.info("[BREAKER] Half-open, probing backend")
+            return
+        # Open, or half-open with the probe still in flight
+        raise CircuitOpen(self.retry_after or self.reset_timeout)
+
+    def _on_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open":
+            self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+            self._open()
+        elif self.state == "closed" and self.failures >= self.failure_threshold:
+            self._open()
+
+    @asynccontextmanager
+    async def guard(self):
+        self._before_call()
+        probe = self.state == "half_open"
+        try:
+            yield
+        except Exception as e:
+            if is_backend_failure(e):
+                self._on_failure()
+            elif probe:
+                # The backend answered (e.g. 400 for this prompt): it is up
+                self._close()
+            raise
+        except BaseException:
+            if probe:
+                # Cancelled probe proved nothing, let the next call probe again
+                self.state = "open"
+                self.opened_at = time.monotonic() - self.reset_timeout
+            raise
+        else:
+            self._close()
+
+    async def wait_ready(self) -> None:
+        """Wait until a call would go through, either normally or as the probe."""
+        while self.state != "closed":
+            if self.state == "open":
+                if not self.retry_after:
+                    return
+                await asyncio.sleep(self.retry_after)
+            else:
+                # Someone else's probe is in flight
+                try:
+                    await asyncio.wait_for(self._closed.wait(), 1.0)
+                except asyncio.TimeoutError:
+                    pass
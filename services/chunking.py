@@ -0,0 +1,58 @@
+import re
+
+from services.validation import ANY_LINK_TOKEN
+
+PARAGRAPH_SPLIT = re.compile(r'\n\s*\n')
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s')
+
+
+def split_chunks(text: str, target_chars: int) -> list[str]:
+    """Group paragraphs into chunks of about target_chars.
+
+    Splits only at paragraph boundaries, so a ⟦LINK:n⟧ token (never contains
+    a blank line) always lands in exactly one chunk. A paragraph longer than
+    target_chars becomes a chunk of its own.
+    """
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for paragraph in PARAGRAPH_SPLIT.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and size + len(paragraph) > target_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def summarize(text: str, max_chars: int = 500) -> str:
+    """Extractive summary: the opening sentence of every paragraph.
+
+    Used as shared context for chunk rewrites; built locally so it does not
+    add an LLM round-trip before the parallel calls.
+    """
+    sentences = []
+    for paragraph in PARAGRAPH_SPLIT.split(text):
+        paragraph = ANY_LINK_TOKEN.sub("", paragraph).strip()
+        if paragraph:
+            sentences.append(SENTENCE_END.split(paragraph, maxsplit=1)[0])
+    summary = " ".join(sentences)
+    if len(summary) > max_chars:
+        summary = summary[:max_chars].rsplit(" ", 1)[0] + "…"
+    return summary
+
+
+def paragraph_spans(text: str) -> list[tuple[int, int]]:
+    """(start, end) code point slices of the non-empty paragraphs, in order."""
+    spans = []
+    start = 0
+    for match in PARAGRAPH_SPLIT.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+    return [(start, end) for start, end in spans if text[start:end].strip()]
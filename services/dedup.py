@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from itertools import islice
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+
+from utils.text import LINK_PATTERN
+
+_log = logging.getLogger(__name__)
+
+WORD = re.compile(r'\w+')
+SHINGLE = 2  # words per shingle (short posts need small shingles to stay stable under edits)
+# bytes without bit j set: len(column.translate(None, _WITHOUT_BIT[j])) counts bytes with bit j
+_WITHOUT_BIT = [bytes(v for v in range(256) if not (v >> j) & 1) for j in range(8)]
+
+
+def normalize(text: str) -> str:
+    """Lowercase words only: drops links, punctuation, emoji and spacing differences."""
+    text = LINK_PATTERN.sub(" ", text.lower().replace("ё", "е"))
+    return " ".join(WORD.findall(text))
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word-bigram shingles of normalized text.
+
+    Per-bit votes are counted column-wise over the packed digests with
+    bytes.translate, so the Python-level work is one hash per shingle.
+    """
+    words = normalize(text).split()
+    if not words:
+        return 0
+    shingles = {" ".join(words[i:i + SHINGLE]) for i in range(max(1, len(words) - SHINGLE + 1))}
+    digests = b"".join([hashlib.blake2b(s.encode(), digest_size=8).digest() for s in shingles])
+    half = len(shingles) / 2
+    result = 0
+    for pos in range(8):
+        column = digests[pos::8]
+        for bit in range(8):
+            if len(column.translate(None, _WITHOUT_BIT[bit])) > half:
+                result |= 1 << (pos * 8 + bit)
+    return result
+
+
+@dataclass
+class DedupEntry:
+    fingerprint: int
+    kind: str  # "recent" (forwarded) | "published"
+    created_at: float = field(default_factory=time.time)
+    channel: str = ""
+    # Published rewrite, offered for reuse instead of a new LLM call
+    text: str = ""
+    entities: list = field(default_factory=list)
+
+
+class DedupIndex:
+    """Bounded SimHash index of forwarded and published posts.
+
+    Fingerprints are 64-bit ints kept per kind, so a lookup is one XOR +
+    popcount per entry of that kind (~0.1 µs each, well under a millisecond
+    for a few thousand posts); oldest entries are evicted beyond `capacity`.
+    """
+
+    def __init__(self, path: str, capacity: int = 3000, max_distance: int = 12):
+        self.path = path
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self._entries: OrderedDict[int, DedupEntry] = OrderedDict()
+        # kind -> {key: fingerprint}, the only thing scanned on lookup
+        self._fingerprints: dict[str, dict[int, int]] = {"recent": {}, "published": {}}
+        self._next_key = 0
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _insert(self, entry: DedupEntry) -> None:
+        key = self._next_key
+        self._next_key += 1
+        self._entries[key] = entry
+        self._fingerprints[entry.kind][key] = entry.fingerprint
+        while len(self._entries) > self.capacity:
+            old_key, old = self._entries.popitem(last=False)
+            del self._fingerprints[old.kind][old_key]
+        self._dirty = True
+
+    def find(self, fingerprint: int, kind: str = "published") -> tuple[DedupEntry, int] | None:
+        """Closest entry of `kind` within max_distance bits: (entry, distance) or None."""
+        fingerprints = self._fingerprints[kind]
+        if not fingerprint or not fingerprints:
+            return None
+        distances = [(f ^ fingerprint).bit_count() for f in fingerprints.values()]
+        distance = min(distances)
+        if distance > self.max_distance:
+            return None
+        key = next(islice(fingerprints, distances.index(distance), None))
+        return self._entries[key], distance
+
+    def add_recent(self, fingerprint: int) -> None:
+        if fingerprint:
+            self._insert(DedupEntry(fingerprint, "recent"))
+
+    def add_published(self, fingerprint: int, text: str, entities: list, channel: str) -> None:
+        if fingerprint:
+            self._insert(DedupEntry(fingerprint, "published", channel=channel, text=text, entities=entities))
+
+    def save(self) -> None:
+        if self._dirty:
+            self._write(self._snapshot())
+
+    async def save_async(self) -> None:
+        """Snapshot on the event loop, write the file in a worker thread."""
+        if self._dirty:
+            await asyncio.to_thread(self._write, self._snapshot())
+
+    def _snapshot(self) -> list[dict]:
+        self._dirty = False
+        return [asdict(e) for e in self._entries.values()]
+
+    def _write(self, records: list[dict]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, json.JSONDecodeError) as e:
+            _log.error(f"[DEDUP] Cannot read index {self.path}: {e}")
+            return
+        for record in records:
+            self._insert(DedupEntry(**record))
+        self._dirty = False
+        _log.info(f"[DEDUP] Loaded {len(self)} fingerprint(s)")
@@ -1,13 +1,32 @@
 import re
+import time
+import asyncio
 import logging
+from functools import lru_cache
+from typing import Awaitable
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
+import httpx
+import google.auth
+from google.auth.transport.requests import Request as AuthRequest
 from google import genai
 from google.genai import types
-from config import Config
+from config import Config, LatencyProfile, PROFILE_ACTIONS
+from services.transport import PooledTransport
+from services.validation import Validation, ValidationStats, validate
+from services.pricing import estimate_cost
+from services.chunking import split_chunks, summarize, paragraph_spans
+from services.usage import Usage, UsageTracker, PostUsage, current_post
+from services.breaker import CircuitBreaker, CircuitOpen
+from services.scheduler import LLMScheduler, current_priority, current_owner
+from utils.utf16 import Utf16Index
+from utils.text import LINK_PATTERN
+from utils import trace
 
 _log = logging.getLogger(__name__)
 
-LINK_PATTERN = re.compile(r'https?://(?:[^\s<>\"()]|\([^\s<>\"()]*\))+')
 LINK_TOKEN = "⟦LINK:{n}⟧"
 TRACKING_PARAMS = {
     # UTM
@@ -29,53 +48,604 @@ TRACKING_PARAMS = {
     # General tracking
     "spm", "scm", "aff_id", "aff_sub", "clickid", "trk", "tracking_id",
 }
+AUTH_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+REWRITE_INSTRUCTION = (
+    "ПЕРЕД ТЕМ КАК ПИСАТЬ — ДУМАЙ.\n\n"
+    "ШАГ 1. ПОНЯТЬ ИНТЕНТ:\n"
+    "Прочитай исходник и определи:\n"
+    "— Что это: наблюдение, рефлексия, вопрос, опыт, фиксация факта, странный случай, что-то ещё?\n"
+    "— Зачем этот пост существует? Какая мысль за ним стоит?\n"
+    "— Нужна ли тут эмоция или нет?\n\n"
+    "ШАГ 2. ЕСЛИ НЕПОНЯТНО — НЕ ПИШИ:\n"
+    "— Если не понял, как именно это должно звучать — перечитай.\n"
+    "— НЕ выбирай 'нейтральный', 'сухой', 'ироничный' или любой другой дефолт.\n"
+    "— Писать без понимания интента ЗАПРЕЩЕНО.\n\n"
+    "ШАГ 3. ТОНАЛЬНОСТЬ — СЛЕДСТВИЕ МЫСЛИ:\n"
+    "— Тон должен вытекать из содержания, а не быть заданным заранее.\n"
+    "— Мысль сухая → текст сухой.\n"
+    "— Мысль странная → текст может быть странным.\n"
+    "— Эмоция не нужна → не добавляй.\n\n"
+    "ТОЛЬКО ПОСЛЕ ПОНИМАНИЯ ИНТЕНТА — ПИШИ:\n\n"
+    "ПОЗИЦИЯ АВТОРА:\n"
+    "— Неявная, родная. Читается из формулировок, структуры, фокуса.\n"
+    "— НЕ пиши 'я думаю', 'я считаю'.\n\n"
+    "ЯЗЫК:\n"
+    "— НЕ формальный, НЕ академический.\n"
+    "— НЕ объясняй 'для тех, кто не знает'.\n"
+    "— НЕ продавай идеи, НЕ хайпуй, НЕ лей воду.\n\n"
+    "СТРУКТУРА И АБЗАЦЫ:\n"
+    "— Формат: Telegram-пост. Разделитель абзацев — ОДНА пустая строка (два переноса \\n\\n).\n"
+    "— Один абзац = одна законченная мысль, 2–4 предложения. Не режь мысль на куски.\n"
+    "— НЕ лепи стену текста — если мысль сменилась, начинай новый абзац.\n"
+    "— НЕ делай абзацы из одного слова, одной фразы или одного предложения.\n"
+    "— Оптимально: 2–5 абзацев на пост. Зависит от объёма мысли.\n"
+    "— Тире, скобки внутри текста — ок, но не выноси их в отдельные строки.\n"
+    "— Списки — только если это естественная форма для данной мысли.\n"
+    "— Без вывода в конце — ок.\n"
+    "— НЕ ставь точку в конце последнего предложения абзаца.\n\n"
+    "ТЕРМИНОЛОГИЯ:\n"
+    "— НЕ заменяй и НЕ упрощай профессиональный сленг.\n"
+    "— 'промпт', 'агент', 'LLM', техжаргон — оставляй.\n\n"
+    "ТОКЕНЫ ССЫЛОК (КРИТИЧЕСКИ ВАЖНО):\n"
+    "— Если в исходном тексте есть токены вида ⟦LINK:0⟧, ⟦LINK:1⟧ — это маркеры ссылок.\n"
+    "— Каждый токен ОБЯЗАН остаться в выходном тексте ровно один раз в ТОЧНО ТАКОМ ЖЕ виде.\n"
+    "— Нельзя удалять, изменять формат, дублировать токены.\n"
+    "— ЗАПРЕЩЕНО создавать новые токены ⟦LINK:N⟧, если их не было в исходнике.\n"
+    "— ЗАПРЕЩЕНО заменять упоминания моделей, продуктов или версий на токены.\n"
+    "— Пример: 'Claude Opus 4.6' остаётся как есть, НЕ превращается в токен.\n"
+    "— Пропавший или лишний токен = критическая ошибка.\n\n"
+    "ГЛУБИНА ПЕРЕРАБОТКИ:\n"
+    "— Это НЕ пересказ и НЕ перефраз.\n"
+    "— Пиши С НУЛЯ, вдохновляясь исходником.\n"
+    "— Свободно меняй порядок идей.\n"
+    "— Сжимай агрессивно.\n"
+    "— Результат должен читаться как личный ход мысли, а не переписанный пост.\n\n"
+    "ПУНКТУАЦИЯ:\n"
+    "— Используй только обычное короткое тире (-), НИКОГДА не используй длинное тире (—) или среднее тире (–).\n"
+    "— Не ставь точку в конце абзаца.\n\n"
+    "ЗАПРЕЩЕНО:\n"
+    "— Любая дефолтная тональность.\n"
+    "— Любой стилистический шаблон.\n"
+    "— Эмоциональные украшения, не оправданные самой мыслью.\n"
+    "— 'В заключение', 'таким образом', 'следовательно'.\n"
+    "— Длинное тире (—) и среднее тире (–). Только короткое (-)."
+)
+
+SOURCE_MARKER = "Исходный текст для переработки:"
+
+# Appended to the instruction for each part of a long post
+CHUNK_NOTE = (
+    "\n\nДЛИННЫЙ ПОСТ:\n"
+    "— Ниже дана только часть {index} из {total} длинного поста. Перепиши ТОЛЬКО её.\n"
+    "— Не добавляй вступление или вывод ко всему посту, части будут склеены по порядку.\n"
+    "— Контекст всего поста (не переписывай, только для понимания): {summary}"
+)
+# Appended to the instruction when one paragraph of a draft is regenerated
+PARAGRAPH_NOTE = (
+    "\n\nОДИН АБЗАЦ:\n"
+    "— Ниже дан только один абзац готового поста. Перепиши ТОЛЬКО его, в ОДИН абзац.\n"
+    "— Остальные абзацы остаются как есть: не повторяй их, не добавляй вступление или вывод.\n"
+    "— Текст до этого абзаца (не переписывай, только для связности): {before}\n"
+    "— Текст после этого абзаца (не переписывай, только для связности): {after}"
+)
+# Entity types that are links (rewritten as ⟦LINK:n⟧ tokens), the rest is formatting
+LINK_ENTITY_TYPES = ("text_link", "url")
+# URLs in that read-only context are masked: the model never sees URLs
+CONTEXT_LINK = "[ссылка]"
+# Scheduler class for a rewrite when the caller doesn't say otherwise
+PRIORITY_BY_PURPOSE = {
+    "draft": "interactive", "regenerate": "interactive", "paragraph": "interactive", "bulk": "background",
+}
+# Latency profile of a rewrite when the caller doesn't name one (paragraphs are regenerations)
+PROFILE_ACTION_BY_PURPOSE = {"draft": "draft", "regenerate": "regenerate", "paragraph": "regenerate", "bulk": "bulk"}
+# Models that can't think below this budget (2.5 Pro can't turn thinking off)
+MIN_THINKING_BUDGET = {"gemini-2.5-pro": 128}
+# Models without thinking_config at all
+NO_THINKING_PREFIXES = ("gemini-1.", "gemini-2.0")
+# Refresh ADC token this long before it expires (SDK itself refreshes only when already expired)
+CREDENTIALS_REFRESH_MARGIN = 300
+# Deadline of the warm-up call when LLM_REQUEST_TIMEOUT is off: the pool's client has no timeout of its own
+WARM_UP_TIMEOUT = 30.0
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+current_profile: ContextVar[LatencyProfile | None] = ContextVar("current_profile", default=None)
+
+
+def thinking_config(model: str, budget: int | None) -> types.ThinkingConfig | None:
+    """Thinking budget for a model, or None to leave it to the model's default."""
+    if budget is None or model.startswith(NO_THINKING_PREFIXES):
+        return None
+    return types.ThinkingConfig(thinking_budget=max(budget, MIN_THINKING_BUDGET.get(model, 0)))
+
+
+def output_budget(text: str, reserve: int, ratio: float, floor: int, ceiling: int,
+                  profile: LatencyProfile | None = None) -> int:
+    """Size max_output_tokens to the source post.
+
+    The rewrite is a compression, so the answer is bounded by the input;
+    the reserve covers hidden thinking tokens, which count as output. A
+    latency profile with a fixed thinking budget reserves exactly that,
+    and its max_output_tokens caps the result.
+    """
+    if profile is not None:
+        if profile.thinking_budget is not None:
+            reserve = profile.thinking_budget
+        ceiling = min(ceiling, profile.max_output_tokens)
+    budget = reserve + int(estimate_tokens(text) * ratio)
+    return max(floor, min(budget, ceiling))
+
+
+@lru_cache(maxsize=512)
+def estimate_tokens(text: str) -> int:
+    """Cheap local approximation of the Gemini tokenizer (no network call).
+
+    Latin words average ~4 chars per token, Cyrillic and other scripts ~3,
+    punctuation and link tokens are roughly one token per symbol.
+    """
+    total = 0
+    for word in WORD_PATTERN.findall(text):
+        chars_per_token = 4 if word.isascii() else 3
+        total += -(-len(word) // chars_per_token)
+    return total
+
+
+@dataclass
+class RewriteResult:
+    text: str
+    entities: list[dict]
+    model: str  # "a+b" when chunks of a long post were served by different tiers
+    elapsed: float  # seconds, including retries
+    usage: Usage  # all calls made for this post (retries, chunks, escalation)
+    formatting_reset: int = 0  # formatting entities a paragraph rewrite dropped or clipped
+
+
+def _paragraph_bounds(text: str, index: int) -> tuple[int, int, int, int]:
+    """Paragraph `index` as (start, end) in code points and in UTF-16 units."""
+    spans = paragraph_spans(text)
+    if not 0 <= index < len(spans):
+        raise ValueError(f"No paragraph {index} in a draft of {len(spans)}")
+    start, end = spans[index]
+    utf16 = Utf16Index(text)
+    return start, end, utf16.to_utf16(start), utf16.to_utf16(end)
+
+
+def _splice_entities(entities: list[dict], para_start: int, para_end: int,
+                     new_entities: list[dict], shift: int) -> tuple[list[dict], int]:
+    """Draft entities after the paragraph [para_start, para_end) (UTF-16) was replaced.
+
+    new_entities are the new paragraph's (relative offsets), shift its change
+    in length. Links inside the paragraph were rewritten with it; an entity
+    covering the whole paragraph (bold across paragraphs) stretches with it.
+    Other formatting inside the paragraph has no place in the new text: it is
+    dropped, or clipped to the part outside. Returns (entities, how many were).
+    """
+    spliced, reset = [], 0
+    for e in entities:
+        e_start, e_end = e["offset"], e["offset"] + e["length"]
+        if e_end <= para_start:
+            spliced.append(e)
+        elif e_start >= para_end:
+            spliced.append({**e, "offset": e_start + shift})
+        elif para_start <= e_start and e_end <= para_end and e["type"] in LINK_ENTITY_TYPES:
+            continue
+        elif e_start <= para_start and e_end >= para_end:
+            spliced.append({**e, "length": e["length"] + shift})
+        else:
+            reset += 1
+            if e_start < para_start:
+                spliced.append({**e, "length": para_start - e_start})
+            elif e_end > para_end:
+                spliced.append({**e, "offset": para_end + shift, "length": e_end - para_end})
+    spliced += [{**e, "offset": e["offset"] + para_start} for e in new_entities]
+    spliced.sort(key=lambda e: e["offset"])
+    return spliced, reset
+
+
+def _finish_reason(response: types.GenerateContentResponse) -> types.FinishReason | None:
+    if not response.candidates:
+        return None
+    return response.candidates[0].finish_reason
+
+
+def _response_text(response: types.GenerateContentResponse) -> str:
+    content = response.text
+    return content.strip() if content else ""
+
+
+def _response_cost(model: str, response: types.GenerateContentResponse) -> float | None:
+    usage = response.usage_metadata
+    if usage is None:
+        return None
+    output = (usage.candidates_token_count or 0) + (usage.thoughts_token_count or 0)
+    return estimate_cost(model, usage.prompt_token_count or 0, output)
 
 
 class LLMService:
-    def __init__(self, config: Config):
-        # Initialize Google GenAI client with Vertex AI
-        self.client = genai.Client(
-            vertexai=True,
-            project=config.vertex_project_id,
-            location=config.vertex_location
-        )
+    def __init__(self, config: Config, client=None):
+        """client: ready genai-compatible client (e.g. services.stub.StubClient for offline runs);
+        by default a Vertex AI client with a warm connection pool is created."""
+        self.credentials = None
+        self.transport: PooledTransport | None = None
+        self._http = None
+        if client is None:
+            # Own credentials and HTTP pool so warm-up can keep both hot
+            self.transport = PooledTransport(keepalive_expiry=max(300.0, config.llm_keepalive_interval * 2))
+            self.credentials, _ = google.auth.default(scopes=AUTH_SCOPES)
+            self._http = httpx.AsyncClient(transport=self.transport, timeout=None)
+
+            # Initialize Google GenAI client with Vertex AI
+            client = genai.Client(
+                vertexai=True,
+                project=config.vertex_project_id,
+                location=config.vertex_location,
+                credentials=self.credentials,
+                http_options=types.HttpOptions(httpx_async_client=self._http)
+            )
+        self.client = client
+        self.keepalive_interval = config.llm_keepalive_interval
+        self._keepalive_task: asyncio.Task | None = None
+        self._last_request_at = 0.0
         # Use model from config (default: gemini-2.5-pro)
         self.model_name = config.vertex_model
         _log.info(f"[LLM] Using model: {self.model_name}")
 
+        # Cascade routing: cheap model first for short posts, escalate on failed checks
+        self.fast_model_name = config.vertex_fast_model
+        self.route_max_chars = config.route_fast_max_chars
+        self.route_max_links = config.route_fast_max_links
+        self.min_paragraphs = config.llm_min_paragraphs
+        self.max_paragraphs = config.llm_max_paragraphs
+        # Smoothed latency per model, used to report what the fast tier saved
+        self._latency_ewma: dict[str, float] = {}
+
+        # Validation of answers against the prompt's hard rules
+        self.retry_budget = config.llm_retry_budget
+        self.retry_deadline = config.llm_retry_deadline
+        self.retry_temperature_step = config.llm_retry_temperature_step
+        self.retry_temperature_min = 0.1
+        self.validation_stats = ValidationStats()
+
+        # Token accounting; near the budget the heavy model is swapped for the fast one
+        self.usage = UsageTracker(
+            config.usage_path,
+            daily_budget=config.llm_daily_token_budget,
+            monthly_budget=config.llm_monthly_token_budget,
+            economy_ratio=config.llm_budget_economy_ratio,
+            pause_ratio=config.llm_budget_pause_ratio,
+            flush_interval=config.usage_flush_interval,
+            editor_budgets={e.user_id: e.daily_token_budget for e in config.editors},
+        )
+
+        # Fail fast while the backend is down instead of waiting out each request
+        self.request_timeout = config.llm_request_timeout or None
+        self.breaker = CircuitBreaker(
+            failure_threshold=config.llm_breaker_threshold,
+            reset_timeout=config.llm_breaker_reset,
+            max_reset_timeout=config.llm_breaker_max_reset,
+        )
+
+        # Bounded concurrency with priority classes: button presses before background work;
+        # each editor is a separate flow with its own cap, so one editor can't take every slot
+        self.scheduler = LLMScheduler(
+            config.llm_concurrency,
+            aging_period=config.llm_scheduler_aging,
+            max_preemptions=config.llm_max_preemptions,
+            limits={e.user_id: e.llm_concurrency for e in config.editors},
+        )
+
+        # Long posts are split into paragraph chunks rewritten in parallel
+        self.long_post_threshold = config.long_post_threshold
+        self.long_post_chunk_chars = config.long_post_chunk_chars
+
         # Generation config matching previous OpenAI settings
+        # (max_output_tokens is overridden per request by _output_budget)
         self.generation_config = types.GenerateContentConfig(
             temperature=0.7,
-            max_output_tokens=8192
+            max_output_tokens=config.llm_output_ceiling
         )
+        self.output_ratio = config.llm_output_ratio
+        self.output_reserve = config.llm_output_reserve
+        self.output_floor = config.llm_output_floor
+        self.output_ceiling = config.llm_output_ceiling
+
+        # Latency profiles (thinking budget, output cap, temperature) chosen per action and channel
+        self.profiles = config.llm_profiles
+        self.profile_defaults = {action: config.profile_for(action) for action in PROFILE_ACTIONS}
+
+    async def _refresh_credentials(self) -> None:
+        """Refresh ADC token ahead of expiry so no user request pays for it."""
+        if self.credentials is None:
+            return
+        expiry = self.credentials.expiry  # naive UTC datetime or None
+        if self.credentials.valid and expiry is not None:
+            left = (expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+            if left > CREDENTIALS_REFRESH_MARGIN:
+                return
+        await asyncio.to_thread(self.credentials.refresh, AuthRequest())
+        _log.debug("[LLM] ADC credentials refreshed")
+
+    async def warm_up(self) -> None:
+        """Refresh credentials and open pooled connections with a cheap call.
+
+        Errors and timeouts are logged, not raised: a cold start is still
+        better than no start (or than hanging before polling begins).
+        """
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._warm_up(), self.request_timeout or WARM_UP_TIMEOUT)
+        except Exception as e:
+            _log.warning(f"[LLM] Warm-up failed: {type(e).__name__}: {e}")
+            return
+        self._last_request_at = time.monotonic()
+        http2 = self.transport.http2 if self.transport else None
+        _log.info(
+            f"[LLM] Warm-up done in {time.monotonic() - started:.2f}s "
+            f"(http2={http2}, reuse_ratio={self.connection_reuse_ratio:.2f})"
+        )
+
+    async def _warm_up(self) -> None:
+        await self._refresh_credentials()
+        await self.client.aio.models.count_tokens(model=self.model_name, contents="ping")
 
-    async def _make_request(self, system_instruction: str, text: str) -> str:
+    @property
+    def connection_reuse_ratio(self) -> float:
+        return self.transport.reuse_ratio if self.transport else 0.0
+
+    def start_keepalive(self) -> None:
+        if self.keepalive_interval > 0 and self._keepalive_task is None:
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+
+    async def _keepalive_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            # Real traffic keeps the pool warm on its own
+            if time.monotonic() - self._last_request_at >= self.keepalive_interval:
+                await self.warm_up()
+            else:
+                try:
+                    await self._refresh_credentials()
+                except Exception as e:
+                    _log.warning(f"[LLM] Credentials refresh failed: {e}")
+
+    async def close(self) -> None:
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        if self._http is not None:
+            await self._http.aclose()
+        await self.usage.close()
+
+    def _output_budget(self, text: str) -> int:
+        """output_budget() with this service's limits and the current latency profile."""
+        return output_budget(text, self.output_reserve, self.output_ratio, self.output_floor,
+                             self.output_ceiling, current_profile.get())
+
+    async def _make_request(self, system_instruction: str, text: str, model: str | None = None) -> str:
         if not text:
             return ""
+        response = await self._call(system_instruction, text, model or self.model_name)
+        return _response_text(response)
 
+    @staticmethod
+    def _build_prompt(system_instruction: str, text: str, suffix: str = "") -> str:
         # Combine system instruction and user text into single prompt
         # Claude via Vertex AI works better with combined context
-        full_prompt = f"{system_instruction}\n\n---\n\nИсходный текст для переработки:\n\n{text}"
-
-        # Use async generate_content method from google-genai
-        response = await self.client.aio.models.generate_content(
-            model=self.model_name,
-            contents=full_prompt,
-            config=self.generation_config
+        full_prompt = f"{system_instruction}\n\n---\n\n{SOURCE_MARKER}\n\n{text}"
+        if suffix:
+            full_prompt += f"\n\n---\n\n{suffix}"
+        return full_prompt
+
+    async def _call(
+        self, system_instruction: str, text: str, model: str,
+        temperature: float | None = None, suffix: str = ""
+    ) -> types.GenerateContentResponse:
+        full_prompt = self._build_prompt(system_instruction, text, suffix)
+
+        budget = self._output_budget(text)
+        response = await self._generate(full_prompt, model, budget, temperature)
+
+        # Truncated answer: retry once with a larger budget
+        if _finish_reason(response) == types.FinishReason.MAX_TOKENS:
+            retry_budget = max(self.output_ceiling, budget * 2)
+            _log.warning(f"[LLM] Output truncated at {budget} tokens, retrying with {retry_budget}")
+            response = await self._generate(full_prompt, model, retry_budget, temperature)
+        return response
+
+    def profile(self, purpose: str, name: str | None = None) -> LatencyProfile:
+        """Latency profile by name, or the default one for a purpose."""
+        return self.profiles[name or self.profile_defaults[PROFILE_ACTION_BY_PURPOSE.get(purpose, "draft")]]
+
+    def _request_config(self, model: str, max_output_tokens: int,
+                        temperature: float | None = None) -> types.GenerateContentConfig:
+        """generation_config with the output budget and the current latency profile applied."""
+        overrides = {"max_output_tokens": max_output_tokens}
+        profile = current_profile.get()
+        if temperature is None and profile is not None:
+            temperature = profile.temperature
+        if temperature is not None:
+            overrides["temperature"] = temperature
+        thinking = thinking_config(model, profile.thinking_budget if profile else None)
+        if thinking is not None:
+            overrides["thinking_config"] = thinking
+        return self.generation_config.model_copy(update=overrides)
+
+    async def _generate(
+        self, prompt: str, model: str, max_output_tokens: int, temperature: float | None = None
+    ) -> types.GenerateContentResponse:
+        config = self._request_config(model, max_output_tokens, temperature)
+
+        async def request() -> types.GenerateContentResponse:
+            # Raises CircuitOpen without a request while the backend is known to be down
+            async with self.breaker.guard():
+                # Use async generate_content method from google-genai
+                return await asyncio.wait_for(
+                    self.client.aio.models.generate_content(
+                        model=model,
+                        contents=prompt,
+                        config=config,
+                    ),
+                    self.request_timeout,
+                )
+
+        queued_at = time.monotonic()
+        # Interactive calls jump the queue (and preempt running background ones if enabled)
+        response = await self.scheduler.run(request)
+        self._last_request_at = time.monotonic()
+        self.usage.record(model, response.usage_metadata)
+        # Latency of the whole call, including waiting for a scheduler slot
+        elapsed = self._last_request_at - queued_at
+        previous = self._latency_ewma.get(model)
+        self._latency_ewma[model] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+        return response
+
+    def _validate(self, model: str, raw: str, tokens: list[str],
+                  paragraph_range: tuple[int, int] | None = None) -> Validation:
+        min_paragraphs, max_paragraphs = paragraph_range or (self.min_paragraphs, self.max_paragraphs)
+        result = validate(raw, tokens, min_paragraphs, max_paragraphs)
+        self.validation_stats.record(model, result)
+        return result
+
+    async def _rewrite_validated(self, instruction: str, text: str, tokens: list[str], model: str,
+                                 paragraph_range: tuple[int, int] | None = None) -> str:
+        """Call the model and retry with lower temperature while hard rules fail.
+
+        Retries are bounded by retry_budget and retry_deadline; if nothing
+        passes, the best-scoring answer is returned (final_fix and link
+        restoration downstream cope with the rest).
+        """
+        started = time.monotonic()
+        profile = current_profile.get()
+        temperature = profile.temperature if profile else self.generation_config.temperature
+        suffix = ""
+        best_raw, best_score = "", -1.0
+
+        for attempt in range(self.retry_budget + 1):
+            response = await self._call(instruction, text, model, temperature=temperature, suffix=suffix)
+            raw = _response_text(response)
+            result = self._validate(model, raw, tokens, paragraph_range)
+            if result.ok:
+                if attempt:
+                    self.validation_stats.recovered += 1
+                return raw
+            if result.score > best_score:
+                best_raw, best_score = raw, result.score
+
+            if attempt == self.retry_budget or time.monotonic() - started > self.retry_deadline:
+                break
+            temperature = max(self.retry_temperature_min, temperature - self.retry_temperature_step)
+            suffix = "ИСПРАВЬ ОШИБКИ ПРЕДЫДУЩЕЙ ПОПЫТКИ:\n" + result.correction()
+            self.validation_stats.retries += 1
+            _log.warning(
+                f"[LLM] {model} answer failed {result.violations}, "
+                f"retry {attempt + 1}/{self.retry_budget} at temperature {temperature:.2f}"
+            )
+
+        _log.error(f"[LLM] No valid answer from {model}, using best (score={best_score:.2f})")
+        return best_raw
+
+    def _fast_tier_allowed(self, text: str, tokens: list[str]) -> bool:
+        return (
+            bool(self.fast_model_name)
+            and self.fast_model_name != self.model_name
+            and len(text) <= self.route_max_chars
+            and len(tokens) <= self.route_max_links
         )
 
-        content = response.text
-        return content.strip() if content else ""
+    def _heavy_model(self) -> str:
+        """Heavy tier model, or the fast one while the token budget is running out."""
+        if self.fast_model_name and self.usage.economy:
+            return self.fast_model_name
+        return self.model_name
+
+    async def _rewrite_routed(self, instruction: str, text: str, tokens: list[str],
+                              paragraph_range: tuple[int, int] | None = None) -> tuple[str, str]:
+        """Send short/simple posts to the fast model, escalate if local checks fail.
 
-    def _extract_all_links(self, text: str, entities: list | None) -> tuple[str, dict[str, dict]]:
+        paragraph_range overrides the configured (min, max) paragraphs of the answer.
+        Returns: (raw_answer, model_that_served_it)
+        """
+        if not text:
+            return "", ""
+        heavy = self._heavy_model()
+        if heavy != self.model_name:
+            raw = await self._rewrite_validated(instruction, text, tokens, heavy, paragraph_range)
+            trace.event("tier.economy", model=heavy)
+            return raw, heavy
+        if not self._fast_tier_allowed(text, tokens):
+            raw = await self._rewrite_validated(instruction, text, tokens, self.model_name, paragraph_range)
+            trace.event("tier.heavy", model=self.model_name, chars=len(text), links=len(tokens))
+            return raw, self.model_name
+
+        started = time.monotonic()
+        try:
+            response = await self._call(instruction, text, self.fast_model_name)
+            raw = _response_text(response)
+            violations = self._validate(self.fast_model_name, raw, tokens, paragraph_range).violations
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            _log.warning(f"[LLM] Fast tier {self.fast_model_name} failed: {e}")
+            response, violations = None, ["error"]
+
+        if not violations:
+            # Savings vs the heavy tier: its cost for the same tokens, its smoothed latency
+            seconds = time.monotonic() - started
+            fast_cost = _response_cost(self.fast_model_name, response)
+            heavy_cost = _response_cost(self.model_name, response)
+            heavy_latency = self._latency_ewma.get(self.model_name)
+            trace.event(
+                "tier.fast", model=self.fast_model_name, seconds=seconds,
+                fast_cost=fast_cost, heavy_cost=heavy_cost, heavy_latency=heavy_latency,
+            )
+            post = current_post.get()
+            if post is not None:
+                if fast_cost is not None and heavy_cost is not None:
+                    post.saved_cost += heavy_cost - fast_cost
+                if heavy_latency is not None:
+                    post.saved_seconds = max(post.saved_seconds, heavy_latency - seconds)
+            return raw, self.fast_model_name
+
+        trace.event(
+            "tier.escalate", model=self.model_name, violations=violations,
+            wasted_cost=_response_cost(self.fast_model_name, response) if response is not None else None,
+        )
+        raw = await self._rewrite_validated(instruction, text, tokens, self.model_name, paragraph_range)
+        return raw, self.model_name
+
+    async def _rewrite_chunked(self, instruction: str, text: str, tokens: list[str]) -> tuple[str, str]:
+        """Rewrite a long post as parallel paragraph chunks sharing a summary."""
+        chunks = split_chunks(text, self.long_post_chunk_chars)
+        if len(chunks) < 2:
+            return await self._rewrite_routed(instruction, text, tokens)
+
+        summary = summarize(text)
+        trace.event("chunked", chars=len(text), chunks=len(chunks))
+        results = await asyncio.gather(*(
+            self._rewrite_routed(
+                instruction + CHUNK_NOTE.format(index=i + 1, total=len(chunks), summary=summary),
+                chunk,
+                [token for token in tokens if token in chunk]
+            )
+            for i, chunk in enumerate(chunks)
+        ))
+        models = sorted({model for _, model in results if model})
+        return "\n\n".join(raw for raw, _ in results if raw), "+".join(models)
+
+    @staticmethod
+    def _extract_all_links(text: str, entities: list | None) -> tuple[str, dict[str, dict]]:
         """Extract all links (entity + raw) and replace with non-linguistic tokens.
 
         LLM never sees URLs — only ⟦LINK:n⟧ tokens.
+        Entity offsets/lengths are Telegram UTF-16 units.
         Returns: (text_with_tokens, links)
         links: {token: {"anchor": str|None, "url": str}}
         """
         links = {}
         counter = 0
+        # Offsets refer to the original text; entities are cut from the end, so it stays valid
+        index = Utf16Index(text)
 
         # Step 1: Extract entity links (process from end to avoid offset shifts)
         # Support both Telegram MessageEntity objects and plain dicts
@@ -85,10 +655,10 @@ class LLMService:
                     return e.get(key, default)
                 return getattr(e, key, default)
 
-            # Log incoming entities for debugging
-            _log.info(f"[LLM] Processing {len(entities)} entities")
+            # Record incoming entities for debugging
             for e in entities:
-                _log.info(f"[LLM]   Entity: type={_get(e, 'type')}, offset={_get(e, 'offset')}, length={_get(e, 'length')}, url={_get(e, 'url')}")
+                trace.event("entity.in", type=_get(e, "type"), offset=_get(e, "offset"),
+                            length=_get(e, "length"), url=_get(e, "url"))
 
             # Filter entities: text_link (with url field) OR url type (URL in text)
             link_entities = []
@@ -103,8 +673,7 @@ class LLMService:
             sorted_entities = sorted(link_entities, key=lambda e: _get(e, "offset"), reverse=True)
 
             for entity in sorted_entities:
-                start = _get(entity, "offset")
-                end = start + _get(entity, "length")
+                start, end = index.to_codepoints(_get(entity, "offset"), _get(entity, "length"))
                 anchor_or_url = text[start:end]  # This is either anchor text or the URL itself
                 entity_type = _get(entity, "type")
 
@@ -113,13 +682,13 @@ class LLMService:
                     url = _get(entity, "url")
                     token = LINK_TOKEN.format(n=counter)
                     links[token] = {"anchor": anchor_or_url, "url": url}
-                    _log.info(f"[LLM]   Extracted text_link: anchor='{anchor_or_url[:30]}', url='{url[:50]}'")
+                    trace.event("link.extracted", token=token, anchor=anchor_or_url, url=url)
                 elif entity_type == "url":
                     # url: visible URL in text (no custom anchor)
                     url = anchor_or_url  # The URL is the text itself
                     token = LINK_TOKEN.format(n=counter)
                     links[token] = {"anchor": None, "url": url}
-                    _log.info(f"[LLM]   Extracted url: url='{url[:50]}'")
+                    trace.event("link.extracted", token=token, url=url)
 
                 counter += 1
                 text = text[:start] + token + text[end:]
@@ -130,6 +699,7 @@ class LLMService:
             url = match.group(0)
             token = LINK_TOKEN.format(n=counter)
             links[token] = {"anchor": None, "url": url}  # No anchor for raw URLs
+            trace.event("link.extracted", token=token, url=url, raw=True)
             counter += 1
             return token
 
@@ -141,8 +711,8 @@ class LLMService:
 
         Returns: (restored_text, entities)
         entities: [{"offset": int, "length": int, "type": "text_link", "url": str}]
+        in code points; _finalize converts them to UTF-16 for Telegram.
         """
-        _log.info(f"[LLM] Restoring {len(links)} link tokens from rewritten text")
         new_entities = []
         remaining = dict(links)
 
@@ -160,7 +730,7 @@ class LLMService:
             if first_token is None:
                 # Remaining tokens are missing
                 for token, data in remaining.items():
-                    _log.error(f"[LLM] LINK TOKEN MISSING: {token} -> {data['url'][:50]}")
+                    trace.event("link.missing", token=token, url=data["url"])
                 break
 
             data = remaining.pop(first_token)
@@ -181,7 +751,7 @@ class LLMService:
                 "type": "text_link",
                 "url": clean_url
             })
-            _log.info(f"[LLM]   Restored {first_token}: '{replacement[:30]}' -> {clean_url[:50]}")
+            trace.event("link.restored", token=first_token, text=replacement, url=clean_url)
 
         return text, new_entities
 
@@ -259,6 +829,7 @@ class LLMService:
                     })
                 else:
                     _log.error(f"[LLM] Entity text not found after normalize: {link_text[:30]}")
+                    trace.dump("entity lost in normalize")
 
         return adjusted
 
@@ -269,90 +840,126 @@ class LLMService:
             tuple: (rewritten_text, caption_entities)
             - caption_entities: list of {"offset", "length", "type", "url"} for text_link
         """
-        _log.debug("[LLM] rewrite_text() called")
-
-        instruction = (
-            "ПЕРЕД ТЕМ КАК ПИСАТЬ — ДУМАЙ.\n\n"
-            "ШАГ 1. ПОНЯТЬ ИНТЕНТ:\n"
-            "Прочитай исходник и определи:\n"
-            "— Что это: наблюдение, рефлексия, вопрос, опыт, фиксация факта, странный случай, что-то ещё?\n"
-            "— Зачем этот пост существует? Какая мысль за ним стоит?\n"
-            "— Нужна ли тут эмоция или нет?\n\n"
-            "ШАГ 2. ЕСЛИ НЕПОНЯТНО — НЕ ПИШИ:\n"
-            "— Если не понял, как именно это должно звучать — перечитай.\n"
-            "— НЕ выбирай 'нейтральный', 'сухой', 'ироничный' или любой другой дефолт.\n"
-            "— Писать без понимания интента ЗАПРЕЩЕНО.\n\n"
-            "ШАГ 3. ТОНАЛЬНОСТЬ — СЛЕДСТВИЕ МЫСЛИ:\n"
-            "— Тон должен вытекать из содержания, а не быть заданным заранее.\n"
-            "— Мысль сухая → текст сухой.\n"
-            "— Мысль странная → текст может быть странным.\n"
-            "— Эмоция не нужна → не добавляй.\n\n"
-            "ТОЛЬКО ПОСЛЕ ПОНИМАНИЯ ИНТЕНТА — ПИШИ:\n\n"
-            "ПОЗИЦИЯ АВТОРА:\n"
-            "— Неявная, родная. Читается из формулировок, структуры, фокуса.\n"
-            "— НЕ пиши 'я думаю', 'я считаю'.\n\n"
-            "ЯЗЫК:\n"
-            "— НЕ формальный, НЕ академический.\n"
-            "— НЕ объясняй 'для тех, кто не знает'.\n"
-            "— НЕ продавай идеи, НЕ хайпуй, НЕ лей воду.\n\n"
-            "СТРУКТУРА И АБЗАЦЫ:\n"
-            "— Формат: Telegram-пост. Разделитель абзацев — ОДНА пустая строка (два переноса \\n\\n).\n"
-            "— Один абзац = одна законченная мысль, 2–4 предложения. Не режь мысль на куски.\n"
-            "— НЕ лепи стену текста — если мысль сменилась, начинай новый абзац.\n"
-            "— НЕ делай абзацы из одного слова, одной фразы или одного предложения.\n"
-            "— Оптимально: 2–5 абзацев на пост. Зависит от объёма мысли.\n"
-            "— Тире, скобки внутри текста — ок, но не выноси их в отдельные строки.\n"
-            "— Списки — только если это естественная форма для данной мысли.\n"
-            "— Без вывода в конце — ок.\n"
-            "— НЕ ставь точку в конце последнего предложения абзаца.\n\n"
-            "ТЕРМИНОЛОГИЯ:\n"
-            "— НЕ заменяй и НЕ упрощай профессиональный сленг.\n"
-            "— 'промпт', 'агент', 'LLM', техжаргон — оставляй.\n\n"
-            "ТОКЕНЫ ССЫЛОК (КРИТИЧЕСКИ ВАЖНО):\n"
-            "— Если в исходном тексте есть токены вида ⟦LINK:0⟧, ⟦LINK:1⟧ — это маркеры ссылок.\n"
-            "— Каждый токен ОБЯЗАН остаться в выходном тексте ровно один раз в ТОЧНО ТАКОМ ЖЕ виде.\n"
-            "— Нельзя удалять, изменять формат, дублировать токены.\n"
-            "— ЗАПРЕЩЕНО создавать новые токены ⟦LINK:N⟧, если их не было в исходнике.\n"
-            "— ЗАПРЕЩЕНО заменять упоминания моделей, продуктов или версий на токены.\n"
-            "— Пример: 'Claude Opus 4.6' остаётся как есть, НЕ превращается в токен.\n"
-            "— Пропавший или лишний токен = критическая ошибка.\n\n"
-            "ГЛУБИНА ПЕРЕРАБОТКИ:\n"
-            "— Это НЕ пересказ и НЕ перефраз.\n"
-            "— Пиши С НУЛЯ, вдохновляясь исходником.\n"
-            "— Свободно меняй порядок идей.\n"
-            "— Сжимай агрессивно.\n"
-            "— Результат должен читаться как личный ход мысли, а не переписанный пост.\n\n"
-            "ПУНКТУАЦИЯ:\n"
-            "— Используй только обычное короткое тире (-), НИКОГДА не используй длинное тире (—) или среднее тире (–).\n"
-            "— Не ставь точку в конце абзаца.\n\n"
-            "ЗАПРЕЩЕНО:\n"
-            "— Любая дефолтная тональность.\n"
-            "— Любой стилистический шаблон.\n"
-            "— Эмоциональные украшения, не оправданные самой мыслью.\n"
-            "— 'В заключение', 'таким образом', 'следовательно'.\n"
-            "— Длинное тире (—) и среднее тире (–). Только короткое (-)."
+        result = await self.rewrite(text, entities)
+        return result.text, result.entities
+
+    async def rewrite(self, text: str, entities: list | None = None, purpose: str = "draft",
+                      priority: str | None = None, editor: int | None = None,
+                      profile: str | None = None) -> RewriteResult:
+        """rewrite_text() plus which model served the post, how long it took and what it used.
+
+        purpose ("draft", "regenerate", "bulk") labels token usage; priority
+        ("interactive", "normal", "background") and the latency profile
+        ("fast", "balanced", "quality", ...) default from it. editor is the
+        user the post is rewritten for: their scheduler flow and daily quota.
+        """
+        return await self._accounted(self._rewrite(text, entities), purpose, priority, editor, profile)
+
+    async def rewrite_paragraph(self, text: str, entities: list[dict], index: int,
+                                priority: str | None = None, editor: int | None = None,
+                                profile: str | None = None) -> RewriteResult:
+        """Rewrite only paragraph `index` of a finished draft and splice it back.
+
+        text/entities are the draft as shown to Telegram (entity offsets in
+        UTF-16); the other paragraphs go to the model as read-only context.
+        Entities before the paragraph are kept, those after it are shifted by
+        the paragraph's change in length; formatting inside it is reset (see
+        _splice_entities), counted in formatting_reset.
+        """
+        result = await self._accounted(
+            self._rewrite_paragraph(text, entities, index), "paragraph", priority, editor, profile
         )
+        _, _, para_start, para_end = _paragraph_bounds(text, index)
+        result.formatting_reset = _splice_entities(entities, para_start, para_end, [], 0)[1]
+        return result
+
+    async def _accounted(self, work: Awaitable[tuple[str, list[dict], str]], purpose: str,
+                         priority: str | None, editor: int | None, profile: str | None) -> RewriteResult:
+        """Run a rewrite coroutine with its usage, priority, editor and latency profile in context."""
+        started = time.monotonic()
+        profile = self.profile(purpose, profile)
+        trace.event("profile", profile=profile.name, purpose=purpose)
+        post = PostUsage(purpose, Usage())
+        context_token = current_post.set(post)
+        priority_token = current_priority.set(priority or PRIORITY_BY_PURPOSE.get(purpose, "normal"))
+        owner_token = current_owner.set(editor)
+        profile_token = current_profile.set(profile)
+        try:
+            final_text, final_entities, model = await work
+        finally:
+            current_profile.reset(profile_token)
+            current_owner.reset(owner_token)
+            current_priority.reset(priority_token)
+            current_post.reset(context_token)
+            # Failed rewrites count too: their tokens are spent
+            self.usage.record_rewrite(post.usage, time.monotonic() - started, editor=editor, profile=profile.name)
+        elapsed = time.monotonic() - started
+        # The only INFO line per rewrite; details are in the trace
+        saved = ""
+        if post.saved_cost or post.saved_seconds:
+            saved = f", fast tier saved ~${post.saved_cost:.4f} and {post.saved_seconds:.1f}s vs {self.model_name}"
+        _log.info(
+            f"[LLM] Rewrite ({purpose}, {profile.name}) by {model} in {elapsed:.1f}s: {post.usage.calls} call(s), "
+            f"{post.usage.total} tokens, {len(final_entities)} link(s){saved}"
+        )
+        return RewriteResult(final_text, final_entities, model, elapsed, post.usage)
+
+    async def _rewrite(self, text: str, entities: list | None) -> tuple[str, list[dict], str]:
+
+        instruction = REWRITE_INSTRUCTION
 
         # Step 1: Extract ALL links (entity + raw) → non-linguistic tokens
         # LLM never sees URLs, only ⟦LINK:n⟧
         text_safe, links = self._extract_all_links(text, entities)
 
-        _log.info(f"[LLM] Links extracted: {len(links)}")
-        _log.info(f"[LLM] Text with tokens (preview): {text_safe[:200]}")
+        trace.event("text.tokenized", links=len(links), text=text_safe)
 
         # Step 2: LLM rewrite (sees only text + tokens, no URLs)
-        raw = await self._make_request(instruction, text_safe)
-
-        _log.info(f"[LLM] LLM response (preview): {raw[:200]}")
+        if len(text_safe) > self.long_post_threshold:
+            raw, model = await self._rewrite_chunked(instruction, text_safe, list(links))
+        else:
+            raw, model = await self._rewrite_routed(instruction, text_safe, list(links))
+
+        final_text, final_entities = self._finalize(raw, links)
+        return final_text, final_entities, model
+
+    async def _rewrite_paragraph(self, text: str, entities: list[dict], index: int) -> tuple[str, list[dict], str]:
+        start, end, para_start, para_end = _paragraph_bounds(text, index)
+
+        # The paragraph's own links become tokens, with offsets relative to it
+        inside = [
+            {**e, "offset": e["offset"] - para_start}
+            for e in entities if para_start <= e["offset"] and e["offset"] + e["length"] <= para_end
+        ]
+        paragraph_safe, links = self._extract_all_links(text[start:end], inside)
+        trace.event("paragraph", index=index, links=len(links), text=paragraph_safe)
+
+        instruction = REWRITE_INSTRUCTION + PARAGRAPH_NOTE.format(
+            before=LINK_PATTERN.sub(CONTEXT_LINK, text[:start].strip()) or "(это первый абзац)",
+            after=LINK_PATTERN.sub(CONTEXT_LINK, text[end:].strip()) or "(это последний абзац)",
+        )
+        raw, model = await self._rewrite_routed(instruction, paragraph_safe, list(links), paragraph_range=(1, 1))
+        new_paragraph, new_entities = self._finalize(raw, links)
+
+        # Splice: only the offsets after the paragraph move, by its change in UTF-16 length
+        shift = Utf16Index(new_paragraph).utf16_length - (para_end - para_start)
+        spliced, reset = _splice_entities(entities, para_start, para_end, new_entities, shift)
+        if reset:
+            trace.event("paragraph.formatting_reset", entities=reset)
+        return text[:start] + new_paragraph + text[end:], spliced, model
+
+    def _finalize(self, raw: str, links: dict[str, dict]) -> tuple[str, list[dict]]:
+        """Turn a raw LLM answer with ⟦LINK:n⟧ tokens into (text, entities)."""
+        trace.event("llm.response", text=raw)
         # Check if tokens are preserved
-        for token in links.keys():
-            if token not in raw:
-                _log.error(f"[LLM] TOKEN LOST BY LLM: {token} -> {links[token]['url'][:50]}")
+        lost = [token for token in links if token not in raw]
+        if lost:
+            _log.error(f"[LLM] TOKEN LOST BY LLM: {', '.join(lost)}")
 
         # Step 3: Restore tokens → text + build entities for Telegram
         restored, new_entities = self._restore_all_links(raw, links)
-
-        _log.info(f"[LLM] Links restored: {len(new_entities)} entities built")
+        if lost:
+            trace.dump("token lost")
 
         # Step 4: Normalize paragraphs for Telegram (no length-based splitting)
         final_text = self._normalize_paragraphs(restored)
@@ -361,4 +968,10 @@ class LLMService:
         # (normalization may change text length, so recalculate offsets)
         adjusted_entities = self._adjust_entities_after_normalize(restored, final_text, new_entities)
 
+        # Step 6: Code point offsets -> UTF-16 units (emoji before a link shift them)
+        index = Utf16Index(final_text)
+        for entity in adjusted_entities:
+            start = entity["offset"]
+            entity["offset"], entity["length"] = index.to_entity_span(start, start + entity["length"])
+
         return final_text, adjusted_entities
\ No newline at end of file
@@ -0,0 +1,18 @@
+# USD per 1M tokens: (input, output). Thinking tokens are billed as output.
+# Vertex AI list prices for prompts <= 200k tokens.
+MODEL_PRICES = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.0-flash": (0.15, 0.60),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+}
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float | None:
+    """Cost of a call in USD, None for models without a known price."""
+    prices = MODEL_PRICES.get(model.split("@")[0])
+    if prices is None:
+        return None
+    input_price, output_price = prices
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
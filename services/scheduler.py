@@ -0,0 +1,170 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+_log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Share of dispatches each class gets while all of them are queued
+WEIGHTS = {"interactive": 8, "normal": 3, "background": 1}
+PRIORITIES = tuple(WEIGHTS)
+
+# Priority of LLM calls made in the current task (set by LLMService.rewrite)
+current_priority: ContextVar[str] = ContextVar("current_priority", default="normal")
+# Who the calls are made for (editor id; None for bulk runs and other tools)
+current_owner: ContextVar[Hashable] = ContextVar("current_owner", default=None)
+
+
+@dataclass(eq=False)
+class _Ticket:
+    priority: str
+    owner: Hashable = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    finish_tag: float = 0.0
+    granted: asyncio.Future | None = None
+    task: asyncio.Task | None = None  # running request, cancelled on preemption
+    preempted: bool = False
+    preemptions: int = 0
+
+
+class LLMScheduler:
+    """Weighted fair queue in front of the LLM backend.
+
+    At most `concurrency` requests run at once. Waiting requests are
+    dispatched by WFQ finish tag (each request costs 1/weight of its class),
+    minus an aging credit of one unit per `aging_period` seconds waited, so
+    background work keeps moving under steady interactive load.
+
+    Cancelling a call already sent to the backend still bills it, and the
+    requeued call pays again, so running requests are left alone by default.
+    With `max_preemptions` > 0 an interactive request that finds every slot
+    busy preempts the newest running background request: it is cancelled
+    and requeued, each request at most `max_preemptions` times.
+
+    Each (priority, owner) pair is a separate flow, so within a class every
+    editor gets an equal share however many requests another one queues;
+    `limits` caps how many slots one owner may hold at once.
+    """
+
+    def __init__(self, concurrency: int = 4, aging_period: float = 10.0, max_preemptions: int = 0,
+                 limits: dict[Hashable, int] | None = None):
+        self.concurrency = max(1, concurrency)
+        self.aging_period = aging_period
+        self.max_preemptions = max_preemptions
+        self.limits = dict(limits or {})
+        self._queues: dict[tuple[str, Hashable], deque[_Ticket]] = {}
+        self._last_tag: dict[tuple[str, Hashable], float] = {}
+        self._virtual_time = 0.0
+        self._running: list[_Ticket] = []
+        self.preempted = 0
+        self.waits: dict[Hashable, list[float]] = {}  # owner -> [dispatched calls, seconds queued]
+
+    def _tag(self, ticket: _Ticket) -> None:
+        flow = (ticket.priority, ticket.owner)
+        start = max(self._virtual_time, self._last_tag.get(flow, 0.0))
+        ticket.finish_tag = start + 1 / WEIGHTS[ticket.priority]
+        self._last_tag[flow] = ticket.finish_tag
+
+    def _at_limit(self, owner: Hashable) -> bool:
+        limit = self.limits.get(owner)
+        return bool(limit) and sum(1 for t in self._running if t.owner == owner) >= limit
+
+    def _next(self) -> _Ticket | None:
+        now = time.monotonic()
+        heads = [queue[0] for queue in self._queues.values() if queue and not self._at_limit(queue[0].owner)]
+        if not heads:
+            return None
+        return min(heads, key=lambda t: t.finish_tag - (now - t.enqueued_at) / self.aging_period)
+
+    def _dispatch(self) -> None:
+        while len(self._running) < self.concurrency:
+            ticket = self._next()
+            if ticket is None:
+                return
+            self._queues[(ticket.priority, ticket.owner)].popleft()
+            if ticket.granted.done():  # waiter was cancelled meanwhile
+                continue
+            self._virtual_time = max(self._virtual_time, ticket.finish_tag)
+            self._running.append(ticket)
+            waits = self.waits.setdefault(ticket.owner, [0, 0.0])
+            waits[0] += 1
+            waits[1] += time.monotonic() - ticket.enqueued_at
+            ticket.granted.set_result(None)
+
+    def _preempt_for(self, ticket: _Ticket) -> None:
+        if ticket.priority != "interactive" or not self.max_preemptions:
+            return
+        # Blocked by its owner's limit: only the owner's own background work can make room
+        own_only = self._at_limit(ticket.owner)
+        if not own_only and len(self._running) < self.concurrency:
+            return
+        victims = [
+            t for t in self._running
+            if t.priority == "background" and t.task is not None
+            and not t.preempted and t.preemptions < self.max_preemptions
+            and (not own_only or t.owner == ticket.owner)
+        ]
+        if victims:
+            victim = victims[-1]  # newest: least work thrown away
+            victim.preempted = True
+            victim.task.cancel()
+            self.preempted += 1
+            _log.info("[SCHED] Preempting a background request for an interactive one")
+
+    def _release(self, ticket: _Ticket) -> None:
+        self._running.remove(ticket)
+        self._dispatch()
+
+    async def _acquire(self, ticket: _Ticket, front: bool = False) -> None:
+        ticket.granted = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault((ticket.priority, ticket.owner), deque())
+        if front:
+            queue.appendleft(ticket)  # requeued after preemption: keeps its turn
+        else:
+            self._tag(ticket)
+            queue.append(ticket)
+        self._preempt_for(ticket)
+        self._dispatch()
+        try:
+            await ticket.granted
+        except asyncio.CancelledError:
+            if ticket.granted.done() and not ticket.granted.cancelled():
+                self._release(ticket)  # granted right before the cancel
+            elif ticket in queue:
+                queue.remove(ticket)
+            raise
+
+    async def run(self, request: Callable[[], Awaitable[T]], priority: str | None = None) -> T:
+        """Run request() when the scheduler grants a slot; priority and owner come from the context."""
+        ticket = _Ticket(priority or current_priority.get(), current_owner.get())
+        front = False
+        while True:
+            await self._acquire(ticket, front)
+            ticket.task = asyncio.ensure_future(request())
+            try:
+                return await asyncio.shield(ticket.task)
+            except asyncio.CancelledError:
+                if not ticket.preempted or not ticket.task.cancelled():
+                    # The caller was cancelled, not preempted
+                    ticket.task.cancel()
+                    raise
+                ticket.preempted = False
+                ticket.preemptions += 1
+                front = True
+            finally:
+                self._release(ticket)
+
+    def queued(self) -> dict[str, int]:
+        counts = dict.fromkeys(PRIORITIES, 0)
+        for (priority, _), queue in self._queues.items():
+            counts[priority] += len(queue)
+        return counts
+
+    def wait_stats(self) -> dict[Hashable, tuple[int, float]]:
+        """owner -> (dispatched calls, average seconds queued) since start"""
+        return {owner: (int(calls), total / calls) for owner, (calls, total) in self.waits.items() if calls}
@@ -0,0 +1,81 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+from google.genai import types
+
+from services.llm import SOURCE_MARKER, estimate_tokens
+from services.validation import LONG_DASHES
+
+STREAM_CHUNK_CHARS = 80  # Streamed answers arrive in pieces of this size
+STREAM_CHUNK_DELAY = 0.05  # ...each after this share of the latency
+
+
+def _source_text(prompt: str) -> str:
+    """Cut the post out of a prompt built by LLMService._build_prompt."""
+    _, _, tail = prompt.partition(f"{SOURCE_MARKER}\n\n")
+    return tail.split("\n\n---\n\n", 1)[0]
+
+
+class _StubModels:
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency
+        self.jitter = jitter
+
+    async def _sleep(self):
+        await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _answer(self, contents) -> tuple[str, int, int]:
+        prompt = contents if isinstance(contents, str) else str(contents)
+        text = _source_text(prompt)
+        for dash in LONG_DASHES:
+            text = text.replace(dash, "-")
+        return text, estimate_tokens(prompt), estimate_tokens(text)
+
+    @staticmethod
+    def _response(text: str, prompt_tokens: int, output_tokens: int,
+                  final: bool = True) -> types.GenerateContentResponse:
+        """final=False: an intermediate stream chunk (no finish reason, no usage)."""
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(
+                content=types.Content(role="model", parts=[types.Part(text=text)]),
+                finish_reason=types.FinishReason.STOP if final else None,
+            )],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                thoughts_token_count=0,
+                total_token_count=prompt_tokens + output_tokens,
+            ) if final else None,
+        )
+
+    async def generate_content(self, model: str, contents, config=None) -> types.GenerateContentResponse:
+        await self._sleep()
+        return self._response(*self._answer(contents))
+
+    async def generate_content_stream(self, model: str, contents, config=None):
+        """Same answer as generate_content, in STREAM_CHUNK_CHARS pieces; usage comes with the last one."""
+        text, prompt_tokens, output_tokens = self._answer(contents)
+        pieces = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+
+        async def chunks():
+            await self._sleep()  # time to first token
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(self.latency * STREAM_CHUNK_DELAY)
+                yield self._response(piece, prompt_tokens, output_tokens, final=i == len(pieces) - 1)
+        return chunks()
+
+    async def count_tokens(self, model: str, contents, config=None) -> types.CountTokensResponse:
+        return types.CountTokensResponse(total_tokens=estimate_tokens(str(contents)))
+
+
+class StubClient:
+    """Offline stand-in for genai.Client (only the parts LLMService uses).
+
+    Echoes the source post back (long dashes replaced), so link tokens and
+    paragraphs survive and validation passes; latency is simulated.
+    """
+
+    def __init__(self, latency: float = 0.3, jitter: float = 0.3):
+        self.aio = SimpleNamespace(models=_StubModels(latency, jitter))
@@ -0,0 +1,46 @@
+import logging
+import importlib.util
+import httpx
+
+_log = logging.getLogger(__name__)
+
+# HTTP/2 in httpx needs the optional `h2` package (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class PooledTransport(httpx.AsyncHTTPTransport):
+    """httpx transport that keeps a warm connection pool and counts reuse.
+
+    Every request carries an httpcore trace hook; a request that had to open
+    a new TCP connection fires `connection.connect_tcp.started`, everything
+    else went over an already established (pooled) connection.
+    """
+
+    def __init__(self, max_connections: int = 10, keepalive_expiry: float = 300.0):
+        self.http2 = HTTP2_AVAILABLE
+        super().__init__(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        self.requests = 0
+        self.new_connections = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        request.extensions = {**request.extensions, "trace": self._trace}
+        return await super().handle_async_request(request)
+
+    async def _trace(self, event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.started":
+            self.new_connections += 1
+
+    @property
+    def reuse_ratio(self) -> float:
+        """Share of requests served over an already open connection."""
+        if not self.requests:
+            return 0.0
+        return max(0.0, 1.0 - self.new_connections / self.requests)
@@ -0,0 +1,408 @@
+import os
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import date
+from contextvars import ContextVar
+from dataclasses import dataclass, astuple
+
+from google.genai import types
+
+from services.pricing import estimate_cost
+
+_log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    purpose TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    thinking_tokens INTEGER NOT NULL,
+    PRIMARY KEY (day, model, purpose)
+)
+"""
+
+# Whole rewrites (count, wall time, tokens) per day and editor / latency profile
+REWRITE_TABLES = {"editor_usage": ("editor", "INTEGER"), "profile_usage": ("profile", "TEXT")}
+
+REWRITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    day TEXT NOT NULL,
+    {key} {key_type} NOT NULL,
+    calls INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    thinking_tokens INTEGER NOT NULL,
+    rewrites INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (day, {key})
+)
+"""
+
+# Deltas are added, so several processes (bot + bulk CLI) can share one store
+UPSERT = """
+INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, model, purpose) DO UPDATE SET
+    calls = calls + excluded.calls,
+    input_tokens = input_tokens + excluded.input_tokens,
+    output_tokens = output_tokens + excluded.output_tokens,
+    thinking_tokens = thinking_tokens + excluded.thinking_tokens
+"""
+
+REWRITE_UPSERT = """
+INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, {key}) DO UPDATE SET
+    calls = calls + excluded.calls,
+    input_tokens = input_tokens + excluded.input_tokens,
+    output_tokens = output_tokens + excluded.output_tokens,
+    thinking_tokens = thinking_tokens + excluded.thinking_tokens,
+    rewrites = rewrites + excluded.rewrites,
+    seconds = seconds + excluded.seconds
+"""
+
+PURPOSE_LABELS = {"draft": "черновики", "regenerate": "регенерации", "paragraph": "абзацы", "bulk": "bulk"}
+
+
+@dataclass
+class Usage:
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    thinking_tokens: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.input_tokens + self.output_tokens + self.thinking_tokens
+
+    @property
+    def cost_output_tokens(self) -> int:
+        return self.output_tokens + self.thinking_tokens  # thinking is billed as output
+
+    def add(self, other: "Usage") -> None:
+        self.calls += other.calls
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.thinking_tokens += other.thinking_tokens
+
+    @classmethod
+    def from_metadata(cls, metadata: types.GenerateContentResponseUsageMetadata | None) -> "Usage":
+        if metadata is None:
+            return cls(calls=1)
+        return cls(
+            calls=1,
+            input_tokens=metadata.prompt_token_count or 0,
+            output_tokens=metadata.candidates_token_count or 0,
+            thinking_tokens=metadata.thoughts_token_count or 0,
+        )
+
+
+@dataclass
+class RewriteUsage(Usage):
+    """Usage of a group of rewrites (one editor's, one profile's), with their count and total wall time."""
+    rewrites: int = 0
+    seconds: float = 0.0
+
+    @property
+    def average_seconds(self) -> float:
+        return self.seconds / self.rewrites if self.rewrites else 0.0
+
+    def add(self, other: Usage) -> None:
+        super().add(other)
+        if isinstance(other, RewriteUsage):
+            self.rewrites += other.rewrites
+            self.seconds += other.seconds
+
+
+@dataclass
+class PostUsage:
+    """Usage of one rewrite() call, shared by its parallel chunk requests."""
+    purpose: str
+    usage: Usage
+    # What the fast tier saved vs the heavy model (chunks run in parallel: seconds is the max)
+    saved_cost: float = 0.0
+    saved_seconds: float = 0.0
+
+
+current_post: ContextVar[PostUsage | None] = ContextVar("current_post", default=None)
+
+
+class UsageTracker:
+    """Token usage per day, model and purpose, with daily/monthly budgets.
+
+    Calls are aggregated in memory and flushed to SQLite every
+    `flush_interval` seconds. Budget state is derived from the stored totals
+    plus unflushed deltas:
+      - economy: >= economy_ratio of a budget, heavy model replaced by the fast one
+      - paused:  >= pause_ratio of a budget, regenerations refused as well
+    A budget of 0 means unlimited. Whole rewrites are also summed per day
+    and editor (against `editor_budgets`, daily tokens) and per latency profile.
+    """
+
+    def __init__(self, path: str, daily_budget: int = 0, monthly_budget: int = 0,
+                 economy_ratio: float = 0.8, pause_ratio: float = 0.95, flush_interval: float = 60.0,
+                 editor_budgets: dict[int, int] | None = None):
+        self.path = path
+        self.daily_budget = daily_budget
+        self.monthly_budget = monthly_budget
+        self.economy_ratio = economy_ratio
+        self.pause_ratio = pause_ratio
+        self.flush_interval = flush_interval
+        self.editor_budgets = dict(editor_budgets or {})
+        self._pending: dict[tuple[str, str, str], Usage] = {}  # unflushed deltas
+        self._pending_rewrites: dict[str, dict[tuple, RewriteUsage]] = {table: {} for table in REWRITE_TABLES}
+        self._editor_day_totals: dict[int, int] = {}  # stored tokens per editor for the current day
+        self._day_total = 0  # stored totals for the current day/month, refreshed on flush
+        self._month_total = 0
+        self._day = ""
+        self._mode = "normal"
+        self._lock = threading.Lock()
+        self._flusher: asyncio.Task | None = None
+        self._stopping = asyncio.Event()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(";".join([SCHEMA] + [
+            REWRITE_SCHEMA.format(table=table, key=key, key_type=key_type)
+            for table, (key, key_type) in REWRITE_TABLES.items()
+        ]))
+        self._reload_totals()
+
+    # --- recording ---
+
+    def record(self, model: str, metadata: types.GenerateContentResponseUsageMetadata | None,
+               purpose: str | None = None) -> Usage:
+        """Account one model call; purpose defaults to the current rewrite's."""
+        usage = Usage.from_metadata(metadata)
+        post = current_post.get()
+        if post is not None:
+            post.usage.add(usage)
+        key = (date.today().isoformat(), model, purpose or (post.purpose if post else "other"))
+        self._pending.setdefault(key, Usage()).add(usage)
+        self._update_mode()
+        return usage
+
+    def record_rewrite(self, usage: Usage, seconds: float, editor: int | None = None,
+                       profile: str | None = None) -> None:
+        """Account one finished (or failed) rewrite to its editor and latency profile."""
+        today = date.today().isoformat()
+        for table, key in (("editor_usage", editor), ("profile_usage", profile)):
+            if key is not None:
+                delta = RewriteUsage(usage.calls, usage.input_tokens, usage.output_tokens, usage.thinking_tokens,
+                                     rewrites=1, seconds=seconds)
+                self._pending_rewrites[table].setdefault((today, key), RewriteUsage()).add(delta)
+
+    # --- budgets ---
+
+    def _unflushed(self, prefix: str) -> int:
+        return sum(u.total for (day, _, _), u in self._pending.items() if day.startswith(prefix))
+
+    def spent(self) -> tuple[int, int]:
+        """(tokens today, tokens this month)"""
+        today = date.today().isoformat()
+        if today != self._day:
+            self._reload_totals()
+        return self._day_total + self._unflushed(today), self._month_total + self._unflushed(today[:7])
+
+    def budget_ratio(self) -> float:
+        """Largest share of a configured budget already spent."""
+        day, month = self.spent()
+        ratios = [0.0]
+        if self.daily_budget:
+            ratios.append(day / self.daily_budget)
+        if self.monthly_budget:
+            ratios.append(month / self.monthly_budget)
+        return max(ratios)
+
+    def editor_spent(self, editor: int) -> int:
+        """Tokens spent today on the editor's rewrites."""
+        today = date.today().isoformat()
+        if today != self._day:
+            self._reload_totals()
+        pending = self._pending_rewrites["editor_usage"].get((today, editor))
+        return self._editor_day_totals.get(editor, 0) + (pending.total if pending else 0)
+
+    def editor_exhausted(self, editor: int) -> bool:
+        budget = self.editor_budgets.get(editor, 0)
+        return bool(budget) and self.editor_spent(editor) >= budget
+
+    def _update_mode(self) -> None:
+        ratio = self.budget_ratio()
+        mode = "paused" if ratio >= self.pause_ratio else "economy" if ratio >= self.economy_ratio else "normal"
+        if mode != self._mode:
+            log = _log.warning if mode != "normal" else _log.info
+            log(f"[USAGE] Budget {ratio:.0%} spent, mode {self._mode} -> {mode}")
+            self._mode = mode
+
+    @property
+    def economy(self) -> bool:
+        return self._mode != "normal"
+
+    @property
+    def regenerations_paused(self) -> bool:
+        return self._mode == "paused"
+
+    # --- store ---
+
+    def _reload_totals(self) -> None:
+        today = date.today().isoformat()
+        with self._lock:
+            day_total, month_total = self._db.execute(
+                "SELECT "
+                "coalesce(sum(CASE WHEN day = ? THEN input_tokens + output_tokens + thinking_tokens END), 0), "
+                "coalesce(sum(input_tokens + output_tokens + thinking_tokens), 0) "
+                "FROM usage WHERE day >= ?",
+                (today, today[:7] + "-01"),
+            ).fetchone()
+            editors = self._db.execute(
+                "SELECT editor, input_tokens + output_tokens + thinking_tokens FROM editor_usage WHERE day = ?",
+                (today,),
+            ).fetchall()
+        self._day, self._day_total, self._month_total = today, day_total, month_total
+        self._editor_day_totals = dict(editors)
+
+    def _write(self, rows: list[tuple], rewrite_rows: dict[str, list[tuple]]) -> None:
+        with self._lock, self._db:
+            self._db.executemany(UPSERT, rows)
+            for table, table_rows in rewrite_rows.items():
+                key, _ = REWRITE_TABLES[table]
+                self._db.executemany(REWRITE_UPSERT.format(table=table, key=key), table_rows)
+
+    def _take_pending(self) -> tuple[list[tuple], dict[str, list[tuple]]]:
+        rows = [key + astuple(usage) for key, usage in self._pending.items()]
+        rewrite_rows = {
+            table: [key + astuple(usage) for key, usage in pending.items()]
+            for table, pending in self._pending_rewrites.items()
+        }
+        self._pending = {}
+        self._pending_rewrites = {table: {} for table in REWRITE_TABLES}
+        return rows, rewrite_rows
+
+    async def flush(self) -> None:
+        """Swap pending deltas on the loop, write them in a worker thread."""
+        rows, rewrite_rows = self._take_pending()
+        if rows or any(rewrite_rows.values()):
+            try:
+                await asyncio.to_thread(self._write, rows, rewrite_rows)
+            except sqlite3.Error as e:
+                _log.error(f"[USAGE] Flush failed, keeping pending rows: {e}")
+                for day, model, purpose, *counts in rows:
+                    self._pending.setdefault((day, model, purpose), Usage()).add(Usage(*counts))
+                for table, table_rows in rewrite_rows.items():
+                    for day, key, *counts in table_rows:
+                        self._pending_rewrites[table].setdefault((day, key), RewriteUsage()).add(RewriteUsage(*counts))
+                return
+        # Picks up what other processes (bulk CLI) spent meanwhile
+        await asyncio.to_thread(self._reload_totals)
+        self._update_mode()
+
+    def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    async def close(self) -> None:
+        if self._flusher:
+            # Not cancelled: rows a flush already took would be lost, and its write could race db.close()
+            self._stopping.set()
+            await self._flusher
+            self._flusher = None
+        rows, rewrite_rows = self._take_pending()
+        if rows or any(rewrite_rows.values()):
+            self._write(rows, rewrite_rows)
+        self._db.close()
+
+    # --- reporting ---
+
+    def _rows(self, since: str) -> dict[tuple[str, str, str], Usage]:
+        with self._lock:
+            stored = self._db.execute(
+                "SELECT day, model, purpose, calls, input_tokens, output_tokens, thinking_tokens "
+                "FROM usage WHERE day >= ?", (since,)
+            ).fetchall()
+        rows = {(day, model, purpose): Usage(*counts) for day, model, purpose, *counts in stored}
+        for key, usage in self._pending.items():
+            if key[0] >= since:
+                rows.setdefault(key, Usage()).add(usage)
+        return rows
+
+    def _rewrite_rows(self, table: str, day: str) -> dict:
+        key, _ = REWRITE_TABLES[table]
+        with self._lock:
+            stored = self._db.execute(
+                f"SELECT {key}, calls, input_tokens, output_tokens, thinking_tokens, rewrites, seconds "
+                f"FROM {table} WHERE day = ?", (day,)
+            ).fetchall()
+        rows = {key: RewriteUsage(*counts) for key, *counts in stored}
+        for (pending_day, key), usage in self._pending_rewrites[table].items():
+            if pending_day == day:
+                rows.setdefault(key, RewriteUsage()).add(usage)
+        return rows
+
+    def summary(self, editor_names: dict[int, str] | None = None) -> str:
+        """editor_names: id -> name for the per-editor section (ids without a name are shown as is)."""
+        today = date.today().isoformat()
+        rows = self._rows(today[:7] + "-01")
+        by_model: dict[str, Usage] = {}
+        by_purpose: dict[str, Usage] = {}
+        month, month_cost = Usage(), 0.0
+        for (day, model, purpose), usage in rows.items():
+            month.add(usage)
+            month_cost += estimate_cost(model, usage.input_tokens, usage.cost_output_tokens) or 0.0
+            if day == today:
+                by_model.setdefault(model, Usage()).add(usage)
+                by_purpose.setdefault(purpose, Usage()).add(usage)
+
+        lines = ["Сегодня:"]
+        for model, usage in sorted(by_model.items()):
+            cost = estimate_cost(model, usage.input_tokens, usage.cost_output_tokens)
+            lines.append(
+                f"  {model}: {usage.calls} вызовов, вход {usage.input_tokens}, выход {usage.output_tokens}, "
+                f"thinking {usage.thinking_tokens}" + (f", ~${cost:.4f}" if cost is not None else "")
+            )
+        for purpose, usage in sorted(by_purpose.items()):
+            lines.append(f"  {PURPOSE_LABELS.get(purpose, purpose)}: {usage.calls} вызовов, {usage.total} токенов")
+        if not by_model:
+            lines.append("  вызовов не было")
+        lines.append(f"За месяц: {month.calls} вызовов, {month.total} токенов, ~${month_cost:.4f}")
+
+        day_spent, month_spent = self.spent()
+        budgets = []
+        if self.daily_budget:
+            budgets.append(f"день {day_spent / self.daily_budget:.0%} из {self.daily_budget}")
+        if self.monthly_budget:
+            budgets.append(f"месяц {month_spent / self.monthly_budget:.0%} из {self.monthly_budget}")
+        lines.append(f"Бюджет: {', '.join(budgets) or 'без лимита'}, режим: {self._mode}")
+
+        editors = self._rewrite_rows("editor_usage", today)
+        if editors:
+            lines.append("Редакторы сегодня:")
+            names = editor_names or {}
+            for editor, usage in sorted(editors.items(), key=lambda item: -item[1].total):
+                budget = self.editor_budgets.get(editor, 0)
+                quota = f" из {budget} ({usage.total / budget:.0%})" if budget else ""
+                lines.append(
+                    f"  {names.get(editor, editor)}: {usage.total} токенов{quota}, "
+                    f"{usage.rewrites} переписываний, в среднем {usage.average_seconds:.1f} с"
+                )
+
+        profiles = self._rewrite_rows("profile_usage", today)
+        if profiles:
+            lines.append("Профили задержки сегодня:")
+            for profile, usage in sorted(profiles.items()):
+                lines.append(
+                    f"  {profile}: {usage.rewrites} переписываний, в среднем {usage.average_seconds:.1f} с, "
+                    f"{usage.total // usage.rewrites} токенов (thinking {usage.thinking_tokens // usage.rewrites}) "
+                    f"на пост"
+                )
+        return "\n".join(lines)
@@ -0,0 +1,116 @@
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Iterable
+
+LONG_DASHES = ("—", "–")
+PARAGRAPH_SPLIT = re.compile(r'\n\s*\n')
+ANY_LINK_TOKEN = re.compile(r'⟦LINK:\d+⟧')
+# Paragraph shorter than this (in words) counts as "one word / one phrase"
+MIN_PARAGRAPH_WORDS = 3
+
+# Hard rules of the rewrite prompt, in reporting order
+RULES = ("empty", "tokens_missing", "tokens_duplicated", "tokens_new", "dashes", "paragraphs")
+
+# Short corrective notes appended to the prompt when a rule fails
+CORRECTIONS = {
+    "empty": "Ответ был пустым. Верни переписанный текст поста.",
+    "tokens_missing": "Ты потерял токены ссылок: {}. Каждый из них должен быть в тексте ровно один раз.",
+    "tokens_duplicated": "Токены {} повторяются. Каждый токен должен встречаться ровно один раз.",
+    "tokens_new": "Ты добавил токены {}, которых нет в исходнике. Не создавай новых токенов.",
+    "dashes": "В тексте есть длинное (—) или среднее (–) тире. Используй только короткое (-).",
+    "paragraphs": "Нарушена структура абзацев: нужно {} абзацев по 2–4 предложения, "
+                  "разделённых одной пустой строкой, без абзацев из одной фразы.",
+}
+
+
+def paragraphs(text: str) -> list[str]:
+    return [p for p in PARAGRAPH_SPLIT.split(text) if p.strip()]
+
+
+def count_paragraphs(text: str) -> int:
+    return len(paragraphs(text))
+
+
+@dataclass
+class Validation:
+    violations: list[str] = field(default_factory=list)
+    # Rule -> offending items (tokens, counts) for the corrective prompt
+    details: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return not self.violations
+
+    @property
+    def score(self) -> float:
+        """Share of hard rules passed, 1.0 = fully valid."""
+        return 1.0 - len(self.violations) / len(RULES)
+
+    def correction(self) -> str:
+        return "\n".join(
+            "- " + CORRECTIONS[rule].format(self.details.get(rule, "")) for rule in self.violations
+        )
+
+
+def validate(
+    raw: str, tokens: Iterable[str], min_paragraphs: int = 1, max_paragraphs: int = 6
+) -> Validation:
+    """Check an LLM answer against the prompt's hard rules.
+
+    tokens: link tokens of the source text, each must appear exactly once.
+    """
+    result = Validation()
+    if not raw.strip():
+        result.violations.append("empty")
+        return result
+
+    expected = set(tokens)
+    found = Counter(ANY_LINK_TOKEN.findall(raw))
+    missing = [t for t in expected if t not in found]
+    duplicated = [t for t, n in found.items() if n > 1 and t in expected]
+    new = [t for t in found if t not in expected]
+    for rule, items in (("tokens_missing", missing), ("tokens_duplicated", duplicated), ("tokens_new", new)):
+        if items:
+            result.violations.append(rule)
+            result.details[rule] = ", ".join(sorted(items))
+
+    if any(dash in raw for dash in LONG_DASHES):
+        result.violations.append("dashes")
+
+    parts = paragraphs(raw)
+    too_short = len(parts) > 1 and any(len(p.split()) < MIN_PARAGRAPH_WORDS for p in parts)
+    if not min_paragraphs <= len(parts) <= max_paragraphs or too_short:
+        result.violations.append("paragraphs")
+        result.details["paragraphs"] = f"{min_paragraphs}–{max_paragraphs}"
+    return result
+
+
+class ValidationStats:
+    """Per-rule failure counters, used to tune the prompt from real traffic."""
+
+    def __init__(self):
+        self.checks: Counter[str] = Counter()  # model -> validated answers
+        self.failures: Counter[tuple[str, str]] = Counter()  # (model, rule) -> failures
+        self.retries = 0
+        self.recovered = 0  # answers fixed by a corrective retry
+
+    def record(self, model: str, result: Validation) -> None:
+        self.checks[model] += 1
+        for rule in result.violations:
+            self.failures[(model, rule)] += 1
+
+    def failure_rates(self) -> dict[str, dict[str, float]]:
+        """{model: {rule: share of answers failing it}}"""
+        rates: dict[str, dict[str, float]] = {}
+        for (model, rule), count in self.failures.items():
+            rates.setdefault(model, {})[rule] = count / self.checks[model]
+        return rates
+
+    def summary(self) -> str:
+        lines = []
+        for model, rules in sorted(self.failure_rates().items()):
+            parts = ", ".join(f"{rule}={rate:.0%}" for rule, rate in sorted(rules.items(), key=lambda r: -r[1]))
+            lines.append(f"{model} ({self.checks[model]} ответов): {parts}")
+        lines.append(f"Повторов: {self.retries}, исправлено повтором: {self.recovered}")
+        return "\n".join(lines)
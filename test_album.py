@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the speculative album caption rewrite: joined when it matches, cancelled when not
+"""
+import sys
+import json
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import handlers.admin as admin
+from config import load_config
+from middlewares.album import AlbumMiddleware
+from services.dedup import DedupIndex
+from utils.inflight import InflightRegistry
+
+CAPTION = "Подпись альбома про новости дня. В ней есть пара фраз и подробности"
+OTHER_CAPTION = "Другая подпись, пришедшая с первой частью альбома. Тоже пара фраз"
+
+
+def album_part(message_id: int, caption: str | None = None):
+    async def answer(text, **kwargs):
+        return SimpleNamespace(chat=SimpleNamespace(id=1), message_id=100, text=text)
+
+    return SimpleNamespace(
+        media_group_id="album-1", message_id=message_id, caption=caption, caption_entities=None,
+        photo=[SimpleNamespace(file_id=f"photo-{message_id}")], video=None,
+        forward_origin=True, from_user=SimpleNamespace(id=10), answer=answer,
+    )
+
+
+def forward_album(llm, tmp_path, monkeypatch, parts: list[tuple[float, SimpleNamespace]]):
+    """Feed album parts (delay, message) through AlbumMiddleware into handle_forward.
+
+    Returns (speculative tasks started, texts the LLM was asked to rewrite, preview texts shown).
+    """
+    monkeypatch.setenv("EDITORS", json.dumps([{"id": 10}]))
+    config = load_config(for_bot=False)
+    rewrites, previews, speculated = [], [], []
+
+    rewrite = llm.rewrite
+
+    async def counting_rewrite(text, *args, **kwargs):
+        rewrites.append(text)
+        return await rewrite(text, *args, **kwargs)
+
+    def speculate(event, data):
+        started = admin.speculate_album_rewrite(event, data)
+        if started:
+            speculated.append(started[1])
+        return started
+
+    async def fake_replace(message, state, text):
+        previews.append(text)
+
+    llm.rewrite = counting_rewrite
+    monkeypatch.setattr(admin, "replace_preview", fake_replace)
+
+    async def handler(event, data):
+        await admin.handle_forward(event, data["state"], None, data["config"], data["llm"], data["inflight"],
+                                   data["dedup"], album=data.get("album"), album_rewrite=data.get("album_rewrite"))
+
+    async def run():
+        middleware = AlbumMiddleware(latency=0.1, speculate=speculate)
+        data = {
+            "config": config, "llm": llm,
+            "dedup": DedupIndex(str(tmp_path / "dedup.json")),
+            "inflight": InflightRegistry(str(tmp_path / "pending.json")),
+            "state": FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=10)),
+        }
+
+        async def arrive(delay, part):
+            await asyncio.sleep(delay)
+            await middleware(handler, part, data)
+
+        await asyncio.gather(*(arrive(delay, part) for delay, part in parts))
+
+    asyncio.run(run())
+    return speculated, rewrites, previews
+
+
+def test_completed_speculation_reused(llm, tmp_path, monkeypatch):
+    speculated, rewrites, previews = forward_album(llm, tmp_path, monkeypatch, [
+        (0, album_part(1, CAPTION)),
+        (0.02, album_part(2)),
+    ])
+    assert len(speculated) == 1
+    assert speculated[0].done() and not speculated[0].cancelled()
+    assert rewrites == [CAPTION]  # the speculative call only, nothing recomputed
+    assert previews == [CAPTION]  # the stub echoes the post
+
+
+def test_late_part_cancels_speculation(llm, tmp_path, monkeypatch):
+    llm.client.aio.models.latency = 0.3  # still rewriting when the album is complete
+    speculated, rewrites, previews = forward_album(llm, tmp_path, monkeypatch, [
+        (0, album_part(2, CAPTION)),
+        # The album's first part arrives late and carries the caption that counts
+        (0.02, album_part(1, OTHER_CAPTION)),
+    ])
+    assert len(speculated) == 1 and speculated[0].cancelled()
+    assert rewrites == [CAPTION, OTHER_CAPTION]
+    assert previews == [OTHER_CAPTION]
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Test script to verify circuit breaker state transitions
+"""
+import sys
+import asyncio
+
+import httpx
+from google.genai import errors
+
+from services.breaker import CircuitBreaker, CircuitOpen, is_backend_failure
+
+down = httpx.ConnectError("connection refused")
+bad_request = errors.ClientError(400, {"error": {"message": "bad prompt"}})
+
+
+async def call(breaker: CircuitBreaker, error: Exception | None = None) -> str:
+    """One guarded call: "ok", "failed" (error passed through) or "open" (CircuitOpen)."""
+    try:
+        async with breaker.guard():
+            if error:
+                raise error
+        return "ok"
+    except CircuitOpen:
+        return "open"
+    except Exception:
+        return "failed"
+
+
+def test_is_backend_failure():
+    assert is_backend_failure(down)
+    assert is_backend_failure(asyncio.TimeoutError())
+    assert is_backend_failure(errors.ServerError(503, {"error": {"message": "unavailable"}}))
+    assert is_backend_failure(errors.ClientError(429, {"error": {"message": "quota"}}))
+    assert not is_backend_failure(bad_request)
+
+
+def test_opens_after_threshold():
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+        assert [await call(breaker, down) for _ in range(3)] == ["failed"] * 3
+        assert breaker.state == "open"
+        assert await call(breaker) == "open"
+        assert 0 < breaker.retry_after <= 0.2
+    asyncio.run(run())
+
+
+def test_failure_count():
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=3)
+        await call(breaker, down)
+        await call(breaker, down)
+        await call(breaker)  # success resets the count
+        await call(breaker, down)
+        assert breaker.state == "closed" and breaker.failures == 1
+        await call(breaker, bad_request)  # not the backend's fault
+        assert breaker.state == "closed" and breaker.failures == 1
+    asyncio.run(run())
+
+
+def test_half_open_probe():
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1, max_reset_timeout=0.3)
+        await call(breaker, down)
+        await asyncio.sleep(0.15)
+        assert await call(breaker, down) == "failed" and breaker.state == "open"
+        assert abs(breaker.reset_timeout - 0.2) < 1e-9  # doubled
+
+        await breaker.wait_ready()
+        assert breaker.retry_after == 0
+        assert await call(breaker) == "ok" and breaker.state == "closed"
+        assert breaker.reset_timeout == 0.1
+
+        # A probe answered with 400 proves the backend is up
+        await call(breaker, down)
+        await asyncio.sleep(0.15)
+        assert await call(breaker, bad_request) == "failed" and breaker.state == "closed"
+    asyncio.run(run())
+
+
+def test_cancelled_probe():
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+        await call(breaker, down)
+        await asyncio.sleep(0.15)
+        started = asyncio.Event()
+
+        async def slow_probe():
+            async with breaker.guard():
+                started.set()
+                await asyncio.sleep(10)
+
+        probe = asyncio.create_task(slow_probe())
+        await started.wait()
+        assert await call(breaker) == "open"  # one probe at a time
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        assert breaker.state == "open" and breaker.retry_after == 0
+        assert await call(breaker) == "ok" and breaker.state == "closed"
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
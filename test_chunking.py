@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Test script to verify paragraph chunking and paragraph spans
+"""
+import sys
+
+from services.chunking import split_chunks, summarize, paragraph_spans
+
+paragraphs = [
+    "Первый абзац. В нем две фразы.",
+    "Второй абзац со ссылкой ⟦LINK:0⟧ внутри.",
+    "Третий абзац. Тоже короткий.",
+    "Четвертый абзац, последний.",
+]
+text = "\n\n".join(paragraphs)
+
+
+def test_split_chunks():
+    chunks = split_chunks(text, 80)
+    assert len(chunks) == 2
+    assert "\n\n".join(chunks).split("\n\n") == paragraphs  # whole paragraphs, in order
+    assert sum("⟦LINK:0⟧" in chunk for chunk in chunks) == 1
+    assert split_chunks(text, 10_000) == [text]
+
+
+def test_split_chunks_edge_cases():
+    long_paragraph = "слово " * 50
+    assert split_chunks(f"Короткий.\n\n{long_paragraph}\n\nЕще короткий.", 40) == [
+        "Короткий.", long_paragraph.strip(), "Еще короткий."
+    ]
+    assert split_chunks("А.\n\n \n\n\nБ.", 1) == ["А.", "Б."]
+    assert split_chunks("", 100) == []
+
+
+def test_summarize():
+    summary = summarize(text)
+    assert summary.startswith("Первый абзац. Второй абзац")
+    assert "⟦LINK" not in summary
+    short = summarize(text, 30)
+    assert len(short) <= 31 and short.endswith("…")
+
+
+def test_paragraph_spans():
+    assert [text[start:end] for start, end in paragraph_spans(text)] == paragraphs
+    assert paragraph_spans("\n\nАбзац.") == [(2, 8)]
+    assert paragraph_spans("А.\n\n   \n\nБ.") == [(0, 2), (9, 11)]
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Test script to verify channel and editor parsing, per-editor quotas and LLM shares, and channel ownership
+"""
+import sys
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import handlers.admin as admin
+from config import PROFILE_ACTIONS, Channel, Editor, Config, load_config, _parse_channels, _parse_editors
+from services.usage import Usage
+from utils.inflight import InflightRegistry
+
+main = Channel("Main", "-100111")
+news = Channel("News", "-100222")
+
+
+def editors_from(admin_id: int = 1) -> list[Editor]:
+    return _parse_editors(admin_id, [main, news], concurrency=2, daily_budget=5000)
+
+
+def test_editors(monkeypatch):
+    monkeypatch.setenv("EDITORS", json.dumps([
+        {"id": 10, "name": "Аня", "channels": ["-100222", "-100999"], "concurrency": 1, "daily_tokens": 300},
+        {"id": "11"},
+    ]))
+    admin_editor, anya, second = editors_from()
+    assert (admin_editor.user_id, admin_editor.name, admin_editor.channels) == (1, "admin", [main, news])
+    assert (anya.name, anya.channels, anya.llm_concurrency, anya.daily_token_budget) == ("Аня", [news], 1, 300)
+    # Defaults: every channel, EDITOR_CONCURRENCY / EDITOR_DAILY_TOKEN_BUDGET
+    assert (second.user_id, second.name, second.channels) == (11, "11", [main, news])
+    assert (second.llm_concurrency, second.daily_token_budget) == (2, 5000)
+
+
+def test_admin_listed_once(monkeypatch):
+    monkeypatch.setenv("EDITORS", json.dumps([{"id": 1, "name": "Владелец", "channels": []}]))
+    assert [(e.user_id, e.name, e.channels) for e in editors_from()] == [(1, "Владелец", [])]
+    monkeypatch.delenv("EDITORS")
+    assert [e.user_id for e in editors_from()] == [1]
+
+
+@pytest.mark.parametrize("spec", [
+    "[{\"id\": 10,}]",  # not JSON
+    '[{"name": "без id"}]',
+    '[{"id": "десять"}]',
+    '[{"id": 10, "channels": 5}]',
+    '[{"id": 10, "concurrency": "два"}]',
+    '[10]',  # not an object
+    '{"id": 10}',  # not a list
+])
+def test_malformed_editors(monkeypatch, spec):
+    monkeypatch.setenv("EDITORS", spec)
+    with pytest.raises(ValueError, match="EDITORS is not valid"):
+        editors_from()
+
+
+def test_channels(monkeypatch):
+    monkeypatch.setenv("CHANNELS", json.dumps([
+        {"name": "Main", "id": "-100111", "profile": "fast"},
+        {"name": "News", "id": "-100222", "profile": {"regenerate": "quality"}},
+    ]))
+    first, second = _parse_channels()
+    assert first.profiles == dict.fromkeys(PROFILE_ACTIONS, "fast")
+    assert (second.name, second.channel_id, second.profiles) == ("News", "-100222", {"regenerate": "quality"})
+    # Not JSON at all: CHANNEL_ID as before
+    monkeypatch.setenv("CHANNELS", "Main=-100111")
+    monkeypatch.setenv("CHANNEL_ID", "-100333")
+    assert [ch.channel_id for ch in _parse_channels()] == ["-100333"]
+
+
+@pytest.mark.parametrize("entry, named", [
+    ({"name": "News", "id": "-100222", "profile": 5}, "#2 ('News')"),
+    ({"name": "News", "id": "-100222", "profile": ["fast"]}, "#2 ('News')"),
+    ({"name": "News", "id": "-100222", "profile": {"draft": 1}}, "#2 ('News')"),
+    ({"name": "News"}, "#2 ('News') has no 'id'"),
+    ("-100222", "#2"),
+])
+def test_malformed_channel_named(monkeypatch, entry, named):
+    monkeypatch.setenv("CHANNELS", json.dumps([{"name": "Main", "id": "-100111"}, entry]))
+    with pytest.raises(ValueError, match="CHANNELS is not valid") as error:
+        _parse_channels()
+    assert named in str(error.value)
+
+
+def test_llm_share_per_editor(monkeypatch, config):
+    from services.llm import LLMService
+    from services.stub import StubClient
+
+    monkeypatch.setenv("ADMIN_ID", "1")
+    monkeypatch.setenv("EDITOR_CONCURRENCY", "3")
+    monkeypatch.setenv("EDITORS", json.dumps([{"id": 10, "concurrency": 1}, {"id": 11, "concurrency": 0}]))
+    llm = LLMService(load_config(for_bot=False), client=StubClient(latency=0))
+    assert llm.scheduler.limits == {1: 3, 10: 1, 11: 0}  # 0: no own limit
+    asyncio.run(llm.close())
+
+
+def fsm() -> FSMContext:
+    return FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=10))
+
+
+def test_quota_cutoff(llm):
+    llm.usage.editor_budgets = {10: 100}
+    llm.usage.record_rewrite(Usage(1, 60, 40, 0), 1.0, editor=10)
+    edits = []
+
+    async def edit_text(text, **kwargs):
+        edits.append(text)
+
+    async def rewrite(*args, **kwargs):
+        raise AssertionError("LLM called over quota")
+
+    llm.rewrite = rewrite
+    processing_msg = SimpleNamespace(chat=SimpleNamespace(id=1), edit_text=edit_text)
+    asyncio.run(admin._generate_preview(processing_msg, fsm(), llm, InflightRegistry(""), 10))
+    assert len(edits) == 1 and edits[0].startswith("⛔")
+
+
+def channel_config(*editors: Editor) -> Config:
+    return SimpleNamespace(editors=list(editors), editor=lambda user_id: next(
+        (e for e in editors if e.user_id == user_id), None))
+
+
+def press(handler, data: str, config, monkeypatch) -> tuple[list, list]:
+    """Run a publish callback for editor 10: (alerts shown, channels published to)."""
+    alerts, published = [], []
+
+    async def answer(text=None, show_alert=False):
+        alerts.append(text)
+
+    async def fake_publish(callback, state, bot, inflight, dedup, archive, chat_id, channel_idx=0):
+        published.append(chat_id)
+
+    monkeypatch.setattr(admin, "_do_publish", fake_publish)
+    callback = SimpleNamespace(data=data, from_user=SimpleNamespace(id=10), answer=answer)
+    asyncio.run(handler(callback, fsm(), None, config, None, None, None))
+    return alerts, published
+
+
+def test_channel_ownership(monkeypatch):
+    only_news = channel_config(Editor(10, "Аня", [news]))
+    # One channel: published there, never to the first channel of CHANNELS
+    assert press(admin.on_publish, "publish", only_news, monkeypatch) == ([], ["-100222"])
+    # Index 1 exists in CHANNELS but not in the editor's own list
+    assert press(admin.on_channel_selected, "channel:1", only_news, monkeypatch) == (["❌ Неверный канал"], [])
+    assert press(admin.on_channel_selected, "channel:0", only_news, monkeypatch) == ([], ["-100222"])
+
+    no_channels = channel_config(Editor(10, "Аня", []))
+    alerts, published = press(admin.on_publish, "publish", no_channels, monkeypatch)
+    assert alerts == ["❌ Тебе не назначено ни одного канала"] and published == []
+    assert press(admin.on_publish, "publish", channel_config(), monkeypatch)[1] == []  # not an editor
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Test script to verify SimHash near-duplicate detection and the dedup index
+"""
+import os
+import sys
+import subprocess
+
+from services.dedup import normalize, simhash, DedupIndex
+
+post = (
+    "Компания выпустила новую версию библиотеки для обработки изображений. "
+    "В релизе ускорили декодирование JPEG, добавили поддержку AVIF и исправили "
+    "утечку памяти при работе с большими файлами. Подробности в блоге: https://example.com/release"
+)
+# Same post forwarded by another channel: different link, emoji, case and punctuation
+near = (
+    "🔥 компания выпустила НОВУЮ версию библиотеки для обработки изображений! "
+    "В релизе ускорили декодирование JPEG, добавили поддержку AVIF и исправили "
+    "утечку памяти при работе с большими файлами... Подробности: https://example.org/news/1"
+)
+other = (
+    "Городской совет утвердил план ремонта дорог на следующий год. Работы начнутся "
+    "весной и затронут центральные улицы, движение будет перекрыто по выходным."
+)
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def test_normalize():
+    assert normalize("🔥 Ёж https://x.io ЕЖ!") == "еж еж"
+
+
+def test_simhash():
+    assert simhash("🔥 https://example.com") == 0  # nothing left after normalize
+    assert simhash(post) == simhash(post)
+    assert distance(simhash(post), simhash(near)) <= 8
+    assert distance(simhash(post), simhash(other)) > 12  # default max_distance
+
+
+def test_index(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.json"), capacity=3)
+    index.add_published(simhash(post), "Переписанный пост", [{"type": "bold", "offset": 0, "length": 5}], "@channel")
+    index.add_recent(simhash(other))
+    index.add_recent(0)  # empty text: not stored
+    assert len(index) == 2
+
+    entry, found_distance = index.find(simhash(near))
+    assert entry.text == "Переписанный пост"
+    assert found_distance == distance(simhash(post), simhash(near))
+    assert index.find(simhash(other)) is None  # kinds are separate
+    assert index.find(simhash(other), "recent") is not None
+    assert index.find(0) is None
+
+
+def test_save_load_and_eviction(tmp_path):
+    path = str(tmp_path / "dedup.json")
+    index = DedupIndex(path, capacity=3)
+    index.add_published(simhash(post), "Переписанный пост", [], "@channel")
+    index.add_recent(simhash(other))
+    index.save()
+
+    restored = DedupIndex(path, capacity=3)
+    restored.load()
+    assert len(restored) == 2
+    assert restored.find(simhash(post))[0].channel == "@channel"
+
+    for i in range(3):
+        index.add_recent(simhash(f"{other} Дополнение номер {i} про погоду и транспорт."))
+    assert len(index) == 3
+    assert index.find(simhash(post)) is None  # the oldest was evicted
+
+
+def test_light_import():
+    # The index only needs the URL regex, not the LLM service with its clients
+    check = "import sys, services.dedup; sys.exit('services.llm' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", check], cwd=os.path.dirname(os.path.abspath(__file__))).returncode == 0
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the shutdown drain, the checkpoint and resuming from it
+"""
+import sys
+import asyncio
+from types import SimpleNamespace
+
+from aiogram import Dispatcher
+
+import handlers.admin as admin
+from utils.inflight import InflightJob, InflightRegistry, ShuttingDown
+
+
+class FakeBot:
+    """Only what resume_pending needs: an id for FSM keys and send_message."""
+
+    id = 42
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text)
+
+
+def test_drain_checkpoint_and_resume(tmp_path, config, monkeypatch):
+    path = str(tmp_path / "pending.json")
+
+    async def shutdown():
+        inflight = InflightRegistry(path)
+        started = asyncio.Event()
+
+        async def job(kind, chat_id, seconds):
+            async with inflight.track(kind, chat_id, chat_id * 10, {"data": {"original_text": f"пост {chat_id}"}}):
+                started.set()
+                await asyncio.sleep(seconds)
+
+        finished = asyncio.create_task(job("rewrite", 4, 0))
+        running = asyncio.create_task(job("rewrite", 1, 10))
+        await started.wait()
+        # Left over from the previous run and not resumed yet
+        inflight.pending.append(InflightJob("publish", 3, 30, {"data": {"generated_text": "готовый пост"}}))
+        # Waiting for the circuit to close
+        inflight.park("rewrite", 2, 20, {"data": {"original_text": "пост 2"}, "message_id": 5})
+
+        drained, abandoned = await inflight.drain(timeout=0.05)
+        assert [j.chat_id for j in drained] == [4]
+        assert sorted(j.chat_id for j in abandoned) == [1, 2, 3]
+        assert running.cancelled() and finished.done()
+        try:
+            async with inflight.track("rewrite", 5, 50, {}):
+                raise AssertionError("work started after drain")
+        except ShuttingDown:
+            pass
+
+    asyncio.run(shutdown())
+
+    generated, previews = [], []
+
+    async def fake_generate(processing_msg, state, llm, inflight, user_id, **kwargs):
+        generated.append((processing_msg.chat.id, (await state.get_data())["original_text"]))
+
+    async def fake_preview(message, state, text, is_new=False):
+        previews.append((message.chat.id, text))
+
+    monkeypatch.setattr(admin, "_generate_preview", fake_generate)
+    monkeypatch.setattr(admin, "send_preview", fake_preview)
+
+    async def restart():
+        dispatcher = Dispatcher()
+        dispatcher["config"] = config
+        bot = FakeBot()
+        inflight = InflightRegistry(path)
+        await admin.resume_pending(bot, dispatcher, None, inflight)
+        # Nothing left for a second start
+        await admin.resume_pending(bot, dispatcher, None, InflightRegistry(path))
+        return bot, inflight
+
+    bot, inflight = asyncio.run(restart())
+    assert sorted(generated) == [(1, "пост 1"), (2, "пост 2")]
+    assert previews == [(3, "готовый пост")]
+    assert len(bot.sent) == 3
+    assert inflight.pending == []
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -3,74 +3,82 @@
 Test script to verify link extraction and restoration logic
 """
 import sys
-sys.path.insert(0, '/Users/aggel008/attention_log_bot')
 
 from services.llm import LLMService
-from config import load_config
-
-# Mock entities for testing
-test_entities = [
-    {"type": "text_link", "offset": 10, "length": 11, "url": "https://example.com/1"},
-    {"type": "text_link", "offset": 50, "length": 5, "url": "https://example.com/2"},
-    {"type": "url", "offset": 80, "length": 23, "url": None},  # url type has no url field
-]
 
 test_text = """Проверка встроенной ссылки здесь и еще одна ссылка
 тут, а также обычный URL https://example.com/3 в тексте."""
 
-# Manually set offsets correctly for test
 test_entities = [
     {"type": "text_link", "offset": 27, "length": 5, "url": "https://example.com/1"},  # "здесь"
     {"type": "text_link", "offset": 51, "length": 3, "url": "https://example.com/2"},  # "тут"
     {"type": "url", "offset": 76, "length": 21, "url": None},  # "https://example.com/3"
 ]
+# url -> the text its entity must cover after the round trip
+test_anchors = {
+    "https://example.com/1": "здесь",
+    "https://example.com/2": "тут",
+    "https://example.com/3": "https://example.com/3",
+}
+
+# 🔥 and 𝔸 are outside the BMP: two UTF-16 units each, so Telegram offsets
+# run ahead of Python string indices by one per such character
+astral_text = "🔥 Новость 𝔸 дня: подробности здесь, а источник https://example.com/4 ниже."
+astral_entities = [
+    {"type": "text_link", "offset": 31, "length": 5, "url": "https://example.com/5"},  # "здесь", code point 29
+]
+astral_anchors = {
+    "https://example.com/5": "здесь",
+    "https://example.com/4": "https://example.com/4",
+}
+
+
+def anchor_of(text: str, entity: dict) -> str:
+    """Slice text by a Telegram entity (UTF-16 offset/length)."""
+    units = text.encode("utf-16-le")
+    return units[entity["offset"] * 2:(entity["offset"] + entity["length"]) * 2].decode("utf-16-le")
+
+
+def assert_anchors(text: str, entities: list[dict], anchors: dict[str, str]) -> None:
+    assert sorted(e["url"] for e in entities) == sorted(anchors)
+    for e in entities:
+        assert anchor_of(text, e) == anchors[e["url"]], e
+
+
+def test_extract_and_restore(llm):
+    text_with_tokens, links = llm._extract_all_links(test_text, test_entities)
+    assert "https://" not in text_with_tokens
+    assert len(links) == len(test_entities)
+
+    restored_text, restored_entities = llm._restore_all_links(text_with_tokens, links)
+    assert restored_text == test_text
+    assert len(restored_entities) == len(test_entities)
+
+
+def test_extract_after_astral_text():
+    assert anchor_of(astral_text, astral_entities[0]) == "здесь"
+    text_with_tokens, links = LLMService._extract_all_links(astral_text, astral_entities)
+    anchors = {data["anchor"]: data["url"] for data in links.values()}
+    assert anchors == {"здесь": "https://example.com/5", None: "https://example.com/4"}
+    assert "https://" not in text_with_tokens
+
+
+def test_finalize_round_trip(llm):
+    for source, entities, anchors in ((test_text, test_entities, test_anchors),
+                                      (astral_text, astral_entities, astral_anchors)):
+        tokens_text, links = llm._extract_all_links(source, entities)
+        final_text, final_entities = llm._finalize(tokens_text, links)
+        assert final_text == source
+        assert_anchors(final_text, final_entities, anchors)
+
+
+def test_finalize_emoji_added_by_llm(llm):
+    # An emoji the LLM puts in front of the link must shift the UTF-16 offset too
+    tokens_text, links = llm._extract_all_links(astral_text, astral_entities)
+    final_text, final_entities = llm._finalize("🎉🎉 " + tokens_text, links)
+    assert_anchors(final_text, final_entities, astral_anchors)
+
 
-print("=" * 60)
-print("TESTING LINK EXTRACTION")
-print("=" * 60)
-
-config = load_config()
-llm = LLMService(config)
-
-print("\nOriginal text:")
-print(test_text)
-print(f"\nEntities: {len(test_entities)}")
-for e in test_entities:
-    print(f"  - {e}")
-
-# Test extraction
-text_with_tokens, links = llm._extract_all_links(test_text, test_entities)
-
-print("\n" + "=" * 60)
-print("AFTER EXTRACTION")
-print("=" * 60)
-print("\nText with tokens:")
-print(text_with_tokens)
-print(f"\nExtracted links: {len(links)}")
-for token, data in links.items():
-    print(f"  {token} -> anchor={data['anchor']}, url={data['url']}")
-
-# Simulate LLM processing (just return the same text)
-llm_response = text_with_tokens
-
-print("\n" + "=" * 60)
-print("TESTING RESTORATION")
-print("=" * 60)
-print("\nLLM response (simulated - same as input):")
-print(llm_response)
-
-# Test restoration
-restored_text, restored_entities = llm._restore_all_links(llm_response, links)
-
-print("\nRestored text:")
-print(restored_text)
-print(f"\nRestored entities: {len(restored_entities)}")
-for e in restored_entities:
-    print(f"  - {e}")
-
-print("\n" + "=" * 60)
-print("VERIFICATION")
-print("=" * 60)
-print(f"Original entities count: {len(test_entities)}")
-print(f"Restored entities count: {len(restored_entities)}")
-print(f"Match: {len(test_entities) == len(restored_entities)}")
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Test script to verify output budget sizing and the retry on a truncated answer
+"""
+import sys
+import asyncio
+
+from google.genai import types
+
+from config import LatencyProfile
+from services.llm import output_budget, estimate_tokens
+
+post = "Короткий пост про новости дня, в котором есть пара фраз и ссылка ⟦LINK:0⟧. " * 20
+LIMITS = {"reserve": 3072, "ratio": 1.5, "floor": 1024, "ceiling": 8192}
+
+
+def test_budget_follows_input():
+    assert output_budget(post, **LIMITS) == 3072 + int(estimate_tokens(post) * 1.5)
+    assert output_budget(post * 2, **LIMITS) > output_budget(post, **LIMITS)
+
+
+def test_floor_and_ceiling():
+    assert output_budget("Да", **{**LIMITS, "reserve": 0}) == 1024
+    assert output_budget(post * 50, **LIMITS) == 8192
+
+
+def test_thinking_reserve_from_profile():
+    no_thinking = LatencyProfile("fast", thinking_budget=0, max_output_tokens=2048, temperature=0.6)
+    fixed = LatencyProfile("balanced", thinking_budget=1024, max_output_tokens=4096, temperature=0.7)
+    dynamic = LatencyProfile("quality", thinking_budget=None, max_output_tokens=8192, temperature=0.7)
+    answer = int(estimate_tokens(post) * 1.5)
+
+    assert output_budget(post, **LIMITS, profile=no_thinking) == max(1024, answer)
+    assert output_budget(post, **LIMITS, profile=fixed) == 1024 + answer
+    assert output_budget(post, **LIMITS, profile=dynamic) == 3072 + answer  # the configured reserve
+    assert output_budget(post * 50, **LIMITS, profile=no_thinking) == 2048  # the profile's cap
+
+
+def stub_budgets(llm, truncated: int) -> list[int]:
+    """Make the stub's first `truncated` answers stop at MAX_TOKENS; returns max_output_tokens of every call."""
+    models = llm.client.aio.models
+    generate = models.generate_content
+    budgets = []
+
+    async def generate_content(model, contents, config=None):
+        budgets.append(config.max_output_tokens)
+        response = await generate(model=model, contents=contents, config=config)
+        if len(budgets) <= truncated:
+            response.candidates[0].finish_reason = types.FinishReason.MAX_TOKENS
+        return response
+
+    models.generate_content = generate_content
+    return budgets
+
+
+def finish_reason(llm) -> types.FinishReason:
+    response = asyncio.run(llm._call("Перепиши текст.", post, llm.model_name))
+    return response.candidates[0].finish_reason
+
+
+def test_no_retry_when_complete(llm):
+    budgets = stub_budgets(llm, truncated=0)
+    assert finish_reason(llm) == types.FinishReason.STOP
+    assert budgets == [llm._output_budget(post)]
+
+
+def test_retry_on_max_tokens(llm):
+    budgets = stub_budgets(llm, truncated=1)
+    assert finish_reason(llm) == types.FinishReason.STOP
+    first = llm._output_budget(post)
+    assert budgets == [first, max(llm.output_ceiling, first * 2)]
+
+
+def test_single_retry(llm):
+    budgets = stub_budgets(llm, truncated=2)
+    assert finish_reason(llm) == types.FinishReason.MAX_TOKENS  # returned as is after one retry
+    assert len(budgets) == 2
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
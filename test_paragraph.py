@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Test script to verify single-paragraph regeneration keeps the draft's entities in place
+"""
+import sys
+import asyncio
+
+from services.llm import _splice_entities
+from utils.text import final_fix, final_fix_entities
+from test_links import anchor_of
+
+# A finished draft (already through final_fix): a link after the paragraph
+# that gets regenerated, and emoji before it so UTF-16 and code points differ
+draft = (
+    "🔥 Первый абзац про новости дня, тут все как было\n\n"
+    "Второй абзац, который перепишем заново\n\n"
+    "Третий абзац со ссылкой 🎉 и жирным словом в конце"
+)
+draft_entities = [
+    {"type": "text_link", "offset": 107, "length": 7, "url": "https://example.com/1"},  # "ссылкой"
+    {"type": "bold", "offset": 120, "length": 6},  # "жирным"
+]
+
+
+def test_draft_entities():
+    assert anchor_of(draft, draft_entities[0]) == "ссылкой"
+    assert anchor_of(draft, draft_entities[1]) == "жирным"
+
+
+def test_link_after_regenerated_paragraph(llm):
+    # The model answers with markdown and a final dot, both removed by final_fix
+    answer = llm.client.aio.models._answer
+    llm.client.aio.models._answer = lambda contents: (
+        lambda text, *tokens: (f"**{text}**.", *tokens)
+    )(*answer(contents))
+
+    result = asyncio.run(llm.rewrite_paragraph(draft, draft_entities, 1))
+    assert "**Второй абзац, который перепишем заново**." in result.text
+    text, entities = final_fix_entities(result.text, result.entities)
+    assert text == final_fix(result.text) == draft
+    assert [anchor_of(text, e) for e in entities] == ["ссылкой", "жирным"]
+
+
+def test_final_fix_entities():
+    text = "  *Заголовок* со ссылкой.\n\nКонец — тут.  "
+    entities = [
+        {"type": "bold", "offset": 2, "length": 11},  # "*Заголовок*"
+        {"type": "text_link", "offset": 17, "length": 7, "url": "https://example.com"},  # "ссылкой"
+        {"type": "italic", "offset": 24, "length": 1},  # "." (removed)
+        {"type": "underline", "offset": 35, "length": 4},  # "тут."
+    ]
+    fixed, remapped = final_fix_entities(text, entities)
+    assert fixed == final_fix(text) == "Заголовок со ссылкой\n\nКонец - тут"
+    assert [anchor_of(fixed, e) for e in remapped] == ["Заголовок", "ссылкой", "тут"]
+    assert remapped[1]["url"] == "https://example.com"
+
+
+def test_splice_after_paragraph_rewrite():
+    # Three-paragraph draft (UTF-16 offsets): the middle paragraph [14, 27) is
+    # replaced by one 4 units longer that carries its own link at 2
+    entities = [
+        {"type": "bold", "offset": 0, "length": 11},  # first paragraph
+        {"type": "text_link", "offset": 14, "length": 6, "url": "https://example.com/old"},  # inside
+        {"type": "italic", "offset": 0, "length": 34},  # covers all three paragraphs
+        {"type": "underline", "offset": 20, "length": 14},  # starts inside, ends in the last paragraph
+        {"type": "bold", "offset": 29, "length": 5},  # last paragraph
+    ]
+    new_entities = [{"type": "text_link", "offset": 2, "length": 4, "url": "https://example.com/new"}]
+    spliced, reset = _splice_entities(entities, 14, 27, new_entities, 4)
+    assert spliced == [
+        {"type": "bold", "offset": 0, "length": 11},
+        {"type": "italic", "offset": 0, "length": 38},  # stretched
+        {"type": "text_link", "offset": 16, "length": 4, "url": "https://example.com/new"},
+        {"type": "underline", "offset": 31, "length": 7},  # clipped to the part outside
+        {"type": "bold", "offset": 33, "length": 5},  # shifted
+    ]
+    assert reset == 1
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test script to verify replace_preview: edits in place, resend fallback and the album caption limit
+"""
+import sys
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import handlers.admin as admin
+from utils.states import PostState
+
+POST = "Переписанный пост про новости дня"
+ALBUM = {"is_album": True, "media_group": [{"type": "photo", "media": "photo-1"}, {"type": "photo", "media": "photo-2"}]}
+
+
+class FakeBot:
+    def __init__(self, calls: list):
+        self.calls = calls
+
+    async def edit_message_caption(self, chat_id, message_id, caption=None, **kwargs):
+        self.calls.append(("bot.edit_message_caption", message_id, caption))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(("bot.send_message", text))
+        return SimpleNamespace(message_id=300)
+
+    async def delete_messages(self, chat_id, message_ids):
+        self.calls.append(("bot.delete_messages", message_ids))
+
+
+class FakeMessage:
+    """The preview being replaced: a text message (text set) or media with a caption (text None)."""
+
+    def __init__(self, text: str | None, fail: str | None = None):
+        self.text = text
+        self.message_id = 100
+        self.chat = SimpleNamespace(id=1)
+        self.calls = []
+        self.bot = FakeBot(self.calls)
+        self.fail = fail
+        self.sent = 200
+
+    def _edit(self, name, body):
+        self.calls.append((name, body))
+        if self.fail:
+            raise TelegramBadRequest(None, f"Bad Request: {self.fail}")
+
+    async def edit_text(self, text, **kwargs):
+        self._edit("edit_text", text)
+
+    async def edit_caption(self, caption=None, **kwargs):
+        self._edit("edit_caption", caption)
+
+    def _answer(self, name, body):
+        self.calls.append((name, body))
+        self.sent += 1
+        return SimpleNamespace(message_id=self.sent)
+
+    async def answer(self, text, **kwargs):
+        return self._answer("answer", text)
+
+    async def answer_photo(self, photo, caption=None, **kwargs):
+        return self._answer("answer_photo", caption)
+
+    async def answer_video(self, video, caption=None, **kwargs):
+        return self._answer("answer_video", caption)
+
+
+def show(message: FakeMessage, data: dict, text: str = POST) -> dict:
+    """replace_preview(message) over FSM data; returns the FSM data afterwards."""
+    async def run():
+        state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+        await state.set_data(data)
+        await admin.replace_preview(message, state, text)
+        assert await state.get_state() == PostState.viewing_preview
+        return await state.get_data()
+
+    return asyncio.run(run())
+
+
+def test_edit_in_place():
+    message = FakeMessage("⏳ Processing...")
+    show(message, {"media_type": "text"})
+    assert message.calls == [("edit_text", POST)]
+
+    message = FakeMessage(None)
+    show(message, {"media_type": "photo", "file_id": "photo-1"})
+    assert message.calls == [("edit_caption", POST)]
+
+
+def test_resend_when_edit_fails():
+    message = FakeMessage("старое превью", fail="message to edit not found")
+    show(message, {"media_type": "text"})
+    assert message.calls == [("edit_text", POST), ("bot.delete_messages", [100]), ("answer", POST)]
+
+    message = FakeMessage(None, fail="message can't be edited")
+    show(message, {"media_type": "video", "file_id": "video-1"})
+    assert message.calls == [("edit_caption", POST), ("bot.delete_messages", [100]), ("answer_video", POST)]
+
+
+def test_unchanged_text_not_resent():
+    message = FakeMessage("старое превью", fail="message is not modified")
+    show(message, {"media_type": "text"})
+    assert message.calls == [("edit_text", POST)]
+
+
+def test_text_to_media_resends():
+    # "⏳ Processing..." is text, an album preview is a photo: only a new message will do
+    message = FakeMessage("⏳ Processing...")
+    show(message, ALBUM)
+    assert message.calls == [("bot.delete_messages", [100]), ("answer_photo", admin.ALBUM_PREFIX + POST)]
+
+
+def test_album_prefix_counts_against_caption_limit():
+    fits = "я" * (admin.CAPTION_LIMIT - len(admin.ALBUM_PREFIX))
+    too_long = fits + "я"
+
+    message = FakeMessage(None)
+    show(message, ALBUM, fits)
+    assert message.calls == [("edit_caption", admin.ALBUM_PREFIX + fits)]
+
+    # The text alone fits 1024, with the prefix it doesn't: the caption moves to its own message
+    message = FakeMessage(None)
+    data = show(message, ALBUM, too_long)
+    assert message.calls == [("bot.edit_message_caption", 100, None), ("bot.send_message", admin.ALBUM_PREFIX + too_long)]
+    assert data["preview_split"] == [100, 300]
+
+    message = FakeMessage("⏳ Processing...")
+    data = show(message, ALBUM, too_long)
+    assert message.calls == [("bot.delete_messages", [100]), ("answer_photo", None),
+                             ("answer", admin.ALBUM_PREFIX + too_long)]
+    assert data["preview_split"] == [201, 202]
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
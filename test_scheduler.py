@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test script to verify LLM scheduler priorities, per-owner limits and preemption
+"""
+import sys
+import asyncio
+
+from services.scheduler import LLMScheduler, current_owner
+
+
+def job(name: str, order: list[str]):
+    async def request():
+        order.append(name)
+        return name
+    return request
+
+
+def test_priority_ordering():
+    async def run():
+        scheduler = LLMScheduler(concurrency=1)
+        order = []
+        gate = asyncio.Event()
+
+        # Occupy the only slot, then queue work of every class
+        holder = asyncio.create_task(scheduler.run(gate.wait, "normal"))
+        await asyncio.sleep(0)
+        names = [f"{priority}{i}" for priority in ("background", "normal", "interactive") for i in range(2)]
+        tasks = [asyncio.create_task(scheduler.run(job(name, order), name[:-1])) for name in names]
+        await asyncio.sleep(0)
+        assert scheduler.queued() == {"interactive": 2, "normal": 2, "background": 2}
+
+        gate.set()
+        await holder
+        assert await asyncio.gather(*tasks) == names
+        assert order == ["interactive0", "interactive1", "normal0", "normal1", "background0", "background1"]
+    asyncio.run(run())
+
+
+def test_owner_limits():
+    async def run():
+        scheduler = LLMScheduler(concurrency=3, limits={"alice": 1})
+        running = {"alice": 0, "bob": 0}
+        peak = {"alice": 0, "bob": 0}
+
+        async def editor_calls(owner, count):
+            current_owner.set(owner)
+
+            async def request():
+                running[owner] += 1
+                peak[owner] = max(peak[owner], running[owner])
+                await asyncio.sleep(0.02)
+                running[owner] -= 1
+
+            await asyncio.gather(*(scheduler.run(request, "interactive") for _ in range(count)))
+
+        await asyncio.gather(editor_calls("alice", 4), editor_calls("bob", 4))
+        assert peak == {"alice": 1, "bob": 2}  # bob takes the slots alice may not
+        stats = scheduler.wait_stats()
+        assert stats["alice"][0] == 4 and stats["bob"][0] == 4
+    asyncio.run(run())
+
+
+def preemption_run(max_preemptions: int) -> tuple[int, int, list[str]]:
+    """A background call occupies the only slot while two interactive ones arrive.
+
+    Returns (preemptions, background attempts, completion order).
+    """
+    async def run():
+        scheduler = LLMScheduler(concurrency=1, max_preemptions=max_preemptions)
+        attempts = 0
+        order = []
+        started = asyncio.Event()
+
+        async def background_request():
+            nonlocal attempts
+            attempts += 1
+            started.set()
+            await asyncio.sleep(0.05)
+            order.append("background")
+
+        background = asyncio.create_task(scheduler.run(background_request, "background"))
+        await started.wait()
+        started.clear()
+        await scheduler.run(job("interactive0", order), "interactive")
+        if scheduler.preempted:
+            await started.wait()  # the requeued call is running again
+        await scheduler.run(job("interactive1", order), "interactive")
+        await background
+        return scheduler.preempted, attempts, order
+    return asyncio.run(run())
+
+
+def test_no_preemption_by_default():
+    # A cancelled Vertex call is still billed: running background work is never cancelled
+    preempted, attempts, order = preemption_run(max_preemptions=0)
+    assert (preempted, attempts) == (0, 1)
+    assert order[0] == "background"
+
+
+def test_preemption_cap():
+    # Opted in: the first interactive call preempts, the requeued call then runs to completion
+    preempted, attempts, order = preemption_run(max_preemptions=1)
+    assert (preempted, attempts) == (1, 2)
+    assert order == ["interactive0", "background", "interactive1"]
+
+
+def test_cancelled_waiter():
+    async def run():
+        scheduler = LLMScheduler(concurrency=1)
+        gate = asyncio.Event()
+        holder = asyncio.create_task(scheduler.run(gate.wait, "normal"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(scheduler.run(job("cancelled", []), "normal"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.queued()["normal"] == 0
+
+        gate.set()
+        await holder
+        assert await scheduler.run(job("after", []), "normal") == "after"
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test script to verify token accounting, budget modes and flushing to SQLite
+"""
+import sys
+import asyncio
+
+from google.genai import types
+
+from services.usage import Usage, UsageTracker
+
+
+def metadata(tokens: int) -> types.GenerateContentResponseUsageMetadata:
+    """One call that spent `tokens` in total (half prompt, half output)."""
+    return types.GenerateContentResponseUsageMetadata(
+        prompt_token_count=tokens // 2, candidates_token_count=tokens - tokens // 2, thoughts_token_count=0,
+    )
+
+
+def test_daily_budget_modes(tmp_path):
+    usage = UsageTracker(str(tmp_path / "usage.db"), daily_budget=1000, economy_ratio=0.8, pause_ratio=0.95)
+    usage.record("gemini-2.5-pro", metadata(799), purpose="draft")
+    assert not usage.economy and not usage.regenerations_paused
+
+    usage.record("gemini-2.5-pro", metadata(1), purpose="draft")  # exactly 80%
+    assert usage.economy and not usage.regenerations_paused
+
+    usage.record("gemini-2.5-pro", metadata(150), purpose="regenerate")  # 95%
+    assert usage.economy and usage.regenerations_paused
+    assert usage.spent() == (950, 950)
+
+
+def test_monthly_budget(tmp_path):
+    usage = UsageTracker(str(tmp_path / "usage.db"), monthly_budget=100)
+    usage.record("gemini-2.5-flash", metadata(50))
+    assert not usage.economy
+    usage.record("gemini-2.5-flash", metadata(50))
+    assert usage.regenerations_paused
+    assert usage.budget_ratio() == 1.0
+
+
+def test_no_budget_is_unlimited(tmp_path):
+    usage = UsageTracker(str(tmp_path / "usage.db"))
+    usage.record("gemini-2.5-pro", metadata(10**9))
+    assert usage.budget_ratio() == 0.0 and not usage.economy
+
+
+def test_editor_quota(tmp_path):
+    usage = UsageTracker(str(tmp_path / "usage.db"), editor_budgets={1: 100})
+    usage.record_rewrite(Usage(1, 60, 30, 0), 2.0, editor=1, profile="fast")
+    assert usage.editor_spent(1) == 90 and not usage.editor_exhausted(1)
+    usage.record_rewrite(Usage(1, 5, 5, 0), 1.0, editor=1)
+    assert usage.editor_exhausted(1)
+    usage.record_rewrite(Usage(1, 500, 500, 0), 1.0, editor=2)
+    assert not usage.editor_exhausted(2)  # no quota configured
+
+
+def test_flush_and_reload(tmp_path):
+    path = str(tmp_path / "usage.db")
+
+    async def run():
+        usage = UsageTracker(path, daily_budget=1000)
+        usage.record("gemini-2.5-pro", metadata(900), purpose="draft")
+        usage.record_rewrite(Usage(1, 450, 450, 0), 3.0, editor=7, profile="quality")
+        await usage.flush()
+        assert usage.spent() == (900, 900)  # now from the stored totals
+        assert usage.editor_spent(7) == 900
+        await usage.close()
+
+    asyncio.run(run())
+    # Another process (bulk CLI, restart) sees the spend and starts in economy mode
+    reopened = UsageTracker(path, daily_budget=1000)
+    assert reopened.spent() == (900, 900)
+    reopened.record("gemini-2.5-pro", metadata(0))
+    assert reopened.economy
+    assert "черновики" in reopened.summary()
+
+
+def test_close_keeps_pending_rows(tmp_path):
+    path = str(tmp_path / "usage.db")
+
+    async def run():
+        usage = UsageTracker(path, flush_interval=60)
+        usage.start()
+        usage.record("gemini-2.5-pro", metadata(40), purpose="draft")
+        usage.record_rewrite(Usage(1, 20, 20, 0), 1.0, editor=3)
+        await asyncio.sleep(0)  # the flusher is waiting, nothing written yet
+        await usage.close()
+
+    asyncio.run(run())
+    reopened = UsageTracker(path)
+    assert reopened.spent() == (40, 40)
+    assert reopened.editor_spent(3) == 40
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
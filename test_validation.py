@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test script to verify LLM answer validation and corrective notes
+"""
+import sys
+
+from services.validation import validate, ValidationStats, count_paragraphs
+
+tokens = ["⟦LINK:0⟧", "⟦LINK:1⟧"]
+good = (
+    "Первый абзац со ссылкой ⟦LINK:0⟧ внутри. И еще одна фраза.\n\n"
+    "Второй абзац тоже нормальный, ссылка ⟦LINK:1⟧ на месте."
+)
+
+
+def test_valid_answer():
+    result = validate(good, tokens)
+    assert result.ok and result.score == 1.0
+    assert count_paragraphs(good) == 2
+    assert result.correction() == ""
+
+
+def test_empty_answer():
+    assert validate("   ", tokens).violations == ["empty"]
+
+
+def test_link_tokens():
+    result = validate(good.replace("⟦LINK:1⟧", ""), tokens)
+    assert result.violations == ["tokens_missing"] and result.details["tokens_missing"] == "⟦LINK:1⟧"
+
+    assert validate(good.replace("⟦LINK:1⟧", "⟦LINK:1⟧ ⟦LINK:1⟧"), tokens).violations == ["tokens_duplicated"]
+
+    result = validate(good + " ⟦LINK:7⟧", tokens)
+    assert result.violations == ["tokens_new"] and result.details["tokens_new"] == "⟦LINK:7⟧"
+
+
+def test_dashes():
+    assert validate(good.replace("И еще", "И — еще"), tokens).violations == ["dashes"]
+    assert validate(good.replace("И еще", "И – еще"), tokens).violations == ["dashes"]
+    assert validate(good.replace("И еще", "И - еще"), tokens).ok
+
+
+def test_paragraphs():
+    assert validate(good + "\n\nКоротко.", tokens).violations == ["paragraphs"]  # one-phrase paragraph
+    result = validate(good, tokens, min_paragraphs=3)
+    assert result.violations == ["paragraphs"] and result.details["paragraphs"] == "3–6"
+    assert validate("Готово ⟦LINK:0⟧ ⟦LINK:1⟧", tokens).ok  # a single short paragraph is fine
+
+
+def test_correction():
+    result = validate(good.replace("⟦LINK:0⟧", "").replace("И еще", "И — еще"), tokens)
+    assert result.violations == ["tokens_missing", "dashes"]  # in rule order
+    assert abs(result.score - (1 - 2 / 6)) < 1e-9
+
+    lines = result.correction().splitlines()
+    assert len(lines) == 2 and all(line.startswith("- ") for line in lines)
+    assert "⟦LINK:0⟧" in lines[0]
+
+
+def test_stats():
+    stats = ValidationStats()
+    stats.record("fast", validate(good, tokens))
+    stats.record("fast", validate(good.replace("⟦LINK:0⟧", "").replace("И еще", "И — еще"), tokens))
+    stats.record("pro", validate(good, tokens))
+    assert stats.failure_rates() == {"fast": {"tokens_missing": 0.5, "dashes": 0.5}}
+    assert stats.summary().startswith("fast (2 ответов): ")
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the variant history and ◀/▶ navigation
+"""
+import sys
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import handlers.admin as admin
+from utils.variants import push_variant, select_variant
+
+link = {"type": "text_link", "offset": 0, "length": 7, "url": "https://example.com"}
+bold = {"type": "bold", "offset": 8, "length": 3}
+
+
+def history(count: int, limit: int = 5) -> dict:
+    data = {}
+    for i in range(count):
+        data.update(push_variant(data, f"Вариант {i}", [link, bold] if i % 2 else [], f"model-{i}", float(i), limit=limit))
+    return data
+
+
+def test_push_and_cap():
+    data = history(7)
+    assert [v[0] for v in data["variants"]] == [f"Вариант {i}" for i in range(2, 7)]  # two oldest evicted
+    assert data["variant_idx"] == 4
+    assert data["generated_text"] == "Вариант 6" and data["model"] == "model-6"
+    assert len(history(3, limit=0)["variants"]) == 1  # at least the current one is kept
+
+
+def test_duplicate_and_reset():
+    data = history(3)
+    data.update(push_variant(data, "Вариант 0", [], "again"))
+    assert [v[0] for v in data["variants"]] == ["Вариант 1", "Вариант 2", "Вариант 0"]
+    data.update(push_variant(data, "Новый черновик", [], "fresh", reset=True))
+    assert [v[0] for v in data["variants"]] == ["Новый черновик"] and data["variant_idx"] == 0
+
+
+def test_select_after_eviction():
+    data = history(7)
+    oldest = select_variant(data, 0)
+    assert oldest["generated_text"] == "Вариант 2" and oldest["rewrite_seconds"] == 2.0
+    assert select_variant(data, 1)["generated_entities"] == [link, bold]  # url kept only where set
+    assert select_variant(data, 5) is None
+    assert select_variant(data, -1) is None
+    assert select_variant({}, 0) is None
+
+
+def navigate(data: dict, *presses: str, monkeypatch) -> list[int]:
+    """Press ◀/▶ in order; returns variant_idx after each press."""
+    shown = []
+
+    async def fake_replace(message, state, text):
+        shown.append(text)
+
+    monkeypatch.setattr(admin, "replace_preview", fake_replace)
+
+    async def run():
+        state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+        await state.set_data(data)
+        answered = []
+
+        async def answer_callback_query(callback_id, *args, **kwargs):
+            answered.append(callback_id)
+
+        async def answer(*args, **kwargs):
+            answered.append("answer")
+
+        indexes = []
+        for press in presses:
+            callback = SimpleNamespace(id=press, data=press, message=None, answer=answer,
+                                       bot=SimpleNamespace(answer_callback_query=answer_callback_query))
+            await admin.on_variant(callback, state)
+            current = await state.get_data()
+            assert current["generated_text"] == current["variants"][current["variant_idx"]][0]
+            indexes.append(current["variant_idx"])
+        assert len(answered) == len(presses)  # every press is answered
+        return indexes
+
+    return asyncio.run(run())
+
+
+def test_navigation_wraps(monkeypatch):
+    data = history(3)
+    assert navigate(data, "variant:next", "variant:next", "variant:prev", "variant:prev", "variant:prev",
+                    monkeypatch=monkeypatch) == [0, 1, 0, 2, 1]
+
+
+def test_navigation_single_variant(monkeypatch):
+    assert navigate(history(1), "variant:next", "variant:prev", "variant:noop", monkeypatch=monkeypatch) == [0, 0, 0]
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
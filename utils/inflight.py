@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+_log = logging.getLogger(__name__)
+
+
+class ShuttingDown(Exception):
+    """Raised when new work is started after the drain phase began."""
+
+
+@dataclass
+class InflightJob:
+    kind: str  # "rewrite" | "publish"
+    chat_id: int
+    user_id: int
+    payload: dict  # everything needed to resume the job (FSM data, texts)
+    started_at: float = field(default_factory=time.time)
+    task: asyncio.Task | None = field(default=None, repr=False, compare=False)
+    # Set when the job itself ends; its task (e.g. the parked-jobs loop) may run on
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False, compare=False)
+
+    def describe(self) -> str:
+        return f"{self.kind}(chat={self.chat_id}, age={time.time() - self.started_at:.1f}s)"
+
+
+class InflightRegistry:
+    """Tracks LLM rewrites and publishes so shutdown can drain them.
+
+    Handlers wrap expensive work in `track()`. On shutdown `drain()` waits for
+    the tracked jobs up to a deadline and checkpoints whatever is still
+    running, so it can be resumed on the next start.
+    """
+
+    def __init__(self, checkpoint_path: str):
+        self.checkpoint_path = checkpoint_path
+        self.accepting = True
+        self._by_id: dict[int, InflightJob] = {}
+        # Jobs loaded from the previous run's checkpoint, not started yet
+        self.pending: list[InflightJob] = []
+        # Rewrites waiting for the LLM backend to recover (circuit open)
+        self.parked: list[InflightJob] = []
+        self._parked_event = asyncio.Event()
+
+    @asynccontextmanager
+    async def track(self, kind: str, chat_id: int, user_id: int, payload: dict):
+        if not self.accepting:
+            raise ShuttingDown()
+        job = InflightJob(kind, chat_id, user_id, payload, task=asyncio.current_task())
+        self._by_id[id(job)] = job
+        try:
+            yield job
+        finally:
+            self._by_id.pop(id(job), None)
+            job.done.set()
+
+    @property
+    def jobs(self) -> list[InflightJob]:
+        return list(self._by_id.values())
+
+    async def drain(self, timeout: float) -> tuple[list[InflightJob], list[InflightJob]]:
+        """Stop accepting work and wait for in-flight jobs.
+
+        Returns: (drained, abandoned). Abandoned jobs are checkpointed to disk
+        and their tasks cancelled.
+        """
+        self.accepting = False
+        jobs = self.jobs
+        if jobs:
+            _log.info(f"[DRAIN] Waiting up to {timeout:.0f}s for {len(jobs)} in-flight job(s)")
+            # The job's own end, not its task's: a long-lived task (parked loop) outlives its jobs
+            waiters = [asyncio.create_task(job.done.wait()) for job in jobs]
+            await asyncio.wait(waiters, timeout=timeout)
+            for waiter in waiters:
+                waiter.cancel()
+
+        drained = [job for job in jobs if job.done.is_set()]
+        running = [job for job in jobs if not job.done.is_set()]
+        # Resumed and parked jobs that never got started go back to the checkpoint as well
+        abandoned = running + self.pending + self.parked
+        self.pending = []
+        self.parked = []
+        if abandoned:
+            self.save_checkpoint(abandoned)
+        tasks = {job.task for job in running if job.task is not None}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for job in drained:
+            _log.info(f"[DRAIN] Finished: {job.describe()}")
+        for job in abandoned:
+            _log.warning(f"[DRAIN] Abandoned (checkpointed): {job.describe()}")
+        return drained, abandoned
+
+    def save_checkpoint(self, jobs: list[InflightJob]) -> None:
+        records = [
+            {"kind": job.kind, "chat_id": job.chat_id, "user_id": job.user_id,
+             "payload": job.payload, "started_at": job.started_at}
+            for job in jobs
+        ]
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self) -> int:
+        """Move the checkpoint left by the previous run into `pending`."""
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, json.JSONDecodeError) as e:
+            _log.error(f"[DRAIN] Cannot read checkpoint {self.checkpoint_path}: {e}")
+            return 0
+        os.remove(self.checkpoint_path)
+        self.pending = [InflightJob(**record) for record in records]
+        return len(self.pending)
+
+    def next_pending(self) -> InflightJob | None:
+        if not self.accepting or not self.pending:
+            return None
+        return self.pending.pop(0)
+
+    def park(self, kind: str, chat_id: int, user_id: int, payload: dict, front: bool = False) -> None:
+        """Queue a job until the backend is reachable again; front=True keeps its turn on re-park."""
+        job = InflightJob(kind, chat_id, user_id, payload)
+        self.parked.insert(0 if front else len(self.parked), job)
+        self._parked_event.set()
+        _log.info(f"[DRAIN] Parked {job.describe()}, {len(self.parked)} waiting")
+
+    async def wait_parked(self) -> None:
+        """Wait until at least one job is parked; the caller pops it when it can run it."""
+        while not self.parked:
+            self._parked_event.clear()
+            await self._parked_event.wait()
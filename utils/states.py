@@ -3,4 +3,5 @@ from aiogram.fsm.state import State, StatesGroup
 class PostState(StatesGroup):
     viewing_preview = State()        # Режим просмотра превью
     waiting_for_correction = State() # Режим ожидания ручной правки текста
-    selecting_channel = State()      # Режим выбора канала для публикации
\ No newline at end of file
+    selecting_channel = State()      # Режим выбора канала для публикации
+    confirming_duplicate = State()   # Форвард похож на опубликованный пост: взять / переписать / пропустить
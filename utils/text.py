@@ -0,0 +1,47 @@
+"""Plain-text helpers shared by the bot, the LLM service and the CLIs."""
+import re
+from bisect import bisect_left
+
+from utils.utf16 import Utf16Index
+
+# Raw URL in post text (parentheses allowed when balanced, as in Wikipedia links)
+LINK_PATTERN = re.compile(r'https?://(?:[^\s<>\"()]|\([^\s<>\"()]*\))+')
+
+DASHES = str.maketrans({"—": "-", "–": "-"})
+TRAILING_DOT = re.compile(r'\.(?=\s*(\n|$))')
+
+
+def final_fix(text):
+    return final_fix_entities(text, [])[0]
+
+
+def final_fix_entities(text: str, entities: list[dict]) -> tuple[str, list[dict]]:
+    """final_fix that keeps entities (Telegram UTF-16 offsets) on their text.
+
+    Every removed character (asterisk, trailing dot, outer whitespace) moves
+    the entities after it; an entity left with no text is dropped.
+    """
+    # origin[i]: index in `text` of the i-th character kept so far
+    origin = list(range(len(text)))
+    # Убираем все звездочки, если они вдруг пролезли
+    origin = [i for i in origin if text[i] != "*"]
+    # Длинные тире (em-dash) → обычное тире (длина не меняется)
+    fixed = "".join(text[i] for i in origin).translate(DASHES)
+    # Убираем точки в конце строк/абзацев
+    dots = {m.start() for m in TRAILING_DOT.finditer(fixed)}
+    if dots:
+        origin = [i for n, i in enumerate(origin) if n not in dots]
+        fixed = "".join(c for n, c in enumerate(fixed) if n not in dots)
+    stripped = fixed.strip()
+    lead = len(fixed) - len(fixed.lstrip())
+    origin = origin[lead:lead + len(stripped)]
+
+    old_index, new_index = Utf16Index(text), Utf16Index(stripped)
+    remapped = []
+    for entity in entities:
+        start, end = old_index.to_codepoints(entity["offset"], entity["length"])
+        start, end = bisect_left(origin, start), bisect_left(origin, end)
+        if end > start:
+            offset, length = new_index.to_entity_span(start, end)
+            remapped.append({**entity, "offset": offset, "length": length})
+    return stripped, remapped
@@ -0,0 +1,105 @@
+"""Per-request debug trace kept in a fixed-size ring buffer.
+
+The hot path only appends (timestamp, trace id, event name, fields) tuples;
+nothing is formatted or written until a trace is dumped: on an error, on a
+lost link token, or on demand with /trace.
+
+    with start_trace("forward"):
+        event("link.extracted", kind="text_link", url=url)
+        ...
+        dump("token lost")   # writes this request's events to the log
+"""
+import time
+import logging
+import functools
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_log = logging.getLogger(__name__)
+
+VALUE_LIMIT = 300  # chars per field value in a dump
+
+_ids = itertools.count(1)
+current_trace: ContextVar[str | None] = ContextVar("current_trace", default=None)
+
+
+class TraceRecorder:
+    def __init__(self, capacity: int = 5000):
+        self._events: deque[tuple] = deque(maxlen=capacity)
+
+    def configure(self, capacity: int) -> None:
+        self._events = deque(self._events, maxlen=capacity)
+
+    def event(self, name: str, fields: dict) -> None:
+        self._events.append((time.time(), current_trace.get(), name, fields))
+
+    def trace_ids(self) -> list[str]:
+        """Trace ids still (at least partly) in the buffer, oldest first."""
+        return list(dict.fromkeys(e[1] for e in self._events if e[1] is not None))
+
+    def format(self, trace_id: str | None = None) -> list[str]:
+        """Formatted events of one trace (or the whole buffer)."""
+        return [
+            _format(ts, tid, name, fields)
+            for ts, tid, name, fields in list(self._events)
+            if trace_id is None or tid == trace_id
+        ]
+
+
+def _value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) > VALUE_LIMIT:
+        text = text[:VALUE_LIMIT] + "…"
+    return text.replace("\n", "⏎")
+
+
+def _format(ts: float, trace_id: str | None, name: str, fields: dict) -> str:
+    stamp = time.strftime("%H:%M:%S", time.localtime(ts)) + f".{int(ts % 1 * 1000):03d}"
+    details = " ".join(f"{key}={_value(value)}" for key, value in fields.items())
+    return f"{stamp} [{trace_id or '-'}] {name} {details}".rstrip()
+
+
+recorder = TraceRecorder()
+
+
+@contextmanager
+def start_trace(label: str):
+    """Give everything recorded in this context (and tasks it spawns) one trace id."""
+    token = current_trace.set(f"{label}-{next(_ids)}")
+    try:
+        yield current_trace.get()
+    finally:
+        current_trace.reset(token)
+
+
+def traced(label: str):
+    """Run an async handler inside its own trace (aiogram still sees the original signature).
+
+    A trace opened earlier for the same update (e.g. by AlbumMiddleware) is kept.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if current_trace.get() is not None:
+                return await func(*args, **kwargs)
+            with start_trace(label):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def event(name: str, **fields) -> None:
+    recorder.event(name, fields)
+
+
+def dump(reason: str, trace_id: str | None = None) -> None:
+    """Write one trace (the current one by default) to the log."""
+    trace_id = trace_id or current_trace.get()
+    if trace_id is None:
+        return
+    lines = recorder.format(trace_id)
+    _log.warning(f"[TRACE] {trace_id} dumped ({reason}), {len(lines)} event(s):\n" + "\n".join(lines))
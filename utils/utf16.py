@@ -0,0 +1,51 @@
+import re
+import operator
+from array import array
+from bisect import bisect_left
+
+# Characters outside the BMP take two UTF-16 code units (a surrogate pair)
+ASTRAL = re.compile('[\U00010000-\U0010FFFF]')
+
+
+def utf16_len(text: str) -> int:
+    """Length of text in UTF-16 code units, the unit of Telegram entity offsets."""
+    return len(text) + sum(1 for _ in ASTRAL.finditer(text))
+
+
+class Utf16Index:
+    """Code point <-> UTF-16 offset conversion for one text.
+
+    Only astral characters (most emoji) shift the two scales apart, so the
+    index keeps just their positions in two sorted arrays: one conversion is
+    a bisect over the astral characters, and plain text costs nothing.
+    Built once per text; the text must not change afterwards.
+    """
+
+    __slots__ = ("length", "utf16_length", "_astral", "_astral_utf16")
+
+    def __init__(self, text: str):
+        self._astral = array("I", map(re.Match.start, ASTRAL.finditer(text)))
+        # UTF-16 offset of each astral character: its code point index + astral characters before it
+        self._astral_utf16 = array("I", map(operator.add, self._astral, range(len(self._astral))))
+        self.length = len(text)
+        self.utf16_length = len(text) + len(self._astral)
+
+    def to_utf16(self, index: int) -> int:
+        if not self._astral:
+            return index
+        return index + bisect_left(self._astral, index)
+
+    def to_codepoint(self, offset: int) -> int:
+        """Code point index for a UTF-16 offset (an offset inside a surrogate pair maps to its character)."""
+        if not self._astral:
+            return offset
+        return offset - bisect_left(self._astral_utf16, offset)
+
+    def to_codepoints(self, offset: int, length: int) -> tuple[int, int]:
+        """Telegram (offset, length) -> Python slice (start, end)."""
+        return self.to_codepoint(offset), self.to_codepoint(offset + length)
+
+    def to_entity_span(self, start: int, end: int) -> tuple[int, int]:
+        """Python slice (start, end) -> Telegram (offset, length)."""
+        offset = self.to_utf16(start)
+        return offset, self.to_utf16(end) - offset
@@ -0,0 +1,57 @@
+"""Bounded history of rewrite variants kept in FSM data.
+
+A variant is stored as a plain list, [text, entities, model, rewrite_seconds],
+with each entity packed as [type, offset, length, url]: FSM storages
+serialize the whole draft on every update, so key names are not repeated.
+"""
+
+ENTITY_FIELDS = ("type", "offset", "length", "url")
+
+
+def _pack_entities(entities: list[dict]) -> list[list]:
+    return [[e["type"], e["offset"], e["length"], e.get("url")] for e in entities]
+
+
+def _unpack_entities(packed: list[list]) -> list[dict]:
+    entities = []
+    for values in packed:
+        entity = dict(zip(ENTITY_FIELDS, values))
+        if entity["url"] is None:
+            del entity["url"]
+        entities.append(entity)
+    return entities
+
+
+def push_variant(data: dict, text: str, entities: list[dict], model: str | None = None,
+                 rewrite_seconds: float | None = None, limit: int = 5, reset: bool = False) -> dict:
+    """FSM updates that append a variant and make it current.
+
+    An identical text moves to the end instead of being stored twice; the
+    oldest variants are evicted beyond `limit`. reset=True starts a new draft.
+    """
+    variants = [] if reset else [v for v in data.get("variants", []) if v[0] != text]
+    variants.append([text, _pack_entities(entities), model, rewrite_seconds])
+    variants = variants[-max(1, limit):]
+    return {
+        "variants": variants,
+        "variant_idx": len(variants) - 1,
+        "generated_text": text,
+        "generated_entities": entities,
+        "model": model,
+        "rewrite_seconds": rewrite_seconds,
+    }
+
+
+def select_variant(data: dict, idx: int) -> dict | None:
+    """FSM updates that make variant `idx` current, or None if it doesn't exist."""
+    variants = data.get("variants", [])
+    if not 0 <= idx < len(variants):
+        return None
+    text, entities, model, rewrite_seconds = variants[idx]
+    return {
+        "variant_idx": idx,
+        "generated_text": text,
+        "generated_entities": _unpack_entities(entities),
+        "model": model,
+        "rewrite_seconds": rewrite_seconds,
+    }